@@ -1,3 +1,4 @@
+import sys
 from dataclasses import dataclass
 from typing import List
 from collections import defaultdict
@@ -53,9 +54,10 @@ def task1_functional():
     manufacturer_dict = {m.manufacturer_id: m for m in manufacturers}
 
     print("=== ЗАПРОС 1 (функциональный): Детали и производители ===")
-    [print(f"Производитель: {manufacturer_dict[d.manufacturer_id].manufacturer_name} -> "
-           f"Деталь: {d.detail_name}, Цена: {d.price} руб.")
-     for d in sorted(details, key=lambda x: (x.manufacturer_id, x.detail_id))]
+    sys.stdout.writelines(
+        f"Производитель: {manufacturer_dict[d.manufacturer_id].manufacturer_name} -> "
+        f"Деталь: {d.detail_name}, Цена: {d.price} руб.\n"
+        for d in sorted(details, key=lambda x: (x.manufacturer_id, x.detail_id)))
     print()
 
 def task2_functional():
@@ -65,8 +67,9 @@ def task2_functional():
         price_totals[detail.manufacturer_id] += detail.price
 
     print("=== ЗАПРОС 2 (функциональный): Суммарная стоимость ===")
-    [print(f"Производитель: {m.manufacturer_name}, Суммарная стоимость: {price_totals[m.manufacturer_id]:.2f} руб.")
-     for m in sorted(manufacturers, key=lambda x: price_totals[x.manufacturer_id], reverse=True)]
+    sys.stdout.writelines(
+        f"Производитель: {m.manufacturer_name}, Суммарная стоимость: {price_totals[m.manufacturer_id]:.2f} руб.\n"
+        for m in sorted(manufacturers, key=lambda x: price_totals[x.manufacturer_id], reverse=True))
     print()
 
 def task3_functional():
@@ -79,7 +82,7 @@ def task3_functional():
     detail_dict = {d.detail_id: d for d in details}
 
     print("=== ЗАПРОС 3 (функциональный): Производители с 'отдел' в названии ===")
-    department_manufacturers = filter(lambda m: "отдел" in m.manufacturer_name.lower(), manufacturers)
+    department_manufacturers = filter(lambda m: "отдел" in m.manufacturer_name.casefold(), manufacturers)
 
     for manufacturer in department_manufacturers:
         print(f"\nПроизводитель: {manufacturer.manufacturer_name}")
@@ -87,7 +90,8 @@ def task3_functional():
         manufacturer_details_list = [detail_dict[did] for did in detail_ids if did in detail_dict]
 
         if manufacturer_details_list:
-            [print(f"  - Деталь: {d.detail_name}, Цена: {d.price} руб.") for d in manufacturer_details_list]
+            sys.stdout.writelines(f"  - Деталь: {d.detail_name}, Цена: {d.price} руб.\n"
+                                  for d in manufacturer_details_list)
         else:
             print("  - Нет деталей")
     print()
@@ -0,0 +1,232 @@
+"""
+Обмен каталогом и результатами запросов в форматах Apache Arrow и Parquet
+Таблицы строятся по столбцам: числа собираются в типизированные массивы
+и передаются в Arrow без копирования, кортежи строк не создаются.
+Формат файла определяется расширением: .arrow - IPC файл, .arrows - IPC
+поток, .parquet - Parquet
+"""
+
+import gc
+import os
+import sys
+from array import array
+from contextlib import contextmanager
+from itertools import repeat
+from operator import attrgetter
+from typing import Dict, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from refactored_manufacturing import (
+    Manufacturer,
+    Detail,
+    ManufacturerDetail,
+    ManufacturingService,
+    Relation
+)
+
+SCHEMAS = {
+    "manufacturers": pa.schema([("manufacturer_id", pa.int64()),
+                                ("manufacturer_name", pa.string())]),
+    "details": pa.schema([("detail_id", pa.int64()), ("detail_name", pa.string()),
+                          ("price", pa.float64()), ("manufacturer_id", pa.int64())]),
+    "links": pa.schema([("manufacturer_id", pa.int64()), ("detail_id", pa.int64())]),
+}
+RECORD_TYPES = {"manufacturers": Manufacturer, "details": Detail, "links": ManufacturerDetail}
+FORMATS = {".arrow": "file", ".arrows": "stream", ".parquet": "parquet"}
+
+_TYPECODES = {pa.int64(): "q", pa.float64(): "d"}
+
+
+def _column(records: List, field: str, arrow_type: pa.DataType) -> pa.Array:
+    """Столбец поля записей; числа передаются буфером array без копирования"""
+    values = map(attrgetter(field), records)
+    typecode = _TYPECODES.get(arrow_type)
+    if typecode is None:
+        return pa.array(list(values), type=arrow_type)
+    buffer = array(typecode, values)
+    if sys.byteorder != "little":
+        buffer.byteswap()
+    return pa.Array.from_buffers(arrow_type, len(buffer), [None, pa.py_buffer(buffer)])
+
+
+def records_table(records: List, schema: pa.Schema) -> pa.Table:
+    """Таблица Arrow по списку записей с полями схемы"""
+    return pa.Table.from_arrays([_column(records, field.name, field.type) for field in schema],
+                                schema=schema)
+
+
+def catalog_tables(service: ManufacturingService) -> Dict[str, pa.Table]:
+    """Таблицы производителей, деталей и связей в порядке сервиса"""
+    return {
+        "manufacturers": records_table(service.manufacturers, SCHEMAS["manufacturers"]),
+        "details": records_table(service.details, SCHEMAS["details"]),
+        "links": records_table(service.manufacturer_details, SCHEMAS["links"]),
+    }
+
+
+def details_by_manufacturer_table(service: ManufacturingService,
+                                  relation: Relation = Relation.OWNERSHIP) -> pa.Table:
+    """Запрос 1 таблицей (manufacturer_name, detail_name, price)
+
+    Название производителя - словарный столбец: одно значение на группу
+    и индекс int32 на строку.
+    """
+    groups = list(service.iter_sorted_detail_groups(relation))
+    names = [manufacturer.manufacturer_name for manufacturer, _ in groups]
+    details = [detail for _, group in groups for detail in group]
+    indices = array("i")
+    for position, (_, group) in enumerate(groups):
+        indices.extend(repeat(position, len(group)))
+    if sys.byteorder != "little":
+        indices.byteswap()
+    manufacturer_names = pa.DictionaryArray.from_arrays(
+        pa.Array.from_buffers(pa.int32(), len(indices), [None, pa.py_buffer(indices)]),
+        pa.array(names, type=pa.string()))
+    return pa.Table.from_arrays(
+        [manufacturer_names, _column(details, "detail_name", pa.string()),
+         _column(details, "price", pa.float64())],
+        names=["manufacturer_name", "detail_name", "price"])
+
+
+def total_price_by_manufacturer_table(service: ManufacturingService,
+                                      relation: Relation = Relation.OWNERSHIP) -> pa.Table:
+    """Запрос 2 таблицей (manufacturer_name, total_price); строк столько, сколько производителей"""
+    rows = service.get_total_price_by_manufacturer(relation)
+    names, totals = zip(*rows) if rows else ((), ())
+    return pa.Table.from_arrays([pa.array(names, type=pa.string()),
+                                 pa.array(totals, type=pa.float64())],
+                                names=["manufacturer_name", "total_price"])
+
+
+def _file_format(path: str) -> str:
+    format_name = FORMATS.get(os.path.splitext(path)[1])
+    if format_name is None:
+        raise ValueError(f"Неизвестный формат файла: {path}")
+    return format_name
+
+
+def write_table(table: pa.Table, path: str, batch_size: int = 1 << 16) -> None:
+    """Записывает таблицу пакетами (группами строк) по batch_size строк"""
+    format_name = _file_format(path)
+    if format_name == "parquet":
+        pq.write_table(table, path, row_group_size=batch_size)
+        return
+    new_writer = pa.ipc.new_file if format_name == "file" else pa.ipc.new_stream
+    with pa.OSFile(path, "wb") as sink, new_writer(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=batch_size)
+
+
+def read_table(path: str) -> pa.Table:
+    """Читает таблицу; IPC файл отображается в память, и буферы не копируются"""
+    format_name = _file_format(path)
+    if format_name == "parquet":
+        return pq.read_table(path, memory_map=True)
+    with pa.memory_map(path) as source:
+        if format_name == "file":
+            return pa.ipc.open_file(source).read_all()
+        return pa.ipc.open_stream(source).read_all()
+
+
+def export_catalog(service: ManufacturingService, directory: str,
+                   suffix: str = ".parquet", batch_size: int = 1 << 16) -> Dict[str, str]:
+    """Записывает таблицы каталога в directory, возвращает пути по именам таблиц"""
+    _file_format(os.path.join(directory, "manufacturers" + suffix))
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, table in catalog_tables(service).items():
+        paths[name] = os.path.join(directory, name + suffix)
+        write_table(table, paths[name], batch_size)
+    return paths
+
+
+def _conform(name: str, table: pa.Table) -> pa.Table:
+    """Столбцы таблицы каталога в порядке и с типами схемы"""
+    schema = SCHEMAS[name]
+    missing = [field.name for field in schema if field.name not in table.column_names]
+    if missing:
+        raise ValueError(f"В таблице {name} нет столбцов: {', '.join(missing)}")
+    table = table.select(schema.names).cast(schema)
+    for column_name, column in zip(schema.names, table.columns):
+        if column.null_count:
+            raise ValueError(f"В таблице {name} пустые значения в столбце {column_name}")
+    return table
+
+
+def _values(column: pa.ChunkedArray) -> list:
+    """Значения столбца списком; числа читаются из буфера через memoryview"""
+    typecode = _TYPECODES.get(column.type)
+    if typecode is None or sys.byteorder != "little":
+        return column.to_pylist()
+    values = []
+    for chunk in column.chunks:
+        if not len(chunk):
+            continue
+        data = memoryview(chunk.buffers()[1]).cast(typecode)
+        values += data[chunk.offset:chunk.offset + len(chunk)].tolist()
+    return values
+
+
+def table_records(name: str, table: pa.Table) -> list:
+    """Записи таблицы каталога name (manufacturers, details или links)"""
+    table = _conform(name, table)
+    return list(map(RECORD_TYPES[name], *map(_values, table.columns)))
+
+
+@contextmanager
+def _gc_paused():
+    """Отключает циклический сборщик мусора: при создании миллионов записей
+    он многократно обходит их все, хотя циклов среди них нет"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def service_from_tables(tables: Dict[str, pa.Table], **service_options) -> ManufacturingService:
+    """Создает ManufacturingService по таблицам каталога"""
+    with _gc_paused():
+        return ManufacturingService(table_records("manufacturers", tables["manufacturers"]),
+                                    table_records("details", tables["details"]),
+                                    table_records("links", tables["links"]),
+                                    **service_options)
+
+
+def columnar_service_from_tables(tables: Dict[str, pa.Table]):
+    """Создает ColumnarManufacturingService; числовые столбцы не копируются
+
+    Названия кодируются словарем Arrow, в таблицу строк попадают
+    только различные значения.
+    """
+    import numpy as np
+    from columnar_storage import ColumnarManufacturingService, StringTable
+
+    tables = {name: _conform(name, table).combine_chunks() for name, table in tables.items()}
+    strings = StringTable()
+
+    def numbers(table: pa.Table, column: str) -> np.ndarray:
+        return table.column(column).to_numpy()
+
+    def codes(table: pa.Table, column: str) -> np.ndarray:
+        encoded = table.column(column).dictionary_encode().combine_chunks()
+        mapping = strings.intern_many(encoded.dictionary.to_pylist())
+        return mapping[encoded.indices.to_numpy(zero_copy_only=False)]
+
+    manufacturers, details, links = tables["manufacturers"], tables["details"], tables["links"]
+    return ColumnarManufacturingService.from_arrays(
+        strings,
+        numbers(manufacturers, "manufacturer_id"), codes(manufacturers, "manufacturer_name"),
+        numbers(details, "detail_id"), codes(details, "detail_name"),
+        numbers(details, "price"), numbers(details, "manufacturer_id"),
+        numbers(links, "manufacturer_id"), numbers(links, "detail_id"))
+
+
+def import_catalog(directory: str, suffix: str = ".parquet",
+                   **service_options) -> ManufacturingService:
+    """Создает ManufacturingService по таблицам, записанным export_catalog"""
+    return service_from_tables({name: read_table(os.path.join(directory, name + suffix))
+                                for name in SCHEMAS}, **service_options)
@@ -0,0 +1,201 @@
+"""
+Асинхронный фасад ManufacturingService для веб-слоя
+Запросы выполняются в пуле потоков, одинаковые одновременные запросы
+объединяются в одно вычисление, а число вычислений ограничено
+Запуск нагрузочного теста: python async_service.py [--clients N]
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import Executor
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, List, Mapping, Optional, Tuple, TypeVar
+
+from refactored_manufacturing import ManufacturingService, Relation
+
+Result = TypeVar("Result")
+
+
+class ServiceOverloadedError(RuntimeError):
+    """Очередь ожидающих вычислений переполнена"""
+
+
+def _freeze_result(result):
+    """Неизменяемый результат, общий для всех ожидающих: кортежи и
+    MappingProxyType, как в query_cache; строится в потоке вычисления"""
+    if isinstance(result, dict):
+        return MappingProxyType({key: tuple(value) for key, value in result.items()})
+    return tuple(result)
+
+
+class AsyncManufacturingService:
+    """Асинхронные запросы к сервису
+
+    Одинаковые запросы, пришедшие во время вычисления или в течение
+    coalesce_window секунд до его начала, получают результат одного
+    вычисления (single-flight) - один и тот же неизменяемый объект
+    (кортеж строк, для запроса 3 - MappingProxyType с кортежами), поэтому
+    цикл событий не копирует результат для каждого ожидающего. Одновременно
+    выполняется не больше max_concurrency вычислений; если ожидающих
+    вычислений больше max_pending, запрос отклоняется с
+    ServiceOverloadedError. Отмена запроса не отменяет общее вычисление:
+    остальные ожидающие получают результат. Изменять данные нужно через
+    apply(): он дожидается завершения текущих вычислений, в том числе
+    начатых отмененными запросами.
+    """
+
+    def __init__(self, service: ManufacturingService,
+                 executor: Optional[Executor] = None,
+                 max_concurrency: int = 4,
+                 max_pending: Optional[int] = None,
+                 coalesce_window: float = 0.0,
+                 single_flight: bool = True):
+        self.service = service
+        self.executor = executor
+        self.max_pending = max_pending
+        self.coalesce_window = coalesce_window
+        self.single_flight = single_flight
+        self.computations = 0
+        self.coalesced = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._pending = 0
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+
+    async def _query(self, key: Hashable, compute: Callable[[], Result]) -> Result:
+        if self.single_flight:
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                self.coalesced += 1
+                return await asyncio.shield(shared)
+
+        if self.max_pending is not None and self._pending >= self.max_pending:
+            raise ServiceOverloadedError(f"ожидают {self._pending} вычислений")
+
+        # Вычисление - отдельная задача: отмена любого из ожидающих, в том
+        # числе первого, не отменяет его для остальных
+        self._pending += 1
+        task = asyncio.ensure_future(self._compute(lambda: _freeze_result(compute())))
+        task.add_done_callback(lambda done: self._finish(key, done))
+        if self.single_flight:
+            self._in_flight[key] = task
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        self._pending -= 1
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Ошибку получат ожидающие; если все отменены, она не считается потерянной
+            task.exception()
+
+    async def _compute(self, compute: Callable[[], Result]) -> Result:
+        if self.coalesce_window:
+            await asyncio.sleep(self.coalesce_window)
+        return await self._read(compute)
+
+    async def _read(self, compute: Callable[[], Result]) -> Result:
+        async with self._semaphore:
+            async with self._condition:
+                await self._condition.wait_for(lambda: not self._writing)
+                self._readers += 1
+            future = None
+            try:
+                self.computations += 1
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self.executor, compute)
+                return await asyncio.shield(future)
+            finally:
+                # Поток нельзя прервать: слот читателя освобождается только
+                # после завершения вычисления, иначе apply() изменит данные
+                # во время чтения
+                while future is not None and not future.done():
+                    try:
+                        await asyncio.wait([future])
+                    except asyncio.CancelledError:
+                        pass
+                async with self._condition:
+                    self._readers -= 1
+                    self._condition.notify_all()
+
+    async def apply(self, mutation: Callable[[ManufacturingService], Any]) -> Any:
+        """Выполняет изменение данных, когда нет текущих вычислений"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing)
+            self._writing = True
+            try:
+                await self._condition.wait_for(lambda: self._readers == 0)
+                return mutation(self.service)
+            finally:
+                self._writing = False
+                self._condition.notify_all()
+
+    async def get_details_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                          ) -> Tuple[Tuple[str, str, float], ...]:
+        """Запрос 1"""
+        return await self._query(("details_by_manufacturer", relation),
+                                 lambda: self.service.get_details_by_manufacturer(relation))
+
+    async def get_total_price_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                              ) -> Tuple[Tuple[str, float], ...]:
+        """Запрос 2"""
+        return await self._query(("total_price_by_manufacturer", relation),
+                                 lambda: self.service.get_total_price_by_manufacturer(relation))
+
+    async def get_department_manufacturers_with_details(self, relation: Relation = Relation.LINKS
+                                                        ) -> Mapping[str, Tuple[Tuple[str, float], ...]]:
+        """Запрос 3"""
+        return await self._query(
+            ("department_manufacturers_with_details", relation),
+            lambda: self.service.get_department_manufacturers_with_details(relation))
+
+
+async def run_load(facade: AsyncManufacturingService, clients: int,
+                   requests_per_client: int, pause: float = 0.001) -> List[float]:
+    """Нагрузка: clients клиентов по requests_per_client запросов 2, задержки в секундах"""
+    latencies: List[float] = []
+
+    async def client():
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            await facade.get_total_price_by_manufacturer()
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(pause)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies
+
+
+def main() -> None:
+    from benchmark import make_catalog
+    from benchmark_suite import percentile
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--details", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5)
+    args = parser.parse_args()
+
+    service = ManufacturingService(*make_catalog(args.details))
+    print(f"{'single-flight':>14} {'запросов':>9} {'вычислений':>11} "
+          f"{'p50, мс':>9} {'p99, мс':>9} {'время, с':>9}")
+    for single_flight in (False, True):
+        async def scenario():
+            facade = AsyncManufacturingService(service, single_flight=single_flight,
+                                               coalesce_window=0.002)
+            started = time.perf_counter()
+            latencies = await run_load(facade, args.clients, args.requests)
+            return facade, latencies, time.perf_counter() - started
+
+        facade, latencies, elapsed = asyncio.run(scenario())
+        print(f"{str(single_flight):>14} {len(latencies):>9} {facade.computations:>11} "
+              f"{percentile(latencies, 0.5) * 1000:>9.1f} "
+              f"{percentile(latencies, 0.99) * 1000:>9.1f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
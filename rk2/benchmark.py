@@ -0,0 +1,742 @@
+"""
+Бенчмарки производительности ManufacturingService
+Запуск: python benchmark.py [--sizes N ...] [имя бенчмарка ...]
+"""
+
+import argparse
+import random
+import time
+import timeit
+import tracemalloc
+from typing import List, Tuple
+
+from refactored_manufacturing import (
+    Manufacturer,
+    Detail,
+    ManufacturerDetail,
+    ManufacturingService,
+    Relation
+)
+from synthetic_data import generate_catalog
+
+
+def make_catalog(detail_count: int, details_per_manufacturer: int = 10
+                 ) -> Tuple[List[Manufacturer], List[Detail], List[ManufacturerDetail]]:
+    """Создает каталог заданного размера с одной связью на деталь"""
+    return generate_catalog(
+        manufacturer_count=max(1, detail_count // details_per_manufacturer),
+        details_per_manufacturer=details_per_manufacturer)
+
+
+def _per_call_us(func, number: int) -> float:
+    """Среднее время одного вызова в микросекундах"""
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def benchmark_index_lookups(sizes: List[int]) -> None:
+    """Стоимость поиска по индексам в сравнении с пересборкой словарей"""
+    print("=== Поиск по индексам ===")
+    print(f"{'деталей':>10} {'пересборка, мкс':>16} {'get_detail, мкс':>16} "
+          f"{'get_manufacturer, мкс':>22}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        detail_id = size // 2
+        manufacturer_id = service.get_detail(detail_id).manufacturer_id
+
+        rebuild = _per_call_us(
+            lambda: {d.detail_id: d for d in service.details}, number=5)
+        detail_lookup = _per_call_us(
+            lambda: service.get_detail(detail_id), number=100000)
+        manufacturer_lookup = _per_call_us(
+            lambda: service.get_manufacturer(manufacturer_id), number=100000)
+
+        print(f"{size:>10} {rebuild:>16.2f} {detail_lookup:>16.3f} "
+              f"{manufacturer_lookup:>22.3f}")
+    print()
+
+
+def benchmark_incremental_totals(sizes: List[int]) -> None:
+    """Запрос 2 с полным пересчетом и с инкрементальными суммами"""
+    print("=== Инкрементальные суммы (запрос 2) ===")
+    print(f"{'деталей':>10} {'пересчет, мс':>13} {'инкр., мс':>10} "
+          f"{'top-10, мкс':>12} {'переоценка, мкс':>16}")
+    for size in sizes:
+        data = make_catalog(size)
+        full_scan = ManufacturingService(*data)
+        incremental = ManufacturingService(*data, incremental_totals=True)
+        rng = random.Random(size)
+        detail_ids = [rng.randint(1, size) for _ in range(1000)]
+
+        def reprice():
+            old = incremental.get_detail(detail_ids[rng.randrange(1000)])
+            incremental.update_detail(
+                Detail(old.detail_id, old.detail_name, old.price + 1.0, old.manufacturer_id))
+
+        full_ms = _per_call_us(full_scan.get_total_price_by_manufacturer, number=3) / 1000
+        incremental_ms = _per_call_us(incremental.get_total_price_by_manufacturer, number=3) / 1000
+        top_us = _per_call_us(lambda: incremental.get_top_manufacturers_by_total(10), number=1000)
+        reprice_us = _per_call_us(reprice, number=1000)
+
+        print(f"{size:>10} {full_ms:>13.2f} {incremental_ms:>10.2f} "
+              f"{top_us:>12.2f} {reprice_us:>16.2f}")
+    print()
+
+
+def benchmark_name_search(sizes: List[int]) -> None:
+    """Поиск производителей по подстроке: триграммы против полного перебора"""
+    print("=== Поиск производителей по подстроке ===")
+    print(f"{'деталей':>10} {'производителей':>15} {'перебор, мкс':>13} {'триграммы, мкс':>15}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        manufacturers = service.manufacturers
+        # Редкая подстрока: кандидатов мало, полный перебор смотрит все названия
+        substring = f"Отдел {len(manufacturers) // 2 + 1}1"
+
+        scan_us = _per_call_us(
+            lambda: [m for m in manufacturers
+                     if substring.lower() in m.manufacturer_name.lower()], number=5)
+        index_us = _per_call_us(lambda: service.find_manufacturers(substring), number=100)
+        print(f"{size:>10} {len(manufacturers):>15} {scan_us:>13.1f} {index_us:>15.1f}")
+    print()
+
+
+def _first_page(make_rows, size: int = 20):
+    """Время и пиковая память (по tracemalloc) получения первой страницы"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = list(make_rows())[:size]
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def benchmark_lazy_queries(sizes: List[int]) -> None:
+    """Первая страница запросов: полные списки против ленивых итераторов"""
+    print("=== Первая страница (20 строк) ===")
+    print(f"{'деталей':>10} {'запрос':>7} {'полный, мс':>11} {'пик, МБ':>8} "
+          f"{'ленивый, мс':>12} {'пик, МБ':>8}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        queries = [
+            ("1", service.get_details_by_manufacturer,
+             lambda: service.iter_details_by_manufacturer(limit=20)),
+            ("2", service.get_total_price_by_manufacturer,
+             lambda: service.iter_total_price_by_manufacturer(limit=20)),
+            ("3", lambda: list(service.get_department_manufacturers_with_details().items()),
+             lambda: service.iter_department_manufacturers_with_details(limit=20)),
+        ]
+        for label, eager, lazy in queries:
+            eager_rows, eager_time, eager_peak = _first_page(eager)
+            lazy_rows, lazy_time, lazy_peak = _first_page(lazy)
+            assert eager_rows == lazy_rows
+            print(f"{size:>10} {label:>7} {eager_time * 1000:>11.2f} {eager_peak / 2 ** 20:>8.2f} "
+                  f"{lazy_time * 1000:>12.2f} {lazy_peak / 2 ** 20:>8.2f}")
+    print()
+
+
+def benchmark_sharded_queries(sizes: List[int], shard_counts=(1, 2, 4, 8)) -> None:
+    """Запросы 1 и 2 в пуле процессов в сравнении с последовательными"""
+    from parallel_queries import ShardedQueryExecutor
+
+    print("=== Параллельные запросы по шардам ===")
+    print(f"{'деталей':>10} {'шардов':>7} {'запрос 1, мс':>13} {'запрос 2, мс':>13}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        query1_ms = _per_call_us(service.get_details_by_manufacturer, number=1) / 1000
+        query2_ms = _per_call_us(service.get_total_price_by_manufacturer, number=1) / 1000
+        print(f"{size:>10} {'-':>7} {query1_ms:>13.1f} {query2_ms:>13.1f}")
+
+        for shard_count in shard_counts:
+            with ShardedQueryExecutor(service, shard_count=shard_count) as executor:
+                executor.get_total_price_by_manufacturer()  # запуск процессов
+                query1_ms = _per_call_us(executor.get_details_by_manufacturer, number=1) / 1000
+                query2_ms = _per_call_us(executor.get_total_price_by_manufacturer, number=1) / 1000
+            print(f"{size:>10} {shard_count:>7} {query1_ms:>13.1f} {query2_ms:>13.1f}")
+    print()
+
+
+def benchmark_query_cache(sizes: List[int]) -> None:
+    """Повторные запросы 2 и 3 через кэш и без него"""
+    from query_cache import CachedManufacturingService
+
+    print("=== Кэш запросов ===")
+    print(f"{'деталей':>10} {'запрос':>7} {'без кэша, мкс':>14} {'из кэша, мкс':>13}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        cached = CachedManufacturingService(service)
+        for label, direct, through_cache in (
+                ("2", service.get_total_price_by_manufacturer,
+                 cached.get_total_price_by_manufacturer),
+                ("3", service.get_department_manufacturers_with_details,
+                 cached.get_department_manufacturers_with_details)):
+            direct_us = _per_call_us(direct, number=3)
+            through_cache()  # первый вызов заполняет кэш
+            cached_us = _per_call_us(through_cache, number=1000)
+            print(f"{size:>10} {label:>7} {direct_us:>14.1f} {cached_us:>13.2f}")
+    print()
+
+
+def benchmark_record_types(sizes: List[int]) -> None:
+    """Байт на запись и скорость создания для вариантов записей"""
+    from compact_records import (
+        FrozenDetail, FrozenManufacturerDetail, NamePool,
+        SlottedDetail, SlottedManufacturerDetail
+    )
+
+    print("=== Варианты записей ===")
+    print(f"{'записей':>10} {'тип':<26} {'байт/запись':>12} {'тыс. записей/с':>15}")
+    for size in sizes:
+        pool = NamePool()
+        # Названия создаются заново для каждой записи, как при разборе выгрузки
+        variants = [
+            ("Detail", lambda: [Detail(i, f"Деталь {i % 1000}", 1.5, i) for i in range(size)]),
+            ("SlottedDetail",
+             lambda: [SlottedDetail(i, f"Деталь {i % 1000}", 1.5, i) for i in range(size)]),
+            ("FrozenDetail",
+             lambda: [FrozenDetail(i, f"Деталь {i % 1000}", 1.5, i) for i in range(size)]),
+            ("SlottedDetail+NamePool",
+             lambda: [SlottedDetail(i, pool.intern(f"Деталь {i % 1000}"), 1.5, i)
+                      for i in range(size)]),
+            ("ManufacturerDetail",
+             lambda: [ManufacturerDetail(i, i) for i in range(size)]),
+            ("SlottedManufacturerDetail",
+             lambda: [SlottedManufacturerDetail(i, i) for i in range(size)]),
+            ("FrozenManufacturerDetail",
+             lambda: [FrozenManufacturerDetail(i, i) for i in range(size)]),
+        ]
+        for label, build in variants:
+            records, _, memory = _measure(build)
+            del records
+            elapsed = min(timeit.repeat(build, number=1, repeat=3))
+            print(f"{size:>10} {label:<26} {memory / size:>12.1f} {size / elapsed / 1000:>15.1f}")
+    print()
+
+
+def benchmark_integrity_check(sizes: List[int]) -> None:
+    """Время проверки целостности на одну связь"""
+    from joins import check_integrity
+
+    print("=== Проверка целостности ===")
+    print(f"{'деталей':>10} {'связей':>10} {'время, с':>9} {'нс/связь':>9} {'проблем':>8}")
+    for size in sizes:
+        data = generate_catalog(manufacturer_count=max(1, size // 10),
+                                details_per_manufacturer=10, link_fanout=1.5)
+        started = time.perf_counter()
+        report = check_integrity(*data)
+        elapsed = time.perf_counter() - started
+        links = len(data[2])
+        print(f"{size:>10} {links:>10} {elapsed:>9.2f} {elapsed / links * 1e9:>9.0f} "
+              f"{sum(report.summary().values()):>8}")
+    print()
+
+
+def benchmark_snapshot_startup(sizes: List[int]) -> None:
+    """Время до первого ответа: построение сервиса против открытия снимка"""
+    import os
+    import tempfile
+    from snapshot_format import SnapshotService, write_snapshot
+
+    print("=== Снимок в mmap ===")
+    print(f"{'деталей':>10} {'файл, МБ':>9} {'сборка, мс':>11} {'открытие, мс':>13} "
+          f"{'без crc, мс':>12} {'запрос 2, мс':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            data = make_catalog(size)
+            path = os.path.join(directory, f"catalog-{size}.snap")
+            write_snapshot(ManufacturingService(*data), path)
+
+            build_ms = _per_call_us(lambda: ManufacturingService(*data), number=1) / 1000
+            open_ms = _per_call_us(lambda: SnapshotService(path).close(), number=3) / 1000
+            fast_ms = _per_call_us(lambda: SnapshotService(path, verify=False).close(),
+                                   number=3) / 1000
+            with SnapshotService(path, verify=False) as snapshot:
+                query2_ms = _per_call_us(snapshot.get_total_price_by_manufacturer,
+                                         number=1) / 1000
+            print(f"{size:>10} {os.path.getsize(path) / 2 ** 20:>9.1f} {build_ms:>11.1f} "
+                  f"{open_ms:>13.2f} {fast_ms:>12.2f} {query2_ms:>13.1f}")
+    print()
+
+
+def benchmark_change_batches(sizes: List[int], batch_sizes=(10, 100, 1000, 10000)) -> None:
+    """Стоимость пакета изменений в сравнении с пересборкой сервиса"""
+    from refactored_manufacturing import Change, ChangeKind
+
+    print("=== Пакеты изменений ===")
+    print(f"{'деталей':>10} {'пакет':>7} {'пакет, мс':>10} {'мкс/изм.':>9} "
+          f"{'инкр., мс':>10} {'пересборка, мс':>15}")
+    for size in sizes:
+        data = make_catalog(size)
+        rebuild_ms = _per_call_us(lambda: ManufacturingService(*data), number=1) / 1000
+        rng = random.Random(size)
+        for batch_size in batch_sizes:
+            services = [ManufacturingService(*data),
+                        ManufacturingService(*data, incremental_totals=True)]
+            for service in services:
+                service.get_details_by_manufacturer()  # индексы запроса 1 уже построены
+            # Переоценки, новые связи и переименования в пропорции 8:1:1
+            changes = []
+            for position in range(batch_size):
+                if position % 10 == 8:
+                    changes.append(Change(ChangeKind.INSERT, "links", ManufacturerDetail(
+                        rng.randint(1, len(data[0])), rng.randint(1, size))))
+                elif position % 10 == 9:
+                    manufacturer = data[0][rng.randrange(len(data[0]))]
+                    changes.append(Change(ChangeKind.UPDATE, "manufacturers", Manufacturer(
+                        manufacturer.manufacturer_id, f"Отдел {rng.random()}")))
+                else:
+                    old = data[1][rng.randrange(size)]
+                    changes.append(Change(ChangeKind.UPDATE, "details", Detail(
+                        old.detail_id, old.detail_name, old.price + 1.0, old.manufacturer_id)))
+            batch_ms, incremental_ms = (
+                _per_call_us(lambda: service.apply_changes(changes), number=1) / 1000
+                for service in services)
+            print(f"{size:>10} {batch_size:>7} {batch_ms:>10.2f} "
+                  f"{batch_ms * 1000 / batch_size:>9.2f} {incremental_ms:>10.2f} "
+                  f"{rebuild_ms:>15.1f}")
+    print()
+
+
+def benchmark_instrumentation(sizes: List[int]) -> None:
+    """Накладные расходы измерений на запросы 1 и 2"""
+    from instrumentation import HistogramSink, Instrumentation
+
+    print("=== Измерение запросов ===")
+    print(f"{'деталей':>10} {'запрос':>7} {'без, мкс':>10} {'с измерением, мкс':>18}")
+    for size in sizes:
+        data = make_catalog(size)
+        plain = ManufacturingService(*data)
+        measured = ManufacturingService(*data, instrumentation=Instrumentation([HistogramSink()]))
+        number = max(3, 100000 // size)
+        for label, query in (("1", "get_details_by_manufacturer"),
+                             ("2", "get_total_price_by_manufacturer")):
+            plain_us = _per_call_us(getattr(plain, query), number=number)
+            measured_us = _per_call_us(getattr(measured, query), number=number)
+            print(f"{size:>10} {label:>7} {plain_us:>10.1f} {measured_us:>18.1f}")
+    print()
+
+
+def benchmark_price_queries(sizes: List[int]) -> None:
+    """Ценовые запросы по индексу в сравнении с сортировкой всех деталей"""
+    print("=== Ценовые запросы ===")
+    print(f"{'деталей':>10} {'запрос':<22} {'перебор, мкс':>13} {'индекс, мкс':>12}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size), incremental_totals=True)
+        details = service.details
+        manufacturer_id = details[size // 2].manufacturer_id
+        threshold = service.get_top_manufacturers_by_total(10)[-1][1]
+        service.get_details_in_price_range(0, 0)  # построение индекса цен
+        queries = [
+            ("top-5 производителя",
+             lambda: sorted((d for d in details if d.manufacturer_id == manufacturer_id),
+                            key=lambda d: -d.price)[:5],
+             lambda: service.get_most_expensive_details(manufacturer_id, 5)),
+            ("цены 100.0-100.9",
+             lambda: sorted((d for d in details if 100.0 <= d.price <= 100.9),
+                            key=lambda d: d.price),
+             lambda: service.get_details_in_price_range(100.0, 100.9)),
+            ("сумма > top-10",
+             lambda: [row for row in sorted(((m.manufacturer_name,
+                                             service.get_manufacturer_stats(m.manufacturer_id)[0])
+                                            for m in service.manufacturers),
+                                           key=lambda x: x[1], reverse=True)
+                      if row[1] > threshold],
+             lambda: service.get_manufacturers_with_total_above(threshold)),
+        ]
+        for label, scan, indexed in queries:
+            scan_us = _per_call_us(scan, number=3)
+            index_us = _per_call_us(indexed, number=1000)
+            print(f"{size:>10} {label:<22} {scan_us:>13.1f} {index_us:>12.2f}")
+    print()
+
+
+def benchmark_report_rendering(sizes: List[int]) -> None:
+    """Пропускная способность вывода отчетов: print по строке против потокового вывода"""
+    import contextlib
+    import os
+    import tempfile
+    from report_renderer import FORMATS, render_reports
+
+    print("=== Вывод отчетов ===")
+    print(f"{'деталей':>10} {'способ':<16} {'МБ':>7} {'время, с':>9} {'МБ/с':>8}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+
+        def print_rows():
+            for manufacturer_name, detail_name, price in service.get_details_by_manufacturer():
+                print(f"Производитель: {manufacturer_name} -> "
+                      f"Деталь: {detail_name}, Цена: {price} руб.")
+            for manufacturer_name, total_price in service.get_total_price_by_manufacturer():
+                print(f"Производитель: {manufacturer_name}, "
+                      f"Суммарная стоимость: {total_price:.2f} руб.")
+            for manufacturer_name, details_list in \
+                    service.get_department_manufacturers_with_details().items():
+                print(f"\nПроизводитель: {manufacturer_name}")
+                for detail_name, price in details_list:
+                    print(f"  - Деталь: {detail_name}, Цена: {price} руб.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            cases = [("print text", "w", lambda sink: print_rows())]
+            cases += [(f"поток {fmt}", "wb",
+                       lambda sink, fmt=fmt: render_reports(service, sink, fmt))
+                      for fmt in FORMATS]
+            for label, mode, run in cases:
+                path = os.path.join(directory, "report")
+                encoding = "utf-8" if mode == "w" else None
+                with open(path, mode, encoding=encoding) as sink, \
+                        contextlib.redirect_stdout(sink):
+                    started = time.perf_counter()
+                    run(sink)
+                elapsed = time.perf_counter() - started
+                megabytes = os.path.getsize(path) / 2 ** 20
+                print(f"{size:>10} {label:<16} {megabytes:>7.1f} {elapsed:>9.2f} "
+                      f"{megabytes / elapsed:>8.1f}")
+    print()
+
+
+def benchmark_sqlite_backend(sizes: List[int]) -> None:
+    """Загрузка и запросы 1-3 в SQLite в сравнении с сервисом в памяти"""
+    from sqlite_backend import SQLiteManufacturingService
+
+    print("=== SQLite ===")
+    print(f"{'деталей':>10} {'хранилище':<10} {'загрузка, мс':>13} {'запрос 1, мс':>13} "
+          f"{'запрос 2, мс':>13} {'запрос 3, мс':>13}")
+    for size in sizes:
+        data = make_catalog(size)
+        number = 3 if size <= 10 ** 5 else 1
+        backends = [("память", lambda: ManufacturingService(*data)),
+                    ("sqlite", lambda: SQLiteManufacturingService(*data))]
+        for label, build in backends:
+            started = time.perf_counter()
+            service = build()
+            load_ms = (time.perf_counter() - started) * 1000
+            query_ms = [_per_call_us(query, number=number) / 1000
+                        for query in (service.get_details_by_manufacturer,
+                                      service.get_total_price_by_manufacturer,
+                                      service.get_department_manufacturers_with_details)]
+            print(f"{size:>10} {label:<10} {load_ms:>13.1f} "
+                  + " ".join(f"{ms:>13.1f}" for ms in query_ms))
+    print()
+
+
+def benchmark_fused_reports(sizes: List[int]) -> None:
+    """Запросы 1-3 одним проходом run_all_reports против трех отдельных вызовов"""
+    print("=== Все отчеты за один проход ===")
+    print(f"{'деталей':>10} {'суммы':<15} {'отдельно, мс':>13} {'один проход, мс':>16} "
+          f"{'ускорение':>10}")
+    for size in sizes:
+        data = make_catalog(size)
+        number = 3 if size <= 10 ** 5 else 1
+        for incremental_totals in (False, True):
+            service = ManufacturingService(*data, incremental_totals=incremental_totals)
+            service.run_all_reports()  # построение отсортированных ID производителей
+
+            def separate():
+                service.get_details_by_manufacturer()
+                service.get_total_price_by_manufacturer()
+                service.get_department_manufacturers_with_details()
+
+            separate_ms = min(_per_call_us(separate, number=number) for _ in range(3)) / 1000
+            fused_ms = min(_per_call_us(service.run_all_reports, number=number)
+                           for _ in range(3)) / 1000
+            label = "инкрементальные" if incremental_totals else "полный проход"
+            print(f"{size:>10} {label:<15} {separate_ms:>13.1f} {fused_ms:>16.1f} "
+                  f"{separate_ms / fused_ms:>9.2f}x")
+    print()
+
+
+def benchmark_versioned_reads(sizes: List[int], readers: int = 4, duration: float = 1.0) -> None:
+    """Чтения из потоков при постоянной записи: версии без блокировок против общей блокировки"""
+    import threading
+    from benchmark_suite import percentile
+    from refactored_manufacturing import Change, ChangeKind
+    from versioned_service import LockedManufacturingService, VersionedManufacturingService
+
+    print(f"=== Версии сервиса: {readers} читателя и писатель ===")
+    print(f"{'деталей':>10} {'сервис':<12} {'чтений/с':>10} {'p99 чтения, мкс':>16} "
+          f"{'пакетов/с':>10}")
+    for size in sizes:
+        data = make_catalog(size)
+        details = data[1]
+        for label, wrapper_type in (("блокировка", LockedManufacturingService),
+                                    ("версии", VersionedManufacturingService)):
+            wrapper = wrapper_type(ManufacturingService(*data, incremental_totals=True))
+            stop = threading.Event()
+            latencies: List[List[float]] = [[] for _ in range(readers)]
+            batches = [0]
+
+            def read(service, detail_id):
+                detail = service.get_detail(detail_id)
+                return service.get_manufacturer_stats(detail.manufacturer_id)
+
+            def reader(samples, seed):
+                rng = random.Random(seed)
+                while not stop.is_set():
+                    detail_id = rng.choice(details).detail_id
+                    started = time.perf_counter()
+                    wrapper.read(lambda service: read(service, detail_id))
+                    samples.append(time.perf_counter() - started)
+
+            def writer():
+                rng = random.Random(0)
+                while not stop.is_set():
+                    wrapper.apply_changes(
+                        Change(ChangeKind.UPDATE, "details",
+                               Detail(d.detail_id, d.detail_name, round(rng.uniform(1, 1000), 2),
+                                      d.manufacturer_id))
+                        for d in rng.sample(details, 100))
+                    batches[0] += 1
+
+            threads = [threading.Thread(target=reader, args=(samples, seed))
+                       for seed, samples in enumerate(latencies)]
+            threads.append(threading.Thread(target=writer))
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            samples = [latency for reader_samples in latencies for latency in reader_samples]
+            print(f"{size:>10} {label:<12} {len(samples) / duration:>10.0f} "
+                  f"{percentile(samples, 0.99) * 1e6:>16.1f} {batches[0] / duration:>10.1f}")
+    print()
+
+
+def benchmark_query_planner(sizes: List[int]) -> None:
+    """Запросы 1-3 методами сервиса и декларативными запросами с планировщиком"""
+    from query_planner import (details_by_manufacturer_query,
+                               manufacturers_with_details_matching_query,
+                               total_price_by_manufacturer_query)
+
+    print("=== Декларативные запросы ===")
+    print(f"{'деталей':>10} {'запрос':<14} {'метод, мс':>10} {'запрос, мс':>11} {'отношение':>10}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        number = 3 if size <= 10 ** 5 else 1
+        cases = [
+            ("1", service.get_details_by_manufacturer,
+             details_by_manufacturer_query(service)),
+            ("2", service.get_total_price_by_manufacturer,
+             total_price_by_manufacturer_query(service)),
+            ("3", service.get_department_manufacturers_with_details,
+             manufacturers_with_details_matching_query(service, "отдел")),
+            ("1 связи", lambda: service.get_details_by_manufacturer(Relation.LINKS),
+             details_by_manufacturer_query(service, Relation.LINKS)),
+            ("2 связи", lambda: service.get_total_price_by_manufacturer(Relation.LINKS),
+             total_price_by_manufacturer_query(service, Relation.LINKS)),
+        ]
+        for label, method, query in cases:
+            method()  # ленивые индексы строятся до замеров
+            query.run()
+            method_ms = min(_per_call_us(method, number=number) for _ in range(3)) / 1000
+            query_ms = min(_per_call_us(query.run, number=number) for _ in range(3)) / 1000
+            print(f"{size:>10} {label:<14} {method_ms:>10.1f} {query_ms:>11.1f} "
+                  f"{query_ms / method_ms:>9.2f}x")
+    print()
+
+def benchmark_arrow_export(sizes: List[int]) -> None:
+    """Таблицы Arrow по столбцам против списков кортежей; запись и чтение Arrow и Parquet"""
+    import os
+    import tempfile
+    import pyarrow as pa
+    import arrow_io
+
+    def from_rows(rows, names):
+        columns = zip(*rows) if rows else [()] * len(names)
+        return pa.Table.from_arrays([pa.array(column) for column in columns], names=names)
+
+    print("=== Экспорт в Arrow ===")
+    print(f"{'деталей':>10} {'таблица':<10} {'кортежи, мс':>12} {'столбцы, мс':>12} "
+          f"{'ускорение':>10}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        service.get_details_by_manufacturer()  # построение отсортированных ID производителей
+        number = 3 if size <= 10 ** 5 else 1
+        cases = [
+            ("запрос 1",
+             lambda: from_rows(service.get_details_by_manufacturer(),
+                               ["manufacturer_name", "detail_name", "price"]),
+             lambda: arrow_io.details_by_manufacturer_table(service)),
+            ("детали",
+             lambda: from_rows([(d.detail_id, d.detail_name, d.price, d.manufacturer_id)
+                                for d in service.details], arrow_io.SCHEMAS["details"].names),
+             lambda: arrow_io.records_table(service.details, arrow_io.SCHEMAS["details"])),
+        ]
+        for label, rows_build, columns_build in cases:
+            rows_ms = min(_per_call_us(rows_build, number=number) for _ in range(3)) / 1000
+            columns_ms = min(_per_call_us(columns_build, number=number) for _ in range(3)) / 1000
+            print(f"{size:>10} {label:<10} {rows_ms:>12.1f} {columns_ms:>12.1f} "
+                  f"{rows_ms / columns_ms:>9.2f}x")
+    print()
+
+    print("=== Файлы каталога ===")
+    print(f"{'деталей':>10} {'формат':<9} {'запись, мс':>11} {'чтение, мс':>11} "
+          f"{'сервис, мс':>11} {'колоночный, мс':>15} {'МБ':>8} {'строк/с':>12}")
+    for size in sizes:
+        service = ManufacturingService(*make_catalog(size))
+        rows = sum(service.get_row_counts())
+        with tempfile.TemporaryDirectory() as directory:
+            for suffix in arrow_io.FORMATS:
+                started = time.perf_counter()
+                paths = arrow_io.export_catalog(service, directory, suffix)
+                write_s = time.perf_counter() - started
+                started = time.perf_counter()
+                tables = {name: arrow_io.read_table(path) for name, path in paths.items()}
+                read_s = time.perf_counter() - started
+                started = time.perf_counter()
+                arrow_io.service_from_tables(tables)
+                build_s = time.perf_counter() - started
+                started = time.perf_counter()
+                arrow_io.columnar_service_from_tables(tables)
+                columnar_s = time.perf_counter() - started
+                megabytes = sum(os.path.getsize(path) for path in paths.values()) / 2 ** 20
+                print(f"{size:>10} {suffix:<9} {write_s * 1000:>11.1f} {read_s * 1000:>11.1f} "
+                      f"{build_s * 1000:>11.1f} {columnar_s * 1000:>15.1f} {megabytes:>8.1f} "
+                      f"{rows / (read_s + build_s):>12.0f}")
+    print()
+
+def benchmark_scenarios(sizes: List[int], count: int = 300) -> None:
+    """Пакет сценариев цен против копирования каталога и пересборки сервиса на сценарий"""
+    from scenarios import Markup, Scenario, ScenarioEngine, Surcharge
+
+    print(f"=== Сценарии цен: пакет из {count} ===")
+    print(f"{'деталей':>10} {'пересборка, сц/с':>17} {'пакет, сц/с':>12} "
+          f"{'пакет + top 10, сц/с':>21} {'полный рейтинг, сц/с':>21}")
+    for size in sizes:
+        manufacturers, details, links = make_catalog(size)
+        service = ManufacturingService(manufacturers, details, links)
+        engine = ScenarioEngine(service)
+        rng = random.Random(size)
+        manufacturer_ids = [m.manufacturer_id for m in manufacturers]
+        scenarios = [Scenario(f"сценарий {number}",
+                              [Markup(rng.choice(manufacturer_ids), 1.07),
+                               Surcharge(rng.choice(manufacturer_ids), 50.0)])
+                     for number in range(count)]
+
+        def rebuild(scenario):
+            markup, surcharge = scenario.transforms
+            linked = set(service.get_manufacturer_to_details().get(surcharge.manufacturer_id, []))
+            repriced = []
+            for d in details:
+                price = d.price * markup.factor if d.manufacturer_id == markup.manufacturer_id \
+                    else d.price
+                if d.detail_id in linked:
+                    price += surcharge.amount
+                repriced.append(Detail(d.detail_id, d.detail_name, price, d.manufacturer_id))
+            return ManufacturingService(manufacturers, repriced,
+                                        links).get_total_price_by_manufacturer()
+
+        rebuild_count = 3 if size <= 10 ** 5 else 1
+        started = time.perf_counter()
+        for scenario in scenarios[:rebuild_count]:
+            rebuild(scenario)
+        rebuild_rate = rebuild_count / (time.perf_counter() - started)
+
+        engine.evaluate_batch(scenarios[:1])  # рейтинг каталога строится один раз
+        started = time.perf_counter()
+        results = engine.evaluate_batch(scenarios)
+        batch_rate = count / (time.perf_counter() - started)
+        started = time.perf_counter()
+        for result in engine.evaluate_batch(scenarios):
+            result.top(10)
+        top_rate = count / (time.perf_counter() - started)
+        ranked_count = min(count, max(3, 10 ** 7 // size))
+        started = time.perf_counter()
+        for result in results[:ranked_count]:
+            result.ranked_totals()
+        ranked_rate = ranked_count / (time.perf_counter() - started)
+        print(f"{size:>10} {rebuild_rate:>17.2f} {batch_rate:>12.0f} {top_rate:>21.0f} "
+              f"{ranked_rate:>21.1f}")
+    print()
+
+def make_columnar_catalog(detail_count: int, details_per_manufacturer: int = 10):
+    """Создает колоночный каталог заданного размера без промежуточных объектов"""
+    import numpy as np
+    from columnar_storage import ColumnarManufacturingService, StringTable
+
+    manufacturer_count = max(1, detail_count // details_per_manufacturer)
+    strings = StringTable()
+    manufacturer_ids = np.arange(1, manufacturer_count + 1, dtype=np.int64)
+    manufacturer_name_codes = strings.intern_many(
+        f"Отдел {i}" if i % 2 else f"Производитель {i}" for i in range(1, manufacturer_count + 1))
+    detail_ids = np.arange(1, detail_count + 1, dtype=np.int64)
+    name_codes = strings.intern_many(f"Деталь {i}" for i in range(1000))
+    return ColumnarManufacturingService.from_arrays(
+        strings,
+        manufacturer_ids, manufacturer_name_codes,
+        detail_ids, name_codes[detail_ids % 1000],
+        (detail_ids % 997).astype(np.float64) + 0.5,
+        detail_ids % manufacturer_count + 1,
+        detail_ids % manufacturer_count + 1, detail_ids,
+    )
+
+
+def _measure(build):
+    """Время построения и прирост памяти (по tracemalloc) для build()"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, memory
+
+
+def benchmark_columnar(sizes: List[int], object_limit: int = 10 ** 6) -> None:
+    """Память и задержка колоночного хранилища в сравнении с объектами"""
+    print("=== Колоночное хранилище ===")
+    print(f"{'деталей':>10} {'хранилище':>10} {'память, МБ':>11} {'байт/деталь':>12} "
+          f"{'запрос 1, мс':>13} {'запрос 2, мс':>13}")
+    for size in sizes:
+        candidates = [("колонки", lambda: make_columnar_catalog(size))]
+        if size <= object_limit:
+            candidates.insert(0, ("объекты", lambda: ManufacturingService(*make_catalog(size))))
+
+        for label, build in candidates:
+            service, _, memory = _measure(build)
+            query1_ms = _per_call_us(service.get_details_by_manufacturer, number=1) / 1000
+            query2_ms = _per_call_us(service.get_total_price_by_manufacturer, number=1) / 1000
+            print(f"{size:>10} {label:>10} {memory / 2 ** 20:>11.1f} {memory / size:>12.1f} "
+                  f"{query1_ms:>13.1f} {query2_ms:>13.1f}")
+            del service
+    print()
+
+
+BENCHMARKS = {
+    "indexes": benchmark_index_lookups,
+    "totals": benchmark_incremental_totals,
+    "columnar": benchmark_columnar,
+    "search": benchmark_name_search,
+    "lazy": benchmark_lazy_queries,
+    "sharded": benchmark_sharded_queries,
+    "cache": benchmark_query_cache,
+    "records": benchmark_record_types,
+    "integrity": benchmark_integrity_check,
+    "snapshot": benchmark_snapshot_startup,
+    "changes": benchmark_change_batches,
+    "instrumentation": benchmark_instrumentation,
+    "prices": benchmark_price_queries,
+    "reports": benchmark_report_rendering,
+    "sqlite": benchmark_sqlite_backend,
+    "fused": benchmark_fused_reports,
+    "versions": benchmark_versioned_reads,
+    "planner": benchmark_query_planner,
+    "arrow": benchmark_arrow_export,
+    "scenarios": benchmark_scenarios,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"бенчмарки для запуска: {', '.join(BENCHMARKS)} (по умолчанию все)")
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+                        help="размеры каталога (количество деталей)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"неизвестный бенчмарк: {name}")
+
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args.sizes)
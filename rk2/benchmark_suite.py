@@ -0,0 +1,208 @@
+"""
+Набор тестов производительности с сохранением результатов в JSON
+и сравнением с базовыми результатами
+Запуск: python benchmark_suite.py --sizes 1000 10000 --output results.json
+        [--baseline baseline.json [--update-baseline]] [--threshold 0.25]
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Sequence
+
+from refactored_manufacturing import ManufacturingService
+from synthetic_data import generate_catalog
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rk1  # noqa: E402  (rk1.py лежит в корне репозитория)
+
+
+def percentile(samples: Sequence[float], share: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(share * len(ordered)))
+    return ordered[rank - 1]
+
+
+def measure(func: Callable[[], int], repeats: int) -> Dict[str, float]:
+    """Задержки, пропускная способность и пиковая память вызова func
+
+    func возвращает число строк результата. Как в timeit, каждый из
+    repeats замеров выполняет func loops раз (loops подбирается так,
+    чтобы замер длился не меньше 0.2 с), а задержка - время замера,
+    деленное на loops. Пиковая память измеряется отдельным запуском
+    под tracemalloc, чтобы не искажать задержки.
+    """
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    latencies = [total / loops for total in timer.repeat(repeats, loops)]
+
+    tracemalloc.start()
+    rows = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = sum(latencies) / len(latencies)
+    return {
+        "repeats": repeats,
+        "loops": loops,
+        "rows": rows,
+        "mean_s": mean,
+        "p50_s": percentile(latencies, 0.50),
+        "p90_s": percentile(latencies, 0.90),
+        "p99_s": percentile(latencies, 0.99),
+        "ops_per_s": 1 / mean if mean else math.inf,
+        "rows_per_s": rows / mean if mean else math.inf,
+        "peak_bytes": peak,
+    }
+
+
+def _rk1_case(task: Callable[[], None], data) -> Callable[[], int]:
+    """Запуск task*_functional из rk1.py на синтетических данных, вывод отбрасывается"""
+    def run() -> int:
+        original = rk1.manufacturers, rk1.details, rk1.manufacturer_details
+        rk1.manufacturers, rk1.details, rk1.manufacturer_details = data
+        try:
+            with open(os.devnull, "w", encoding="utf-8") as sink, \
+                    contextlib.redirect_stdout(sink):
+                task()
+        finally:
+            rk1.manufacturers, rk1.details, rk1.manufacturer_details = original
+        return len(data[1])
+    return run
+
+
+def benchmark_cases(data) -> Dict[str, Callable[[], int]]:
+    """Измеряемые операции для одного каталога"""
+    service = ManufacturingService(*data)
+    incremental = ManufacturingService(*data, incremental_totals=True)
+    return {
+        "service.build": lambda: ManufacturingService(*data).get_row_counts("details")[0],
+        "service.get_details_by_manufacturer":
+            lambda: len(service.get_details_by_manufacturer()),
+        "service.get_total_price_by_manufacturer":
+            lambda: len(service.get_total_price_by_manufacturer()),
+        "service.get_total_price_by_manufacturer[incremental]":
+            lambda: len(incremental.get_total_price_by_manufacturer()),
+        "service.get_top_manufacturers_by_total[10]":
+            lambda: len(service.get_top_manufacturers_by_total(10)),
+        "service.get_department_manufacturers_with_details":
+            lambda: len(service.get_department_manufacturers_with_details()),
+        "rk1.task1_functional": _rk1_case(rk1.task1_functional, data),
+        "rk1.task2_functional": _rk1_case(rk1.task2_functional, data),
+        "rk1.task3_functional": _rk1_case(rk1.task3_functional, data),
+    }
+
+
+def run_suite(sizes: List[int], repeats: int, details_per_manufacturer: int = 10,
+              link_fanout: float = 1.2, name_length: int = 32, skew: float = 1.0,
+              seed: int = 0) -> dict:
+    """Запускает все измерения для каталогов указанных размеров"""
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "details_per_manufacturer": details_per_manufacturer,
+            "link_fanout": link_fanout, "name_length": name_length,
+            "skew": skew, "seed": seed,
+        },
+        "sizes": {},
+    }
+    for size in sizes:
+        data = generate_catalog(
+            manufacturer_count=max(1, size // details_per_manufacturer),
+            details_per_manufacturer=details_per_manufacturer,
+            link_fanout=link_fanout, name_length=name_length, skew=skew, seed=seed)
+        results["sizes"][str(size)] = {
+            name: measure(case, repeats) for name, case in benchmark_cases(data).items()
+        }
+        del data
+    return results
+
+
+def compare_with_baseline(current: dict, baseline: dict, threshold: float,
+                          min_seconds: float = 0.05) -> List[str]:
+    """Описания замедлений p50 больше чем на threshold относительно базы
+
+    Операции, замер которых в базе (p50, умноженное на loops) короче
+    min_seconds, не сравниваются: их время определяется шумом
+    измерений. В базах без loops замер - один вызов.
+    """
+    regressions = []
+    for size, cases in current["sizes"].items():
+        for name, stats in cases.items():
+            reference = baseline.get("sizes", {}).get(size, {}).get(name)
+            if (reference is None
+                    or reference["p50_s"] * reference.get("loops", 1) < min_seconds):
+                continue
+            ratio = stats["p50_s"] / reference["p50_s"]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f"{name} @ {size}: p50 {stats['p50_s'] * 1000:.2f} мс, "
+                    f"база {reference['p50_s'] * 1000:.2f} мс (x{ratio:.2f})")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    """Краткая таблица результатов"""
+    print(f"{'деталей':>10}  {'операция':<56} {'p50, мс':>9} {'p99, мс':>9} "
+          f"{'строк/с':>12} {'пик, МБ':>8}")
+    for size, cases in results["sizes"].items():
+        for name, stats in cases.items():
+            print(f"{size:>10}  {name:<56} {stats['p50_s'] * 1000:>9.2f} "
+                  f"{stats['p99_s'] * 1000:>9.2f} {stats['rows_per_s']:>12.0f} "
+                  f"{stats['peak_bytes'] / 2 ** 20:>8.2f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10 ** 3, 10 ** 4, 10 ** 5],
+                        help="количества деталей (10^7 требует десятков ГБ памяти)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--details-per-manufacturer", type=int, default=10)
+    parser.add_argument("--link-fanout", type=float, default=1.2)
+    parser.add_argument("--name-length", type=int, default=32)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    parser.add_argument("--baseline", help="файл с базовыми результатами")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="записать текущие результаты в --baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="допустимое относительное замедление p50")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.repeats, args.details_per_manufacturer,
+                        args.link_fanout, args.name_length, args.skew, args.seed)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(results, stream, ensure_ascii=False, indent=2)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as stream:
+            json.dump(results, stream, ensure_ascii=False, indent=2)
+        print(f"\nБазовые результаты записаны в {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as stream:
+            baseline = json.load(stream)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print("\n✗ ЗАМЕДЛЕНИЯ ОТНОСИТЕЛЬНО БАЗЫ:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\n✓ Замедлений относительно базы нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Журнал изменений ManufacturingService
+Пакеты изменений применяются к сервису и дописываются в журнал; сервис,
+восстановленный из снимка, догоняется воспроизведением журнала с
+позиции снимка
+"""
+
+import json
+from dataclasses import asdict
+from typing import Iterable, Iterator, List, Optional
+
+from refactored_manufacturing import (
+    Manufacturer,
+    Detail,
+    ManufacturerDetail,
+    ManufacturingService,
+    Change,
+    ChangeKind
+)
+
+RECORD_TYPES = {
+    "manufacturers": Manufacturer,
+    "details": Detail,
+    "links": ManufacturerDetail,
+}
+
+
+def change_to_json(change: Change) -> str:
+    """Строка JSON Lines для изменения"""
+    record = change.record if isinstance(change.record, int) else asdict(change.record)
+    return json.dumps({"kind": change.kind.value, "table": change.table, "record": record},
+                      ensure_ascii=False)
+
+
+def change_from_json(line: str) -> Change:
+    """Изменение из строки JSON Lines"""
+    raw = json.loads(line)
+    record = raw["record"]
+    if isinstance(record, dict):
+        record = RECORD_TYPES[raw["table"]](**record)
+    return Change(ChangeKind(raw["kind"]), raw["table"], record)
+
+
+class ChangeLog:
+    """Только дополняемый журнал примененных изменений
+
+    Позиция в журнале - число записей в нем. В журнал попадают только
+    изменения, успешно примененные к сервису. Если указан path, каждый
+    пакет дописывается в файл JSON Lines.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._changes: List[Change] = []
+
+    @classmethod
+    def load(cls, path: str) -> "ChangeLog":
+        """Читает журнал из файла; новые пакеты дописываются в тот же файл"""
+        log = cls(path)
+        with open(path, encoding="utf-8") as stream:
+            log._changes = [change_from_json(line) for line in stream if line.strip()]
+        return log
+
+    def __len__(self) -> int:
+        return len(self._changes)
+
+    def __iter__(self) -> Iterator[Change]:
+        return iter(self._changes)
+
+    def apply(self, service: ManufacturingService, changes: Iterable[Change]) -> int:
+        """Применяет пакет к сервису и записывает его в журнал
+
+        При ошибке в журнал попадают изменения, примененные до нее,
+        после чего исключение передается дальше.
+        """
+        applied: List[Change] = []
+        try:
+            for change in changes:
+                service.apply_change(change)
+                applied.append(change)
+        finally:
+            self._append(applied)
+        return len(applied)
+
+    def _append(self, changes: List[Change]) -> None:
+        if not changes:
+            return
+        self._changes.extend(changes)
+        if self.path is not None:
+            with open(self.path, "a", encoding="utf-8") as stream:
+                stream.writelines(change_to_json(change) + "\n" for change in changes)
+
+    def replay(self, service: ManufacturingService, start: int = 0,
+               stop: Optional[int] = None) -> int:
+        """Применяет к сервису записи журнала с позиции start до stop"""
+        return service.apply_changes(self._changes[start:stop])
@@ -0,0 +1,191 @@
+"""
+Колоночное хранилище каталога на массивах NumPy
+ID, цены и связи хранятся в непрерывных типизированных массивах,
+названия - в таблице интернированных строк
+"""
+
+import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from refactored_manufacturing import Manufacturer, Detail, ManufacturerDetail, fold_case
+
+
+class StringTable:
+    """Таблица интернированных строк: каждая строка хранится один раз"""
+
+    def __init__(self):
+        self._strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        """Возвращает код строки, добавляя ее при необходимости"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._strings)
+            self._strings.append(value)
+            self._codes[value] = code
+        return code
+
+    def intern_many(self, values) -> np.ndarray:
+        """Коды для последовательности строк"""
+        return np.fromiter((self.intern(value) for value in values), dtype=np.int32)
+
+    def __getitem__(self, code: int) -> str:
+        return self._strings[code]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def lookup(self, codes: np.ndarray) -> List[str]:
+        """Строки по массиву кодов"""
+        strings = self._strings
+        return [strings[code] for code in codes.tolist()]
+
+    def nbytes(self) -> int:
+        """Приблизительный объем памяти строк и словаря кодов"""
+        return (sum(sys.getsizeof(value) for value in self._strings)
+                + sys.getsizeof(self._strings) + sys.getsizeof(self._codes))
+
+
+class ColumnarManufacturingService:
+    """Сервис с колоночным хранением данных
+
+    Отвечает на те же запросы, что и ManufacturingService, и возвращает
+    результаты тех же типов. Запросы 1 и 2 выполняются векторно:
+    сортировка lexsort и группировка bincount вместо циклов Python.
+    """
+
+    def __init__(self, manufacturers: List[Manufacturer],
+                 details: List[Detail],
+                 manufacturer_details: List[ManufacturerDetail]):
+        strings = StringTable()
+        self._init_columns(
+            strings,
+            np.fromiter((m.manufacturer_id for m in manufacturers), dtype=np.int64),
+            strings.intern_many(m.manufacturer_name for m in manufacturers),
+            np.fromiter((d.detail_id for d in details), dtype=np.int64),
+            strings.intern_many(d.detail_name for d in details),
+            np.fromiter((d.price for d in details), dtype=np.float64),
+            np.fromiter((d.manufacturer_id for d in details), dtype=np.int64),
+            np.fromiter((md.manufacturer_id for md in manufacturer_details), dtype=np.int64),
+            np.fromiter((md.detail_id for md in manufacturer_details), dtype=np.int64),
+        )
+
+    @classmethod
+    def from_arrays(cls, strings: StringTable,
+                    manufacturer_ids: np.ndarray, manufacturer_name_codes: np.ndarray,
+                    detail_ids: np.ndarray, detail_name_codes: np.ndarray,
+                    prices: np.ndarray, detail_manufacturer_ids: np.ndarray,
+                    link_manufacturer_ids: np.ndarray,
+                    link_detail_ids: np.ndarray) -> "ColumnarManufacturingService":
+        """Создает сервис из готовых столбцов без промежуточных объектов"""
+        service = cls.__new__(cls)
+        service._init_columns(
+            strings,
+            np.asarray(manufacturer_ids, dtype=np.int64),
+            np.asarray(manufacturer_name_codes, dtype=np.int32),
+            np.asarray(detail_ids, dtype=np.int64),
+            np.asarray(detail_name_codes, dtype=np.int32),
+            np.asarray(prices, dtype=np.float64),
+            np.asarray(detail_manufacturer_ids, dtype=np.int64),
+            np.asarray(link_manufacturer_ids, dtype=np.int64),
+            np.asarray(link_detail_ids, dtype=np.int64),
+        )
+        return service
+
+    def _init_columns(self, strings, manufacturer_ids, manufacturer_name_codes,
+                      detail_ids, detail_name_codes, prices, detail_manufacturer_ids,
+                      link_manufacturer_ids, link_detail_ids) -> None:
+        self.strings = strings
+        self.manufacturer_ids = manufacturer_ids
+        self.manufacturer_name_codes = manufacturer_name_codes
+        self.detail_ids = detail_ids
+        self.detail_name_codes = detail_name_codes
+        self.prices = prices
+        self.detail_manufacturer_ids = detail_manufacturer_ids
+        self.link_manufacturer_ids = link_manufacturer_ids
+        self.link_detail_ids = link_detail_ids
+
+        # Индексы для поиска по ID бинарным поиском
+        self._manufacturer_order = np.argsort(manufacturer_ids, kind="stable")
+        self._sorted_manufacturer_ids = manufacturer_ids[self._manufacturer_order]
+        self._detail_order = np.argsort(detail_ids, kind="stable")
+        self._sorted_detail_ids = detail_ids[self._detail_order]
+
+    def _manufacturer_positions(self, manufacturer_ids: np.ndarray) -> np.ndarray:
+        """Позиции производителей в порядке добавления, -1 для отсутствующих"""
+        return _positions(self._sorted_manufacturer_ids, self._manufacturer_order,
+                          manufacturer_ids)
+
+    def _detail_positions(self, detail_ids: np.ndarray) -> np.ndarray:
+        """Позиции деталей в порядке добавления, -1 для отсутствующих"""
+        return _positions(self._sorted_detail_ids, self._detail_order, detail_ids)
+
+    def nbytes(self) -> int:
+        """Объем памяти столбцов, индексов и таблицы строк"""
+        arrays = (self.manufacturer_ids, self.manufacturer_name_codes,
+                  self.detail_ids, self.detail_name_codes, self.prices,
+                  self.detail_manufacturer_ids, self.link_manufacturer_ids,
+                  self.link_detail_ids, self._manufacturer_order,
+                  self._sorted_manufacturer_ids, self._detail_order,
+                  self._sorted_detail_ids)
+        return sum(array.nbytes for array in arrays) + self.strings.nbytes()
+
+    def get_details_by_manufacturer(self) -> List[Tuple[str, str, float]]:
+        """Запрос 1: Получить детали с их производителями"""
+        positions = self._manufacturer_positions(self.detail_manufacturer_ids)
+        rows = np.flatnonzero(positions >= 0)
+        order = rows[np.lexsort((self.detail_ids[rows], self.detail_manufacturer_ids[rows]))]
+
+        manufacturer_names = self.strings.lookup(
+            self.manufacturer_name_codes[positions[order]])
+        detail_names = self.strings.lookup(self.detail_name_codes[order])
+        return list(zip(manufacturer_names, detail_names, self.prices[order].tolist()))
+
+    def get_total_price_by_manufacturer(self) -> List[Tuple[str, float]]:
+        """Запрос 2: Получить суммарную стоимость деталей по производителям"""
+        positions = self._manufacturer_positions(self.detail_manufacturer_ids)
+        known = positions >= 0
+        totals = np.bincount(positions[known], weights=self.prices[known],
+                             minlength=len(self.manufacturer_ids))
+
+        # Стабильная сортировка сохраняет порядок производителей при равных суммах
+        order = np.argsort(-totals, kind="stable")
+        names = self.strings.lookup(self.manufacturer_name_codes[order])
+        return list(zip(names, totals[order].tolist()))
+
+    def get_department_manufacturers_with_details(self) -> Dict[str, List[Tuple[str, float]]]:
+        """Запрос 3: Получить производителей с 'отдел' в названии и их детали"""
+        link_order = np.argsort(self.link_manufacturer_ids, kind="stable")
+        sorted_link_manufacturers = self.link_manufacturer_ids[link_order]
+        matches = {}
+
+        result = {}
+        for manufacturer_id, name_code in zip(self.manufacturer_ids.tolist(),
+                                              self.manufacturer_name_codes.tolist()):
+            if name_code not in matches:
+                matches[name_code] = "отдел" in fold_case(self.strings[name_code])
+            if not matches[name_code]:
+                continue
+
+            start, stop = np.searchsorted(sorted_link_manufacturers,
+                                          [manufacturer_id, manufacturer_id + 1])
+            positions = self._detail_positions(self.link_detail_ids[link_order[start:stop]])
+            positions = positions[positions >= 0]
+            result[self.strings[name_code]] = list(zip(
+                self.strings.lookup(self.detail_name_codes[positions]),
+                self.prices[positions].tolist()))
+
+        return result
+
+
+def _positions(sorted_ids: np.ndarray, order: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Бинарный поиск ids в отсортированном столбце с возвратом исходных позиций"""
+    if not len(sorted_ids):
+        return np.full(len(ids), -1, dtype=np.int64)
+    index = np.searchsorted(sorted_ids, ids)
+    index[index == len(sorted_ids)] = 0
+    found = sorted_ids[index] == ids
+    return np.where(found, order[index], -1)
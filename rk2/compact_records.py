@@ -0,0 +1,98 @@
+"""
+Компактные варианты записей Manufacturer, Detail и ManufacturerDetail
+Записи со __slots__ не имеют __dict__, замороженные варианты к тому же
+хешируемы; повторяющиеся названия деталей хранятся в одном экземпляре
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from refactored_manufacturing import Manufacturer, Detail, ManufacturerDetail
+
+
+@dataclass(slots=True)
+class SlottedManufacturer:
+    """Производитель без __dict__"""
+    manufacturer_id: int
+    manufacturer_name: str
+
+
+@dataclass(slots=True)
+class SlottedDetail:
+    """Деталь без __dict__"""
+    detail_id: int
+    detail_name: str
+    price: float
+    manufacturer_id: int
+
+
+@dataclass(slots=True)
+class SlottedManufacturerDetail:
+    """Связь производителя и детали без __dict__"""
+    manufacturer_id: int
+    detail_id: int
+
+
+@dataclass(slots=True, frozen=True)
+class FrozenManufacturer:
+    """Неизменяемый хешируемый производитель"""
+    manufacturer_id: int
+    manufacturer_name: str
+
+
+@dataclass(slots=True, frozen=True)
+class FrozenDetail:
+    """Неизменяемая хешируемая деталь"""
+    detail_id: int
+    detail_name: str
+    price: float
+    manufacturer_id: int
+
+
+@dataclass(slots=True, frozen=True)
+class FrozenManufacturerDetail:
+    """Неизменяемая хешируемая связь производителя и детали"""
+    manufacturer_id: int
+    detail_id: int
+
+
+class NamePool:
+    """Пул названий: одинаковые строки заменяются одним экземпляром"""
+
+    def __init__(self):
+        self._names: Dict[str, str] = {}
+
+    def intern(self, name: str) -> str:
+        """Возвращает экземпляр строки из пула, добавляя ее при необходимости"""
+        return self._names.setdefault(name, name)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+def to_compact(manufacturers: Iterable[Manufacturer],
+               details: Iterable[Detail],
+               manufacturer_details: Iterable[ManufacturerDetail],
+               frozen: bool = False,
+               pool: Optional[NamePool] = None) -> Tuple[list, list, list]:
+    """Переводит записи в компактные варианты с общим пулом названий"""
+    if frozen:
+        manufacturer_type, detail_type, link_type = (
+            FrozenManufacturer, FrozenDetail, FrozenManufacturerDetail)
+    else:
+        manufacturer_type, detail_type, link_type = (
+            SlottedManufacturer, SlottedDetail, SlottedManufacturerDetail)
+    pool = pool if pool is not None else NamePool()
+
+    compact_manufacturers: List = [
+        manufacturer_type(m.manufacturer_id, pool.intern(m.manufacturer_name))
+        for m in manufacturers
+    ]
+    compact_details: List = [
+        detail_type(d.detail_id, pool.intern(d.detail_name), d.price, d.manufacturer_id)
+        for d in details
+    ]
+    compact_links: List = [
+        link_type(md.manufacturer_id, md.detail_id) for md in manufacturer_details
+    ]
+    return compact_manufacturers, compact_details, compact_links
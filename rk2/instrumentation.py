@@ -0,0 +1,251 @@
+"""
+Измерение запросов ManufacturingService по фазам
+Для каждого запроса собираются время фаз, число строк и прирост числа
+выделенных блоков памяти; результаты передаются в подключаемые
+приемники. Без Instrumentation сервис использует NULL_RECORDER, фазы
+которого ничего не делают
+"""
+
+import cProfile
+import io
+import json
+import math
+import pstats
+import sys
+import time
+import tracemalloc
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, TextIO, Tuple
+
+
+@dataclass
+class QueryStats:
+    """Измерения одного выполнения запроса
+
+    allocated_blocks - прирост sys.getallocatedblocks(): сколько блоков
+    памяти осталось выделенным (в том числе под результат).
+    """
+    query: str
+    seconds: float = 0.0
+    rows: int = 0
+    allocated_blocks: int = 0
+    phases: Dict[str, float] = field(default_factory=dict)
+    phase_blocks: Dict[str, int] = field(default_factory=dict)
+
+
+class _Phase:
+    __slots__ = ("_stats", "_name", "_started", "_blocks")
+
+    def __init__(self, stats: QueryStats, name: str):
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._blocks = sys.getallocatedblocks()
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._started
+        stats = self._stats
+        stats.phases[self._name] = stats.phases.get(self._name, 0.0) + elapsed
+        stats.phase_blocks[self._name] = (stats.phase_blocks.get(self._name, 0)
+                                          + sys.getallocatedblocks() - self._blocks)
+
+
+class QueryRecorder:
+    """Контекст измерения одного запроса; передает QueryStats приемникам при выходе"""
+
+    def __init__(self, query: str, sinks: List["Sink"]):
+        self.stats = QueryStats(query)
+        self._sinks = sinks
+
+    @property
+    def rows(self) -> int:
+        return self.stats.rows
+
+    @rows.setter
+    def rows(self, value: int) -> None:
+        self.stats.rows = value
+
+    def phase(self, name: str) -> _Phase:
+        """Контекст фазы запроса; повторные фазы с тем же именем суммируются"""
+        return _Phase(self.stats, name)
+
+    def __enter__(self):
+        self._blocks = sys.getallocatedblocks()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.stats.seconds = time.perf_counter() - self._started
+        self.stats.allocated_blocks = sys.getallocatedblocks() - self._blocks
+        if exc_type is None:
+            for sink in self._sinks:
+                sink.emit(self.stats)
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _NullRecorder:
+    """Recorder без измерений для сервиса без Instrumentation
+
+    Запрос с ним тратит на вызовы контекстов около микросекунды.
+    """
+    _phase = _NullPhase()
+    rows = 0  # присваивания игнорируются: значение никто не читает
+
+    def phase(self, name: str) -> _NullPhase:
+        return self._phase
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_RECORDER = _NullRecorder()
+
+
+class Sink(ABC):
+    """Приемник измерений"""
+
+    @abstractmethod
+    def emit(self, stats: QueryStats) -> None:
+        """Принимает измерения одного выполнения запроса"""
+
+
+class HistogramSink(Sink):
+    """Гистограммы длительностей в памяти по запросам и фазам
+
+    Длительности раскладываются по корзинам с границами 2^k мкс, поэтому
+    память не растет с числом запросов, а перцентили приближенные
+    (верхняя граница корзины).
+    """
+
+    def __init__(self):
+        # (запрос, фаза) -> {номер корзины: количество}; фаза "total" - весь запрос
+        self.buckets: Dict[Tuple[str, str], Dict[int, int]] = {}
+        self.rows: Dict[str, int] = {}
+        self.allocated_blocks: Dict[str, int] = {}
+
+    def emit(self, stats: QueryStats) -> None:
+        self._add(stats.query, "total", stats.seconds)
+        for phase, seconds in stats.phases.items():
+            self._add(stats.query, phase, seconds)
+        self.rows[stats.query] = self.rows.get(stats.query, 0) + stats.rows
+        self.allocated_blocks[stats.query] = (self.allocated_blocks.get(stats.query, 0)
+                                              + stats.allocated_blocks)
+
+    def _add(self, query: str, phase: str, seconds: float) -> None:
+        counts = self.buckets.setdefault((query, phase), {})
+        bucket = int(seconds * 1e6).bit_length()
+        counts[bucket] = counts.get(bucket, 0) + 1
+
+    def histogram(self, query: str, phase: str = "total") -> Dict[float, int]:
+        """Верхняя граница корзины в микросекундах -> количество"""
+        counts = self.buckets.get((query, phase), {})
+        return {float(2 ** bucket): counts[bucket] for bucket in sorted(counts)}
+
+    def percentile(self, query: str, share: float, phase: str = "total") -> float:
+        """Приближенный перцентиль длительности в секундах (метод ближайшего ранга)"""
+        counts = self.buckets.get((query, phase))
+        if not counts:
+            return 0.0
+        rank = max(1, math.ceil(share * sum(counts.values())))
+        seen = 0
+        for bucket in sorted(counts):
+            seen += counts[bucket]
+            if seen >= rank:
+                break
+        return 2 ** bucket / 1e6
+
+    def report(self) -> str:
+        """Таблица по запросам и фазам: вызовы, p50, p99, строки и блоки памяти"""
+        lines = [f"{'запрос':<44} {'фаза':<14} {'вызовов':>8} {'p50, мкс':>9} "
+                 f"{'p99, мкс':>9} {'строк':>8} {'блоков':>8}"]
+        for query, phase in self.buckets:
+            count = sum(self.buckets[query, phase].values())
+            is_total = phase == "total"
+            lines.append(
+                f"{query:<44} {phase:<14} {count:>8} "
+                f"{self.percentile(query, 0.5, phase) * 1e6:>9.0f} "
+                f"{self.percentile(query, 0.99, phase) * 1e6:>9.0f} "
+                f"{self.rows[query] if is_total else '':>8} "
+                f"{self.allocated_blocks[query] if is_total else '':>8}")
+        return "\n".join(lines)
+
+
+class JsonLogSink(Sink):
+    """Каждое измерение - строка JSON в потоке"""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+
+    def emit(self, stats: QueryStats) -> None:
+        self.stream.write(json.dumps(asdict(stats), ensure_ascii=False) + "\n")
+
+
+class CallbackSink(Sink):
+    """Передает измерения функции"""
+
+    def __init__(self, callback: Callable[[QueryStats], None]):
+        self.callback = callback
+
+    def emit(self, stats: QueryStats) -> None:
+        self.callback(stats)
+
+
+class Instrumentation:
+    """Набор приемников, подключаемый к ManufacturingService(instrumentation=...)"""
+
+    def __init__(self, sinks: Iterable[Sink] = ()):
+        self.sinks: List[Sink] = list(sinks)
+
+    def query(self, name: str) -> QueryRecorder:
+        """Контекст измерения запроса name"""
+        return QueryRecorder(name, self.sinks)
+
+
+def profile_call(func: Callable, *args, sort: str = "cumulative", limit: int = 20,
+                 stream: Optional[TextIO] = None, **kwargs):
+    """Выполняет func под cProfile, печатает отчет в stream и возвращает результат"""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats(sort).print_stats(limit)
+    (stream or sys.stdout).write(report.getvalue())
+    return result
+
+
+def trace_allocations(func: Callable, *args, limit: int = 10,
+                      stream: Optional[TextIO] = None, **kwargs):
+    """Выполняет func под tracemalloc, печатает строки с наибольшим
+    выделением памяти в stream и возвращает результат"""
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = func(*args, **kwargs)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+
+    output = stream or sys.stdout
+    output.write(f"Пик памяти: {peak / 1024:.1f} КБ\n")
+    for statistic in after.compare_to(before, "lineno")[:limit]:
+        output.write(f"{statistic}\n")
+    return result
@@ -0,0 +1,129 @@
+"""
+Соединение производителей и деталей по двум отношениям и проверка
+целостности данных
+Detail.manufacturer_id задает отношение один ко многим, таблица
+ManufacturerDetail - многие ко многим; эти отношения могут расходиться
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Tuple, TypeVar
+
+from refactored_manufacturing import Manufacturer, Detail, ManufacturerDetail, Relation
+
+Build = TypeVar("Build")
+Probe = TypeVar("Probe")
+
+
+def hash_join(build: Iterable[Build], probe: Iterable[Probe],
+              build_key: Callable[[Build], Hashable],
+              probe_key: Callable[[Probe], Hashable]) -> Iterator[Tuple[Build, Probe]]:
+    """Внутреннее соединение: хеш-таблица по build, проход по probe
+
+    Пары выдаются в порядке probe, а для одной строки probe - в
+    порядке build.
+    """
+    table: Dict[Hashable, List[Build]] = {}
+    for row in build:
+        table.setdefault(build_key(row), []).append(row)
+    for row in probe:
+        for match in table.get(probe_key(row), ()):
+            yield match, row
+
+
+def join_details(manufacturers: Iterable[Manufacturer], details: Iterable[Detail],
+                 manufacturer_details: Iterable[ManufacturerDetail] = (),
+                 relation: Relation = Relation.OWNERSHIP
+                 ) -> Iterator[Tuple[Manufacturer, Detail]]:
+    """Пары (производитель, деталь) по выбранному отношению"""
+    if relation is Relation.OWNERSHIP:
+        return hash_join(manufacturers, details,
+                         lambda m: m.manufacturer_id, lambda d: d.manufacturer_id)
+
+    linked = hash_join(manufacturers, manufacturer_details,
+                       lambda m: m.manufacturer_id, lambda md: md.manufacturer_id)
+    return ((manufacturer, detail) for (manufacturer, _), detail in hash_join(
+        linked, details, lambda pair: pair[1].detail_id, lambda d: d.detail_id))
+
+
+def group_details(manufacturers: Iterable[Manufacturer], details: Iterable[Detail],
+                  manufacturer_details: Iterable[ManufacturerDetail] = (),
+                  relation: Relation = Relation.OWNERSHIP) -> Dict[int, List[Detail]]:
+    """Представление manufacturer_id -> детали по выбранному отношению"""
+    view: Dict[int, List[Detail]] = {}
+    for manufacturer, detail in join_details(manufacturers, details,
+                                             manufacturer_details, relation):
+        view.setdefault(manufacturer.manufacturer_id, []).append(detail)
+    return view
+
+
+@dataclass
+class IntegrityReport:
+    """Результат проверки целостности каталога"""
+    duplicate_manufacturer_ids: List[int] = field(default_factory=list)
+    duplicate_detail_ids: List[int] = field(default_factory=list)
+    # Детали, у которых Detail.manufacturer_id не найден среди производителей
+    details_with_unknown_manufacturer: List[int] = field(default_factory=list)
+    # Связи (manufacturer_id, detail_id) с несуществующим производителем или деталью
+    links_with_unknown_manufacturer: List[Tuple[int, int]] = field(default_factory=list)
+    links_with_unknown_detail: List[Tuple[int, int]] = field(default_factory=list)
+    duplicate_links: List[Tuple[int, int]] = field(default_factory=list)
+    # Связи, противоречащие Detail.manufacturer_id
+    conflicting_links: List[Tuple[int, int]] = field(default_factory=list)
+    # Детали без связи со своим производителем
+    details_without_own_link: List[int] = field(default_factory=list)
+
+    @property
+    def is_consistent(self) -> bool:
+        """Нет ни одной проблемы"""
+        return not any(getattr(self, name) for name in self.__dataclass_fields__)
+
+    def summary(self) -> Dict[str, int]:
+        """Количество проблем каждого вида"""
+        return {name: len(getattr(self, name)) for name in self.__dataclass_fields__}
+
+
+def check_integrity(manufacturers: Iterable[Manufacturer], details: Iterable[Detail],
+                    manufacturer_details: Iterable[ManufacturerDetail]) -> IntegrityReport:
+    """Проверяет каталог за один проход по каждой коллекции
+
+    Время и память линейны по числу записей: используются только
+    множества и словари по ID.
+    """
+    report = IntegrityReport()
+
+    manufacturer_ids = set()
+    for manufacturer in manufacturers:
+        if manufacturer.manufacturer_id in manufacturer_ids:
+            report.duplicate_manufacturer_ids.append(manufacturer.manufacturer_id)
+        manufacturer_ids.add(manufacturer.manufacturer_id)
+
+    owners: Dict[int, int] = {}
+    for detail in details:
+        if detail.detail_id in owners:
+            report.duplicate_detail_ids.append(detail.detail_id)
+        owners[detail.detail_id] = detail.manufacturer_id
+        if detail.manufacturer_id not in manufacturer_ids:
+            report.details_with_unknown_manufacturer.append(detail.detail_id)
+
+    seen_links = set()
+    own_linked = set()
+    for link in manufacturer_details:
+        key = (link.manufacturer_id, link.detail_id)
+        if key in seen_links:
+            report.duplicate_links.append(key)
+            continue
+        seen_links.add(key)
+
+        if link.manufacturer_id not in manufacturer_ids:
+            report.links_with_unknown_manufacturer.append(key)
+        owner = owners.get(link.detail_id)
+        if owner is None:
+            report.links_with_unknown_detail.append(key)
+        elif owner == link.manufacturer_id:
+            own_linked.add(link.detail_id)
+        else:
+            report.conflicting_links.append(key)
+
+    report.details_without_own_link = [
+        detail_id for detail_id in owners if detail_id not in own_linked]
+    return report
@@ -0,0 +1,196 @@
+"""
+Потоковая загрузка производителей, деталей и связей из CSV и JSON Lines
+Записи читаются построчно и сразу добавляются в индексы сервиса,
+без промежуточных списков
+"""
+
+import csv
+import gzip
+import json
+import math
+from dataclasses import fields
+from typing import Callable, Iterator, List, Optional, Tuple, Type, TypeVar
+
+from refactored_manufacturing import (
+    Manufacturer,
+    Detail,
+    ManufacturerDetail,
+    ManufacturingService
+)
+
+Record = TypeVar("Record", Manufacturer, Detail, ManufacturerDetail)
+ErrorHandler = Callable[["LoadError"], None]
+
+
+class LoadError(ValueError):
+    """Ошибка в строке загружаемого файла"""
+
+    def __init__(self, path: str, line_number: int, message: str):
+        super().__init__(f"{path}:{line_number}: {message}")
+        self.path = path
+        self.line_number = line_number
+        self.message = message
+
+
+def _open_binary(path: str):
+    """Открывает файл на чтение байтов, файлы .gz распаковываются на лету"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _decoded_lines(stream, bad_lines: List[int]) -> Iterator[str]:
+    """Строки потока байтов, декодированные по одной
+
+    Строка с некорректным UTF-8 декодируется с surrogateescape, а ее
+    номер добавляется в bad_lines, чтобы ошибку получила только она.
+    BOM в начале первой строки отбрасывается.
+    """
+    for line_number, line in enumerate(stream, 1):
+        encoding = "utf-8-sig" if line_number == 1 else "utf-8"
+        try:
+            yield line.decode(encoding)
+        except UnicodeDecodeError:
+            bad_lines.append(line_number)
+            yield line.decode(encoding, "surrogateescape")
+
+
+def _file_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise ValueError(f"Неизвестный формат файла: {path}")
+
+
+def _convert(value, field_type: type, from_text: bool):
+    """Приводит значение поля к типу из объявления dataclass
+
+    Цена должна быть конечным числом: "nan" и "inf" в CSV и NaN и
+    Infinity в JSON отклоняются.
+    """
+    if from_text:
+        value = field_type(value.strip()) if field_type is not str else value
+    elif field_type is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    elif type(value) is not field_type:
+        raise TypeError(f"ожидался {field_type.__name__}, получено {type(value).__name__}")
+    if field_type is float and not math.isfinite(value):
+        raise ValueError(f"ожидалось конечное число, получено {value}")
+    return value
+
+
+def _build_record(record_type: Type[Record], raw: dict, from_text: bool) -> Record:
+    values = []
+    for field in fields(record_type):
+        if raw.get(field.name) is None:
+            raise ValueError(f"нет поля '{field.name}'")
+        try:
+            values.append(_convert(raw[field.name], field.type, from_text))
+        except (TypeError, ValueError) as error:
+            raise ValueError(f"поле '{field.name}': {error}") from None
+    return record_type(*values)
+
+
+def _iter_raw(path: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Тройки (номер строки, словарь полей, ошибка разбора)"""
+    file_format = _file_format(path)
+    bad_lines: List[int] = []
+    with _open_binary(path) as stream:
+        lines = _decoded_lines(stream, bad_lines)
+        if file_format == "csv":
+            reader = csv.DictReader(lines)
+            # Последняя строка предыдущей записи: запись CSV может занимать
+            # несколько строк, если в кавычках есть перевод строки
+            previous = 0
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as error:
+                    # line_num при ошибке может не учитывать прочитанную строку
+                    yield previous + 1, None, f"некорректная строка CSV: {error}"
+                    previous = max(previous + 1, reader.line_num)
+                    continue
+                else:
+                    if bad_lines and bad_lines[-1] > previous:
+                        yield reader.line_num, None, "некорректная кодировка UTF-8"
+                    else:
+                        yield reader.line_num, row, None
+                previous = reader.line_num
+        else:
+            for line_number, line in enumerate(lines, 1):
+                if bad_lines and bad_lines[-1] == line_number:
+                    yield line_number, None, "некорректная кодировка UTF-8"
+                    continue
+                if not line.strip():
+                    continue
+                try:
+                    raw = json.loads(line)
+                except json.JSONDecodeError as error:
+                    yield line_number, None, f"некорректный JSON: {error.msg}"
+                    continue
+                if isinstance(raw, dict):
+                    yield line_number, raw, None
+                else:
+                    yield line_number, None, "ожидался JSON-объект"
+
+
+def iter_records(path: str, record_type: Type[Record],
+                 on_error: Optional[ErrorHandler] = None) -> Iterator[Tuple[int, Record]]:
+    """Лениво читает записи record_type из CSV или JSONL файла
+
+    Возвращает пары (номер строки, запись). Некорректная строка, в том
+    числе с ошибкой кодировки UTF-8 или разбора CSV, передается в
+    on_error как LoadError и пропускается; без on_error исключение
+    LoadError прерывает чтение.
+    """
+    from_text = _file_format(path) == "csv"
+    for line_number, raw, problem in _iter_raw(path):
+        if problem is None:
+            try:
+                yield line_number, _build_record(record_type, raw, from_text)
+                continue
+            except ValueError as error:
+                problem = str(error)
+        _report(LoadError(path, line_number, problem), on_error)
+
+
+def _report(error: LoadError, on_error: Optional[ErrorHandler]) -> None:
+    if on_error is None:
+        raise error
+    on_error(error)
+
+
+def load_into(service: ManufacturingService, path: str, record_type: Type[Record],
+              on_error: Optional[ErrorHandler] = None) -> int:
+    """Добавляет записи из файла в сервис и возвращает число загруженных"""
+    add = {
+        Manufacturer: service.add_manufacturer,
+        Detail: service.add_detail,
+        ManufacturerDetail: service.add_link,
+    }[record_type]
+
+    loaded = 0
+    for line_number, record in iter_records(path, record_type, on_error):
+        try:
+            add(record)
+        except ValueError as error:
+            # Повторный ID отклоняется сервисом
+            _report(LoadError(path, line_number, str(error)), on_error)
+            continue
+        loaded += 1
+    return loaded
+
+
+def load_service(manufacturers_path: str, details_path: str, links_path: str,
+                 on_error: Optional[ErrorHandler] = None,
+                 **service_options) -> ManufacturingService:
+    """Создает сервис из трех файлов (CSV или JSONL, допускается .gz)"""
+    service = ManufacturingService([], [], [], **service_options)
+    load_into(service, manufacturers_path, Manufacturer, on_error)
+    load_into(service, details_path, Detail, on_error)
+    load_into(service, links_path, ManufacturerDetail, on_error)
+    return service
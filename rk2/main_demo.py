@@ -1,7 +1,13 @@
 """
 Демонстрация работы рефакторинга и тестов
+Запуск: python main_demo.py [--stats] [--profile]
 """
 
+import argparse
+import sys
+from typing import Optional
+
+from instrumentation import HistogramSink, Instrumentation, profile_call
 from refactored_manufacturing import (
     get_sample_data,
     ManufacturingService,
@@ -11,7 +17,7 @@ from refactored_manufacturing import (
 )
 
 
-def demonstrate_refactored_code():
+def demonstrate_refactored_code(instrumentation: Optional[Instrumentation] = None):
     """Демонстрация работы рефакторированного кода"""
     print("ДЕМОНСТРАЦИЯ РЕФАКТОРИНГА")
     print("=" * 60)
@@ -20,15 +26,16 @@ def demonstrate_refactored_code():
     manufacturers, details, manufacturer_details = get_sample_data()
 
     # Создаем сервис
-    service = ManufacturingService(manufacturers, details, manufacturer_details)
+    service = ManufacturingService(manufacturers, details, manufacturer_details,
+                                   instrumentation=instrumentation)
 
     # Демонстрируем каждый метод
     print("\n1. Детали с производителями:")
     print("-" * 40)
-    details_by_manufacturer = service.get_details_by_manufacturer()
-    for i, (manufacturer, detail, price) in enumerate(details_by_manufacturer[:3], 1):
+    first_details = service.iter_details_by_manufacturer(limit=3)
+    for i, (manufacturer, detail, price) in enumerate(first_details, 1):
         print(f"{i}. {manufacturer} -> {detail} ({price} руб.)")
-    print(f"... и еще {len(details_by_manufacturer) - 3} записей")
+    print(f"... и еще {service.count_details_by_manufacturer() - 3} записей")
 
     print("\n2. Суммарная стоимость по производителям:")
     print("-" * 40)
@@ -59,8 +66,28 @@ def demonstrate_original_functionality():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stats", action="store_true",
+                        help="вывести время фаз, строки и память запросов")
+    parser.add_argument("--profile", action="store_true",
+                        help="вывести отчет cProfile для демонстрации рефакторинга")
+    args = parser.parse_args()
+
+    histogram = HistogramSink()
+    instrumentation = Instrumentation([histogram]) if args.stats else None
+
     # Демонстрируем рефакторинг
-    demonstrate_refactored_code()
+    if args.profile:
+        profile_call(demonstrate_refactored_code, instrumentation, limit=15, stream=sys.stderr)
+    else:
+        demonstrate_refactored_code(instrumentation)
 
     # Демонстрируем исходную функциональность
     demonstrate_original_functionality()
+
+    if args.stats:
+        print("\n\n" + "=" * 60)
+        print("СТАТИСТИКА ЗАПРОСОВ")
+        print("=" * 60)
+        print(histogram.report())
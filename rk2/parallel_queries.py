@@ -0,0 +1,224 @@
+"""
+Параллельное выполнение запросов над шардами каталога
+Детали делятся на шарды по manufacturer_id, столбцы и названия шардов
+передаются процессам-исполнителям через разделяемую память, а
+родительский процесс объединяет частичные результаты. Строки запроса 1
+собирают исполнители: родитель только распаковывает готовые группы и
+сливает их, не выполняя кода Python на каждую строку
+"""
+
+import heapq
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, groupby
+from multiprocessing.shared_memory import SharedMemory
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from refactored_manufacturing import Detail, ManufacturingService
+
+# Столбцы в разделяемой памяти: (имя, код типа array). Названия в UTF-8
+# лежат после столбцов; для строки хранятся границы названия детали и
+# названия производителя (-1, если производителя нет в сервисе)
+_COLUMNS = (("manufacturer_ids", "q"), ("detail_ids", "q"), ("prices", "d"),
+            ("name_starts", "q"), ("name_ends", "q"), ("owner_starts", "q"), ("owner_ends", "q"))
+
+# Разделяемая память, уже подключенная в процессе-исполнителе
+_attached: Dict[str, SharedMemory] = {}
+
+
+def _columns_size(row_count: int) -> int:
+    return sum(row_count * array(typecode).itemsize for _, typecode in _COLUMNS)
+
+
+def _column_views(buffer, row_count: int) -> Dict[str, memoryview]:
+    """Типизированные представления столбцов и байты названий (text) в общем буфере"""
+    views = {}
+    offset = 0
+    for name, typecode in _COLUMNS:
+        size = row_count * array(typecode).itemsize
+        views[name] = buffer[offset:offset + size].cast(typecode)
+        offset += size
+    views["text"] = buffer[offset:]
+    return views
+
+
+def _worker_views(shm_name: str, row_count: int) -> Dict[str, memoryview]:
+    shm = _attached.get(shm_name)
+    if shm is None:
+        # После refresh() родитель создает новый блок, старый больше не нужен
+        for stale in _attached.values():
+            stale.close()
+        _attached.clear()
+        shm = _attached[shm_name] = SharedMemory(name=shm_name)
+    return _column_views(shm.buf, row_count)
+
+
+def _shard_groups(manufacturer_ids: memoryview, start: int, stop: int
+                  ) -> List[Tuple[int, int, int]]:
+    """Группы (manufacturer_id, начало, конец): детали производителя в шарде идут подряд"""
+    groups = []
+    position = start
+    for manufacturer_id, run in groupby(manufacturer_ids[start:stop]):
+        size = sum(1 for _ in run)
+        groups.append((manufacturer_id, position, position + size))
+        position += size
+    return groups
+
+
+def _shard_totals(shm_name: str, row_count: int, start: int, stop: int) -> Dict[int, float]:
+    """Частичные суммы по производителям шарда"""
+    views = _worker_views(shm_name, row_count)
+    prices = views["prices"]
+    totals: Dict[int, float] = {}
+    for manufacturer_id, group_start, group_stop in _shard_groups(
+            views["manufacturer_ids"], start, stop):
+        total_price = 0.0
+        for price in prices[group_start:group_stop]:
+            total_price += price
+        totals[manufacturer_id] = total_price
+    return totals
+
+
+def _shard_rows(shm_name: str, row_count: int, start: int, stop: int
+                ) -> List[Tuple[int, List[Tuple[str, str, float]]]]:
+    """Строки запроса 1 шарда: пары (manufacturer_id, строки группы)
+
+    Группы идут по возрастанию manufacturer_id, строки группы - по
+    возрастанию detail_id; группы без производителя пропускаются.
+    """
+    views = _worker_views(shm_name, row_count)
+    detail_ids, prices, text = views["detail_ids"], views["prices"], views["text"]
+    name_starts, name_ends = views["name_starts"], views["name_ends"]
+    result = []
+    for manufacturer_id, group_start, group_stop in sorted(
+            _shard_groups(views["manufacturer_ids"], start, stop)):
+        owner_start = views["owner_starts"][group_start]
+        if owner_start < 0:
+            continue
+        name = str(text[owner_start:views["owner_ends"][group_start]], "utf-8")
+        rows = sorted(range(group_start, group_stop), key=detail_ids.__getitem__)
+        result.append((manufacturer_id, [
+            (name, str(text[name_starts[row]:name_ends[row]], "utf-8"), prices[row])
+            for row in rows]))
+    return result
+
+
+class ShardedQueryExecutor:
+    """Выполняет запросы 1 и 2 сервиса в пуле процессов
+
+    Исполнитель копирует детали и названия сервиса в разделяемую память
+    при создании; после изменения данных сервиса нужно вызвать refresh().
+    Результаты совпадают с последовательными запросами сервиса:
+    детали одного производителя попадают в один шард в порядке индекса
+    сервиса, поэтому суммы накапливаются в том же порядке. Запрос 3
+    уже выполняется по индексам за время, пропорциональное результату,
+    и делегируется сервису.
+
+    Строки запроса 1 передаются родителю через pickle, и одна их
+    распаковка дороже последовательного запроса 1 по поддерживаемым
+    индексам сервиса (200 тыс. деталей: около 0.10 с против 0.04 с).
+    Поэтому запрос 1 по шардам не быстрее последовательного при любом
+    числе ядер, а выигрыш возможен только для запроса 2, где исполнители
+    возвращают по одной сумме на производителя (python benchmark.py sharded).
+    """
+
+    def __init__(self, service: ManufacturingService,
+                 shard_count: Optional[int] = None,
+                 max_workers: Optional[int] = None):
+        self.service = service
+        self.shard_count = shard_count or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(max_workers=max_workers or self.shard_count)
+        self._shm: Optional[SharedMemory] = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Заново раскладывает детали сервиса по шардам"""
+        shards: List[List[Tuple[int, Iterable[Detail]]]] = [[] for _ in range(self.shard_count)]
+        for manufacturer_id, group in self.service.iter_detail_groups():
+            shards[manufacturer_id % self.shard_count].append((manufacturer_id, group))
+
+        columns = {name: array(typecode) for name, typecode in _COLUMNS}
+        text = bytearray()
+        self._bounds: List[Tuple[int, int]] = []
+        for shard in shards:
+            start = len(columns["detail_ids"])
+            for manufacturer_id, group in shard:
+                manufacturer = self.service.get_manufacturer(manufacturer_id)
+                owner_start = owner_end = -1
+                if manufacturer is not None:
+                    owner_start = len(text)
+                    text += manufacturer.manufacturer_name.encode("utf-8")
+                    owner_end = len(text)
+                for detail in group:
+                    columns["manufacturer_ids"].append(manufacturer_id)
+                    columns["detail_ids"].append(detail.detail_id)
+                    columns["prices"].append(detail.price)
+                    columns["name_starts"].append(len(text))
+                    text += detail.detail_name.encode("utf-8")
+                    columns["name_ends"].append(len(text))
+                    columns["owner_starts"].append(owner_start)
+                    columns["owner_ends"].append(owner_end)
+            self._bounds.append((start, len(columns["detail_ids"])))
+
+        self._release_memory()
+        self._row_count = row_count = len(columns["detail_ids"])
+        self._shm = SharedMemory(create=True, size=max(_columns_size(row_count) + len(text), 1))
+        views = _column_views(self._shm.buf, row_count)
+        for name, column in columns.items():
+            views[name][:] = column
+        views["text"][:len(text)] = text
+        for view in views.values():
+            view.release()
+
+    def _map(self, task):
+        """Запускает task на всех непустых шардах"""
+        futures = [self._pool.submit(task, self._shm.name, self._row_count, start, stop)
+                   for start, stop in self._bounds if start < stop]
+        return [future.result() for future in futures]
+
+    def iter_details_by_manufacturer(self) -> Iterator[Tuple[str, str, float]]:
+        """Запрос 1 по одной строке: группы строк из исполнителей сливаются лениво
+
+        Производители шардов не пересекаются, поэтому слияние идет по
+        группам, а строки групп выдаются без обработки в родителе.
+        """
+        merged = heapq.merge(*self._map(_shard_rows), key=itemgetter(0))
+        return chain.from_iterable(map(itemgetter(1), merged))
+
+    def get_details_by_manufacturer(self) -> List[Tuple[str, str, float]]:
+        """Запрос 1: сортировка и сборка строк в исполнителях, слияние групп"""
+        return list(self.iter_details_by_manufacturer())
+
+    def get_total_price_by_manufacturer(self) -> List[Tuple[str, float]]:
+        """Запрос 2: частичные суммы шардов и их объединение"""
+        price_totals: Dict[int, float] = {}
+        for partial in self._map(_shard_totals):
+            price_totals.update(partial)
+
+        result = [(manufacturer.manufacturer_name,
+                   price_totals.get(manufacturer.manufacturer_id, 0.0))
+                  for manufacturer in self.service.manufacturers]
+        return sorted(result, key=lambda x: x[1], reverse=True)
+
+    def get_department_manufacturers_with_details(self) -> Dict[str, List[Tuple[str, float]]]:
+        """Запрос 3: выполняется сервисом"""
+        return self.service.get_department_manufacturers_with_details()
+
+    def _release_memory(self) -> None:
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self) -> None:
+        """Останавливает процессы и освобождает разделяемую память"""
+        self._pool.shutdown()
+        self._release_memory()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
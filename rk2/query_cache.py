@@ -0,0 +1,123 @@
+"""
+Кэш результатов запросов ManufacturingService
+Записи кэша помечаются версиями таблиц, от которых зависит запрос,
+поэтому изменение данных делает устаревшими только затронутые записи
+"""
+
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Callable, Hashable, Mapping, NamedTuple, Optional, Tuple
+
+from refactored_manufacturing import ManufacturingService
+
+DetailRows = Tuple[Tuple[str, str, float], ...]
+TotalRows = Tuple[Tuple[str, float], ...]
+DepartmentMapping = Mapping[str, Tuple[Tuple[str, float], ...]]
+
+
+class CacheInfo(NamedTuple):
+    """Счетчики кэша"""
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    size: int
+    rows: int
+
+
+class CachedManufacturingService:
+    """Кэширующая обертка над запросами сервиса
+
+    Результаты возвращаются в неизменяемом виде (кортежи и
+    MappingProxyType), чтобы вызывающий код не мог испортить кэш.
+    Запись устаревает, когда меняется версия одной из ее таблиц:
+    например, изменение связей не сбрасывает запросы 1 и 2. Вытеснение
+    LRU ограничено числом записей maxsize и, если задано, суммарным
+    числом строк max_rows.
+    """
+
+    def __init__(self, service: ManufacturingService, maxsize: int = 128,
+                 max_rows: Optional[int] = None):
+        self.service = service
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, ...], object, int]]" = OrderedDict()
+        self._rows = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def _cached(self, key: Hashable, tables: Tuple[str, ...],
+                compute: Callable[[], Tuple[object, int]]):
+        versions = self.service.get_data_version(*tables)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] == versions:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._invalidations += 1
+            self._discard(key)
+
+        self._misses += 1
+        result, rows = compute()
+        self._entries[key] = (versions, result, rows)
+        self._rows += rows
+        while self._entries and (len(self._entries) > self.maxsize
+                                 or (self.max_rows is not None and self._rows > self.max_rows)):
+            self._discard(next(iter(self._entries)))
+            self._evictions += 1
+        return result
+
+    def _discard(self, key: Hashable) -> None:
+        _, _, rows = self._entries.pop(key)
+        self._rows -= rows
+
+    def cache_info(self) -> CacheInfo:
+        """Текущие значения счетчиков"""
+        return CacheInfo(self._hits, self._misses, self._evictions,
+                         self._invalidations, len(self._entries), self._rows)
+
+    def clear(self) -> None:
+        """Очищает кэш, сохраняя счетчики"""
+        self._entries.clear()
+        self._rows = 0
+
+    def get_details_by_manufacturer(self) -> DetailRows:
+        """Запрос 1"""
+        def compute():
+            rows = tuple(self.service.get_details_by_manufacturer())
+            return rows, len(rows)
+        return self._cached(("details_by_manufacturer",),
+                            ("manufacturers", "details"), compute)
+
+    def get_total_price_by_manufacturer(self) -> TotalRows:
+        """Запрос 2"""
+        def compute():
+            rows = tuple(self.service.get_total_price_by_manufacturer())
+            return rows, len(rows)
+        return self._cached(("total_price_by_manufacturer",),
+                            ("manufacturers", "details"), compute)
+
+    def get_top_manufacturers_by_total(self, k: int) -> TotalRows:
+        """Первые k строк запроса 2"""
+        def compute():
+            rows = tuple(self.service.get_top_manufacturers_by_total(k))
+            return rows, len(rows)
+        return self._cached(("top_manufacturers_by_total", k),
+                            ("manufacturers", "details"), compute)
+
+    def get_manufacturers_with_details_matching(self, pattern: str) -> DepartmentMapping:
+        """Производители с подстрокой pattern в названии и их детали"""
+        def compute():
+            result = {name: tuple(details_list) for name, details_list
+                      in self.service.iter_manufacturers_with_details_matching(pattern)}
+            rows = sum(len(details_list) for details_list in result.values()) + len(result)
+            return MappingProxyType(result), rows
+        return self._cached(("manufacturers_with_details_matching", pattern),
+                            ("manufacturers", "details", "links"), compute)
+
+    def get_department_manufacturers_with_details(self) -> DepartmentMapping:
+        """Запрос 3"""
+        return self.get_manufacturers_with_details_matching("отдел")
@@ -0,0 +1,701 @@
+"""
+Декларативные запросы к ManufacturingService
+Запрос описывает соединение производителей с деталями по одному из
+отношений, фильтры, группировку по производителю с агрегатами,
+сортировку и ограничение числа строк. Планировщик выбирает доступ к
+данным по индексам сервиса и простой статистике, а выбранный план
+компилируется в функцию на Python, поэтому строки не проходят через
+интерпретатор плана
+Слой запросов читает данные и статистику только публичными методами
+ManufacturingService
+"""
+
+from dataclasses import dataclass, field, replace
+from functools import partial
+from operator import attrgetter, itemgetter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from instrumentation import NULL_RECORDER
+from refactored_manufacturing import ManufacturingService, Relation, fold_case
+
+MANUFACTURER_COLUMNS = ("manufacturer_id", "manufacturer_name")
+DETAIL_COLUMNS = ("detail_id", "detail_name", "price")
+COLUMNS = MANUFACTURER_COLUMNS + DETAIL_COLUMNS
+# Столбцы деталей, которые можно суммировать
+NUMERIC_COLUMNS = ("detail_id", "price")
+
+# Доля строк, проходящих фильтр по диапазону цен, если индекс цен еще
+# не построен и точное число неизвестно
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+
+
+@dataclass(frozen=True)
+class Sum:
+    """Сумма числового столбца деталей группы (price или detail_id);
+    0.0 для группы без деталей"""
+    column: str = "price"
+
+
+@dataclass(frozen=True)
+class Count:
+    """Число деталей группы"""
+
+
+@dataclass(frozen=True)
+class Min:
+    """Наименьшее значение столбца деталей группы или None"""
+    column: str = "price"
+
+
+@dataclass(frozen=True)
+class Max:
+    """Наибольшее значение столбца деталей группы или None"""
+    column: str = "price"
+
+
+@dataclass(frozen=True, init=False)
+class Collect:
+    """Список значений (для нескольких столбцов - кортежей) по деталям группы"""
+    columns: Tuple[str, ...]
+
+    def __init__(self, *columns: str):
+        object.__setattr__(self, "columns", columns or ("detail_name", "price"))
+
+
+Aggregate = Union[Sum, Count, Min, Max, Collect]
+
+
+@dataclass
+class Plan:
+    """Выбранный план: шаги от результата к источникам, оценки и код исполнителя"""
+    steps: List[str]
+    source: str
+    arguments: Dict[str, object]
+    estimated_rows: int
+    cost: int
+
+    def __str__(self) -> str:
+        lines = ["  " * depth + ("-> " if depth else "") + step
+                 for depth, step in enumerate(self.steps)]
+        lines.append(f"Оценка: ≈{self.estimated_rows} строк соединения, стоимость ≈{self.cost}")
+        return "\n".join(lines)
+
+
+@dataclass(frozen=True)
+class Query:
+    """Запрос к каталогу сервиса
+
+    Строки запроса - пары производитель-деталь по relation (как в
+    запросах 1-3: только существующие производители и детали); при
+    outer=True производитель без подходящих деталей дает одну строку с
+    None в столбцах деталей. Методы возвращают новый запрос, повторный
+    where() добавляет условия через И. Без order_by порядок строк
+    определяется планом; сортировка устойчива, None меньше любых значений.
+    """
+    service: ManufacturingService = field(compare=False, repr=False)
+    relation: Relation = Relation.OWNERSHIP
+    outer: bool = False
+    manufacturer_ids: Optional[Tuple[int, ...]] = None
+    name_patterns: Tuple[str, ...] = ()
+    detail_ids: Optional[Tuple[int, ...]] = None
+    price_range: Optional[Tuple[float, float]] = None
+    aggregates: Optional[Tuple[Tuple[str, Aggregate], ...]] = None
+    columns: Optional[Tuple[str, ...]] = None
+    ordering: Tuple[str, ...] = ()
+    row_limit: Optional[int] = None
+
+    def join(self, relation: Relation = Relation.OWNERSHIP, outer: bool = False) -> "Query":
+        """Отношение, по которому детали соединяются с производителями"""
+        return replace(self, relation=relation, outer=outer)
+
+    def where(self, manufacturer_ids: Optional[Iterable[int]] = None,
+              name_contains: Optional[str] = None,
+              detail_ids: Optional[Iterable[int]] = None,
+              price_between: Optional[Tuple[float, float]] = None) -> "Query":
+        """Фильтры: ID производителей, подстрока названия (без учета
+        регистра), ID деталей и цена от low до high включительно"""
+        query = self
+        if manufacturer_ids is not None:
+            ids = tuple(dict.fromkeys(manufacturer_ids))
+            if query.manufacturer_ids is not None:
+                allowed = set(query.manufacturer_ids)
+                ids = tuple(manufacturer_id for manufacturer_id in ids
+                            if manufacturer_id in allowed)
+            query = replace(query, manufacturer_ids=ids)
+        if name_contains is not None:
+            query = replace(query, name_patterns=query.name_patterns + (name_contains,))
+        if detail_ids is not None:
+            ids = tuple(dict.fromkeys(detail_ids))
+            if query.detail_ids is not None:
+                allowed = set(query.detail_ids)
+                ids = tuple(detail_id for detail_id in ids if detail_id in allowed)
+            query = replace(query, detail_ids=ids)
+        if price_between is not None:
+            low, high = price_between
+            if query.price_range is not None:
+                low, high = max(low, query.price_range[0]), min(high, query.price_range[1])
+            query = replace(query, price_range=(low, high))
+        return query
+
+    def group_by(self, **aggregates: Aggregate) -> "Query":
+        """Группировка по производителю; столбцы - поля производителя и агрегаты"""
+        return replace(self, aggregates=tuple(aggregates.items()))
+
+    def select(self, *columns: str) -> "Query":
+        """Столбцы результата"""
+        return replace(self, columns=columns)
+
+    def order_by(self, *columns: str) -> "Query":
+        """Сортировка по столбцам; "-столбец" - по убыванию"""
+        return replace(self, ordering=columns)
+
+    def limit(self, count: int) -> "Query":
+        """Не больше count строк"""
+        return replace(self, row_limit=count)
+
+    def plan(self) -> Plan:
+        """План выполнения по текущим индексам и статистике сервиса"""
+        return _Planner(self).plan()
+
+    def explain(self, verbose: bool = False) -> str:
+        """Текст плана; с verbose - и код исполнителя"""
+        plan = self.plan()
+        return f"{plan}\n\n{plan.source}" if verbose else str(plan)
+
+    def run(self) -> List[tuple]:
+        """Выполняет запрос и возвращает строки-кортежи"""
+        instrumentation = self.service.instrumentation
+        recorder = NULL_RECORDER if instrumentation is None else instrumentation.query("query")
+        with recorder as record:
+            with record.phase("plan"):
+                plan = self.plan()
+                execute = _compile(plan.source)
+            with record.phase("execute"):
+                result = execute(**plan.arguments)
+            record.rows = len(result)
+            return result
+
+
+# Запросы 1-3 сервиса
+
+def details_by_manufacturer_query(service: ManufacturingService,
+                                  relation: Relation = Relation.OWNERSHIP) -> Query:
+    """Запрос 1: то же, что service.get_details_by_manufacturer(relation)"""
+    return (Query(service).join(relation)
+            .select("manufacturer_name", "detail_name", "price")
+            .order_by("manufacturer_id", "detail_id"))
+
+
+def total_price_by_manufacturer_query(service: ManufacturingService,
+                                      relation: Relation = Relation.OWNERSHIP) -> Query:
+    """Запрос 2: то же, что service.get_total_price_by_manufacturer(relation)"""
+    return (Query(service).join(relation, outer=True)
+            .group_by(total=Sum("price"))
+            .select("manufacturer_name", "total")
+            .order_by("-total"))
+
+
+def manufacturers_with_details_matching_query(service: ManufacturingService, pattern: str,
+                                              relation: Relation = Relation.LINKS) -> Query:
+    """Запрос 3 для подстроки pattern; dict(query.run()) совпадает с
+    service.get_manufacturers_with_details_matching(pattern, relation)"""
+    return (Query(service).join(relation, outer=True)
+            .where(name_contains=pattern)
+            .group_by(details=Collect("detail_name", "price"))
+            .select("manufacturer_name", "details"))
+
+
+# Планирование
+
+_compiled: Dict[str, Callable[..., List[tuple]]] = {}
+
+
+def _compile(source: str) -> Callable[..., List[tuple]]:
+    """Функция-исполнитель из исходного кода; одинаковые планы компилируются один раз"""
+    execute = _compiled.get(source)
+    if execute is None:
+        namespace = {"_null_first": _null_first, "itemgetter": itemgetter}
+        exec(compile(source, "<query plan>", "exec"), namespace)
+        execute = _compiled[source] = namespace["execute"]
+    return execute
+
+
+def _null_first(position: int) -> Callable[[tuple], tuple]:
+    """Ключ сортировки, при котором None меньше любых значений"""
+    def key(row: tuple) -> tuple:
+        value = row[position]
+        return (value is not None, value)
+    return key
+
+
+class _Planner:
+    """Выбор плана для запроса и генерация кода исполнителя"""
+
+    def __init__(self, query: Query):
+        self.query = query
+        self.service = query.service
+        self.grouped = query.aggregates is not None
+        self.aggregates = dict(query.aggregates or ())
+        self.steps: List[str] = []
+        self.arguments: Dict[str, object] = {}
+        self._validate()
+
+    def _validate(self) -> None:
+        query = self.query
+        if self.grouped:
+            available = MANUFACTURER_COLUMNS + tuple(self.aggregates)
+            for name, aggregate in self.aggregates.items():
+                if not isinstance(aggregate, (Sum, Count, Min, Max, Collect)):
+                    raise TypeError(f"Неизвестный агрегат {name}: {aggregate!r}")
+                if name in MANUFACTURER_COLUMNS:
+                    raise ValueError(f"Имя агрегата совпадает со столбцом: {name}")
+                allowed = (COLUMNS if isinstance(aggregate, Collect)
+                           else NUMERIC_COLUMNS if isinstance(aggregate, Sum) else DETAIL_COLUMNS)
+                for column in getattr(aggregate, "columns", (getattr(aggregate, "column", None),)):
+                    if column is not None and column not in allowed:
+                        raise ValueError(f"Неизвестный столбец агрегата {name}: {column}")
+        else:
+            available = COLUMNS
+        self.columns = query.columns if query.columns is not None else available
+        self.ordering = [(column.lstrip("-"), column.startswith("-"))
+                         for column in query.ordering]
+        for column in tuple(self.columns) + tuple(column for column, _ in self.ordering):
+            if column not in available:
+                raise ValueError(f"Неизвестный столбец: {column}")
+        if query.row_limit is not None and query.row_limit < 0:
+            raise ValueError("Ограничение числа строк не может быть отрицательным")
+
+    # Выбор доступа к данным
+
+    def plan(self) -> Plan:
+        query, service = self.query, self.service
+        candidates, candidates_step = self._candidates()
+        sort_columns = [column for column, _ in self.ordering]
+        self.ordered_scan = (not self.grouped and sort_columns in (
+            ["manufacturer_id"], ["manufacturer_id", "detail_id"])
+            and not any(descending for _, descending in self.ordering))
+        self.sorted_groups = self.ordered_scan and len(sort_columns) == 2
+        # Запрос 1 без фильтров производителей: группы в порядке
+        # iter_sorted_detail_groups() сервиса
+        self.service_groups = self.ordered_scan and not query.outer and candidates is None
+
+        links = query.relation is Relation.LINKS
+        if candidates is None:
+            group_rows, = service.get_row_counts("links" if links else "details")
+        else:
+            group_rows = sum(service.get_group_size(manufacturer.manufacturer_id, query.relation)
+                             for manufacturer in candidates)
+
+        # Стоимость - число просмотренных строк; связь по ID детали
+        # ищется в большом словаре деталей и стоит вдвое дороже
+        options = [(group_rows * (2 if links else 1), "nested", None, group_rows)]
+        for source in self._detail_sources():
+            kind, rows, build_cost = source[0], source[1], source[3]
+            if links and not (self.sorted_groups or self.service_groups):
+                options.append((build_cost + rows + group_rows, "hash", source, group_rows))
+            elif not self.ordered_scan and (self.grouped or not query.outer):
+                options.append((build_cost + rows, "details", source, rows))
+        cost, strategy, source, estimated_rows = min(options, key=itemgetter(0))
+
+        self.arguments.update(related=partial(service.iter_related_details,
+                                              relation=query.relation),
+                              low=None, high=None, detail_ids=None, source=None,
+                              find_manufacturer=None, sorted_details=None,
+                              limit=query.row_limit)
+        if query.price_range is not None:
+            self.arguments.update(low=query.price_range[0], high=query.price_range[1])
+        if query.detail_ids is not None:
+            self.arguments["detail_ids"] = frozenset(query.detail_ids)
+
+        if self.sorted_groups and not self.service_groups:
+            self.arguments["sorted_details"] = partial(service.get_sorted_details,
+                                                       relation=query.relation)
+        if candidates is None:
+            if self.service_groups:
+                # Пары (производитель, детали по возрастанию ID)
+                candidates = _Deferred(partial(service.iter_sorted_detail_groups,
+                                               query.relation))
+                candidates_step += ", по возрастанию ID по индексу групп"
+            elif self.ordered_scan:
+                candidates = sorted(service.manufacturers, key=attrgetter("manufacturer_id"))
+                candidates_step += ", по возрастанию ID"
+            else:
+                candidates = service.manufacturers
+            find_manufacturer = service.get_manufacturer
+        else:
+            if self.ordered_scan:
+                candidates = sorted(candidates, key=attrgetter("manufacturer_id"))
+                candidates_step += ", по возрастанию ID"
+            find_manufacturer = {manufacturer.manufacturer_id: manufacturer
+                                 for manufacturer in candidates}.get
+        self.arguments.update(candidates=candidates, find_manufacturer=find_manufacturer)
+
+        relation_step = ("по индексу связей и словарю деталей" if links
+                         else "по индексу групп Detail.manufacturer_id")
+        join_type = "внешнее" if query.outer else "внутреннее"
+        detail_filter = self._detail_filter(source)
+        if strategy == "nested":
+            body = self._manufacturer_driven(detail_filter, lookup="details")
+            join_steps = [f"Вложенный цикл, {join_type} соединение {relation_step} "
+                          f"(≈{group_rows} строк)", candidates_step]
+        elif strategy == "hash":
+            self.arguments["source"] = source[2]
+            body = self._manufacturer_driven(None, lookup="table", build=detail_filter)
+            join_steps = [f"Хеш-соединение, {join_type}: связи производителей с хеш-таблицей "
+                          f"деталей (≈{group_rows} связей)", candidates_step,
+                          f"Хеш-таблица деталей: {source[4]} (≈{source[1]} строк)"]
+        else:
+            self.arguments["source"] = source[2]
+            body = self._detail_driven(detail_filter)
+            join_steps = [f"Хеш-соединение, {join_type}: детали с производителями "
+                          f"по Detail.manufacturer_id", f"{source[4]} (≈{source[1]} строк)",
+                          candidates_step]
+        if detail_filter:
+            join_steps.insert(1, f"Фильтр деталей: {self._filter_text(source)}")
+
+        steps = []
+        if query.row_limit is not None:
+            steps.append(f"Ограничение: {query.row_limit}")
+        if self.ordering and not self.ordered_scan:
+            steps.append(f"Сортировка: {', '.join(query.ordering)}")
+        elif self.ordering:
+            steps.append(f"Сортировка не нужна: порядок индекса ({', '.join(query.ordering)})")
+        if self.grouped:
+            steps.append("Группировка по производителю: " + ", ".join(
+                f"{name}={_describe(aggregate)}" for name, aggregate in self.aggregates.items()))
+        steps += join_steps
+
+        return Plan(steps, self._function(body), self.arguments, estimated_rows, cost)
+
+    def _candidates(self):
+        """Производители после фильтров (None - все) и шаг плана"""
+        query, service = self.query, self.service
+        if query.manufacturer_ids is None and not query.name_patterns:
+            count, = service.get_row_counts("manufacturers")
+            return None, f"Просмотр всех производителей ({count})"
+
+        steps = []
+        ids: Optional[List[int]] = None
+        if query.manufacturer_ids is not None:
+            ids = [manufacturer_id for manufacturer_id in query.manufacturer_ids
+                   if service.get_manufacturer(manufacturer_id) is not None]
+            steps.append("поиск по ID")
+        for pattern in query.name_patterns:
+            found = [manufacturer.manufacturer_id
+                     for manufacturer in service.find_manufacturers(pattern)]
+            steps.append(f"поиск по триграммам {pattern!r}" if len(fold_case(pattern)) >= 3
+                         else f"просмотр названий {pattern!r}")
+            if ids is None:
+                ids = found
+            else:
+                allowed = set(found)
+                ids = [manufacturer_id for manufacturer_id in ids if manufacturer_id in allowed]
+        candidates = [service.get_manufacturer(manufacturer_id) for manufacturer_id in ids]
+        return candidates, f"Производители: {', '.join(steps)} ({len(candidates)})"
+
+    def _detail_sources(self):
+        """Варианты отбора деталей по индексам:
+        (вид, оценка строк, источник, стоимость построения, описание)"""
+        query, service = self.query, self.service
+        sources = []
+        if query.detail_ids is not None:
+            ids = query.detail_ids
+            sources.append(("ids", len(ids),
+                            (detail for detail in map(service.get_detail, ids)
+                             if detail is not None),
+                            0, f"Поиск деталей по ID ({len(ids)})"))
+        if query.price_range is not None:
+            low, high = query.price_range
+            rows = service.count_details_in_price_range(low, high, build_index=False)
+            build_cost = 0
+            if rows is None:
+                # Индекс цен строится при первом использовании
+                build_cost, = service.get_row_counts("details")
+                rows = int(build_cost * DEFAULT_RANGE_SELECTIVITY)
+            sources.append(("price", rows,
+                            _Deferred(partial(service.get_details_in_price_range, low, high)),
+                            build_cost, f"Просмотр диапазона индекса цен [{low}, {high}]"))
+        return sources
+
+    def _detail_filter(self, source) -> Optional[str]:
+        """Условие на деталь, которое не обеспечено источником деталей;
+        вместо {detail} подставляется выражение детали"""
+        conditions = []
+        kind = source[0] if source is not None else None
+        if self.query.price_range is not None and kind != "price":
+            conditions.append("low <= {detail}.price <= high")
+        if self.query.detail_ids is not None and kind != "ids":
+            conditions.append("{detail}.detail_id in detail_ids")
+        return " and ".join(conditions) or None
+
+    def _filter_text(self, source) -> str:
+        kind = source[0] if source is not None else None
+        conditions = []
+        if self.query.price_range is not None and kind != "price":
+            conditions.append("цена в [{}, {}]".format(*self.query.price_range))
+        if self.query.detail_ids is not None and kind != "ids":
+            conditions.append(f"ID детали среди {len(self.query.detail_ids)}")
+        return " и ".join(conditions)
+
+    # Генерация кода
+
+    def _function(self, body: List[str]) -> str:
+        lines = ["def execute(candidates, find_manufacturer, related, source,",
+                 "            low, high, detail_ids, sorted_details, limit):"]
+        lines += body
+        lines += self._finish()
+        lines.append("    return result")
+        return "\n".join(lines) + "\n"
+
+    def _row_columns(self) -> List[str]:
+        """Выбранные столбцы и скрытые столбцы сортировки"""
+        columns = list(self.columns)
+        if self.ordering and not self.ordered_scan:
+            columns += [column for column, _ in self.ordering if column not in columns]
+        return columns
+
+    def _detail_row(self, manufacturer_locals: bool, null_details: bool = False,
+                    detail: str = "detail") -> str:
+        values = []
+        for column in self._row_columns():
+            if column in MANUFACTURER_COLUMNS:
+                values.append(column if manufacturer_locals else f"manufacturer.{column}")
+            else:
+                values.append("None" if null_details else f"{detail}.{column}")
+        return "(" + ", ".join(values) + ("," if len(values) == 1 else "") + ")"
+
+    def _group_row(self, manufacturer_locals: bool, state: Optional[str] = None) -> str:
+        positions = {name: position for position, name in enumerate(self.aggregates)}
+        values = []
+        for column in self._row_columns():
+            if column in MANUFACTURER_COLUMNS:
+                values.append(column if manufacturer_locals else f"manufacturer.{column}")
+            elif state is None:
+                values.append(f"aggregate{positions[column]}")
+            else:
+                values.append(f"{state}[{positions[column]}]")
+        return "(" + ", ".join(values) + ("," if len(values) == 1 else "") + ")"
+
+    def _manufacturer_columns(self) -> List[str]:
+        """Поля производителя, нужные строкам и агрегатам"""
+        needed = set(self._row_columns())
+        for aggregate in self.aggregates.values():
+            needed.update(getattr(aggregate, "columns", ()))
+        return [column for column in MANUFACTURER_COLUMNS if column in needed]
+
+    def _inner_loop(self, lookup: str) -> List[str]:
+        """Цикл по деталям группы group производителя; деталь - detail"""
+        if lookup == "table":
+            return ["for detail in group:",
+                    "    if detail.detail_id not in table:",
+                    "        continue"]
+        return ["for detail in group:"]
+
+    def _detail_clauses(self, lookup: str, detail_filter: Optional[str]) -> Tuple[str, str]:
+        """for- и if-части генератора по деталям группы group и выражение детали"""
+        conditions = []
+        if self.service_groups:
+            # Группы сервиса уже содержат отсортированные детали
+            detail = "detail"
+            clauses = "for detail in group"
+        elif self.sorted_groups:
+            detail = "detail"
+            clauses = "for detail in sorted_details(manufacturer.manufacturer_id)"
+        else:
+            detail = "detail"
+            clauses = "for detail in group"
+            if lookup == "table":
+                conditions.append("detail.detail_id in table")
+        if detail_filter:
+            conditions.append(detail_filter.format(detail=detail))
+        if conditions:
+            clauses += " if " + " and ".join(conditions)
+        return clauses, detail
+
+    def _group_source(self) -> str:
+        return "related(manufacturer.manufacturer_id)"
+
+    def _manufacturer_driven(self, detail_filter: Optional[str], lookup: str,
+                             build: Optional[str] = None) -> List[str]:
+        """Цикл по производителям и их группам деталей (вложенный цикл или
+        проба хеш-таблицы table)"""
+        query = self.query
+        lines = []
+        if lookup == "table":
+            condition = f" if {build.format(detail='detail')}" if build else ""
+            lines.append(f"    table = {{detail.detail_id for detail in source{condition}}}")
+
+        if not self.grouped and not query.outer and not self._early_limit():
+            # Все строки одним генератором списка
+            clauses, detail = self._detail_clauses(lookup, detail_filter)
+            row = self._detail_row(manufacturer_locals=False, detail=detail)
+            if self.service_groups:
+                return lines + [f"    result = [{row} for manufacturer, group in candidates "
+                                f"{clauses}]"]
+            if self.sorted_groups:
+                return lines + [f"    result = [{row} for manufacturer in candidates {clauses}]"]
+            return lines + [f"    result = [{row} for manufacturer in candidates "
+                            f"for group in [{self._group_source()}] {clauses}]"]
+
+        lines += ["    result = []",
+                  "    append = result.append",
+                  "    for manufacturer, group in candidates:" if self.service_groups
+                  else "    for manufacturer in candidates:"]
+        body = [f"{column} = manufacturer.{column}" for column in self._manufacturer_columns()]
+        if not (self.service_groups or self.sorted_groups):
+            body.append(f"group = {self._group_source()}")
+        limit_check = ["if limit is not None and len(result) >= limit:",
+                       "    del result[limit:]",
+                       "    return result"]
+
+        if not self.grouped:
+            clauses, detail = self._detail_clauses(lookup, detail_filter)
+            comprehension = f"[{self._detail_row(True, detail=detail)} {clauses}]"
+            if query.outer:
+                body += [f"rows = {comprehension}",
+                         "if rows:",
+                         "    result += rows",
+                         "else:",
+                         f"    append({self._detail_row(True, null_details=True)})"]
+            else:
+                body.append(f"result += {comprehension}")
+            if self._early_limit():
+                body += limit_check
+        else:
+            body += [f"aggregate{position} = {_initial(aggregate)}"
+                     for position, aggregate in enumerate(self.aggregates.values())]
+            if not query.outer:
+                body.append("matched = False")
+            inner = self._inner_loop(lookup)
+            step = []
+            if detail_filter:
+                step += [f"if not ({detail_filter.format(detail='detail')}):", "    continue"]
+            if not query.outer:
+                step.append("matched = True")
+            for position, aggregate in enumerate(self.aggregates.values()):
+                step += _update(aggregate, f"aggregate{position}", manufacturer_locals=True)
+            inner += ["    " + line for line in step]
+            body += inner
+            if query.outer:
+                body.append(f"append({self._group_row(manufacturer_locals=True)})")
+            else:
+                body += ["if matched:",
+                         f"    append({self._group_row(manufacturer_locals=True)})"]
+            if self._early_limit():
+                body += limit_check
+        return lines + ["        " + line for line in body]
+
+    def _detail_driven(self, detail_filter: Optional[str]) -> List[str]:
+        """Цикл по отобранным деталям с поиском производителя через find_manufacturer"""
+        query = self.query
+        lines = ["    result = []",
+                 "    append = result.append",
+                 "    for detail in source:",
+                 "        manufacturer = find_manufacturer(detail.manufacturer_id)",
+                 "        if manufacturer is None:",
+                 "            continue"]
+        if detail_filter:
+            lines += [f"        if not ({detail_filter.format(detail='detail')}):",
+                      "            continue"]
+        if not self.grouped:
+            lines.append(f"        append({self._detail_row(manufacturer_locals=False)})")
+            if self._early_limit():
+                lines += ["        if len(result) >= limit:",
+                          "            del result[limit:]",
+                          "            return result"]
+            return lines
+
+        initial = "[" + ", ".join(_initial(aggregate)
+                                  for aggregate in self.aggregates.values()) + "]"
+        lines = lines[:2] + ["    groups = {}"] + lines[2:] + [
+            "        state = groups.get(detail.manufacturer_id)",
+            "        if state is None:",
+            f"            state = groups[detail.manufacturer_id] = {initial}"]
+        for position, aggregate in enumerate(self.aggregates.values()):
+            lines += ["        " + line
+                      for line in _update(aggregate, f"state[{position}]", manufacturer_locals=False)]
+        # Группы выдаются в порядке производителей
+        lines += ["    for manufacturer in candidates:",
+                  "        state = groups.get(manufacturer.manufacturer_id)",
+                  "        if state is None:"]
+        lines.append(f"            state = {initial}" if query.outer else "            continue")
+        lines.append(f"        append({self._group_row(manufacturer_locals=False, state='state')})")
+        if self._early_limit():
+            lines += ["        if len(result) >= limit:",
+                      "            del result[limit:]",
+                      "            return result"]
+        return lines
+
+    def _early_limit(self) -> bool:
+        return self.query.row_limit is not None and not (self.ordering and not self.ordered_scan)
+
+    def _finish(self) -> List[str]:
+        """Сортировка, ограничение и отбрасывание скрытых столбцов"""
+        lines = []
+        row_columns = self._row_columns()
+        if self.ordering and not self.ordered_scan:
+            nullable = set() if not self.grouped else {
+                name for name, aggregate in self.aggregates.items()
+                if isinstance(aggregate, (Min, Max))}
+            if not self.grouped and self.query.outer:
+                nullable.update(DETAIL_COLUMNS)
+            # Устойчивая сортировка по ключам от последнего к первому
+            for column, descending in reversed(self.ordering):
+                position = row_columns.index(column)
+                key = (f"_null_first({position})" if column in nullable
+                       else f"itemgetter({position})")
+                reverse = ", reverse=True" if descending else ""
+                lines.append(f"    result.sort(key={key}{reverse})")
+        if self.query.row_limit is not None:
+            lines.append("    del result[limit:]")
+        if len(row_columns) > len(self.columns):
+            width = len(self.columns)
+            lines.append(f"    result = [row[:{width}] for row in result]")
+        return lines
+
+
+class _Deferred:
+    """Источник деталей, который строится при выполнении плана"""
+
+    def __init__(self, build: Callable[[], Iterable]):
+        self._build = build
+
+    def __iter__(self):
+        return iter(self._build())
+
+
+def _initial(aggregate: Aggregate) -> str:
+    if isinstance(aggregate, Sum):
+        return "0.0" if aggregate.column == "price" else "0"
+    if isinstance(aggregate, Count):
+        return "0"
+    if isinstance(aggregate, Collect):
+        return "[]"
+    return "None"
+
+
+def _update(aggregate: Aggregate, target: str, manufacturer_locals: bool) -> List[str]:
+    """Строки кода, учитывающие detail в агрегате target"""
+    if isinstance(aggregate, Sum):
+        return [f"{target} += detail.{aggregate.column}"]
+    if isinstance(aggregate, Count):
+        return [f"{target} += 1"]
+    if isinstance(aggregate, Collect):
+        values = [(column if manufacturer_locals else f"manufacturer.{column}")
+                  if column in MANUFACTURER_COLUMNS else f"detail.{column}"
+                  for column in aggregate.columns]
+        value = values[0] if len(values) == 1 else "(" + ", ".join(values) + ")"
+        return [f"{target}.append({value})"]
+    comparison = "<" if isinstance(aggregate, Min) else ">"
+    return [f"value = detail.{aggregate.column}",
+            f"if {target} is None or value {comparison} {target}:",
+            f"    {target} = value"]
+
+
+def _describe(aggregate: Aggregate) -> str:
+    name = type(aggregate).__name__.lower()
+    if isinstance(aggregate, Count):
+        return "count()"
+    if isinstance(aggregate, Collect):
+        return f"collect({', '.join(aggregate.columns)})"
+    return f"{name}({aggregate.column})"
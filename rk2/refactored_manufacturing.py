@@ -4,8 +4,17 @@
 """
 
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from enum import Enum
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Dict, Iterable, Iterator, Optional, Set, Tuple
 from collections import defaultdict
+from itertools import islice
+import copy
+import heapq
+import sys
+import unicodedata
+
+from instrumentation import NULL_RECORDER, Instrumentation
 
 @dataclass
 class Manufacturer:
@@ -28,85 +37,1122 @@ class ManufacturerDetail:
     detail_id: int
 
 
+class Relation(Enum):
+    """Отношение, по которому детали сопоставляются производителям"""
+    OWNERSHIP = "ownership"  # поле Detail.manufacturer_id, один ко многим
+    LINKS = "links"          # таблица ManufacturerDetail, многие ко многим
+
+
+class ChangeKind(Enum):
+    """Вид изменения записи"""
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+
+
+class ReadOnlyServiceError(RuntimeError):
+    """Изменение версии сервиса, общей с другими версиями (см. fork)"""
+
+
+@dataclass(frozen=True)
+class Change:
+    """Изменение одной записи таблицы "manufacturers", "details" или "links"
+
+    Для вставки и обновления record - новая запись; для удаления - ID
+    производителя или детали, а для связи - сама связь ManufacturerDetail.
+    """
+    kind: ChangeKind
+    table: str
+    record: object
+
+
+@dataclass(frozen=True)
+class Reports:
+    """Результаты запросов 1-3, посчитанные run_all_reports"""
+    details_by_manufacturer: List[Tuple[str, str, float]]
+    total_price_by_manufacturer: List[Tuple[str, float]]
+    manufacturers_with_details: Dict[str, List[Tuple[str, float]]]
+
+
+class ManufacturerTotals:
+    """Материализованные суммы и количества деталей по производителям
+
+    Суммы обновляются за O(1) при каждом изменении детали, а рейтинг
+    производителей по убыванию суммы хранится в отсортированном списке
+    ключей (-сумма, порядковый номер, ID) и обновляется бинарным поиском.
+    Порядковый номер сохраняет порядок добавления производителей при
+    равных суммах, как стабильная сортировка в полном пересчете.
+    """
+
+    def __init__(self):
+        self.totals: Dict[int, float] = {}
+        self.counts: Dict[int, int] = {}
+        self._ranking: List[Tuple[float, int, int]] = []
+        self._ranking_keys: Dict[int, Tuple[float, int, int]] = {}
+        self._next_seq = 0
+
+    def copy(self) -> "ManufacturerTotals":
+        """Независимая копия сумм и рейтинга, O(m)"""
+        totals = ManufacturerTotals()
+        totals.totals = dict(self.totals)
+        totals.counts = dict(self.counts)
+        totals._ranking = list(self._ranking)
+        totals._ranking_keys = dict(self._ranking_keys)
+        totals._next_seq = self._next_seq
+        return totals
+
+    def add_member(self, manufacturer_id: int) -> None:
+        """Включает производителя в рейтинг"""
+        key = (-self.totals.get(manufacturer_id, 0.0), self._next_seq, manufacturer_id)
+        self._next_seq += 1
+        self._ranking_keys[manufacturer_id] = key
+        insort(self._ranking, key)
+
+    def remove_member(self, manufacturer_id: int) -> None:
+        """Исключает производителя из рейтинга"""
+        key = self._ranking_keys.pop(manufacturer_id)
+        del self._ranking[bisect_left(self._ranking, key)]
+
+    def add_price(self, manufacturer_id: int, price: float) -> None:
+        """Учитывает стоимость новой детали производителя"""
+        self.totals[manufacturer_id] = self.totals.get(manufacturer_id, 0.0) + price
+        self.counts[manufacturer_id] = self.counts.get(manufacturer_id, 0) + 1
+        self._rerank(manufacturer_id)
+
+    def remove_price(self, manufacturer_id: int, price: float) -> None:
+        """Исключает стоимость удаленной детали производителя"""
+        count = self.counts[manufacturer_id] - 1
+        if count:
+            self.counts[manufacturer_id] = count
+            self.totals[manufacturer_id] -= price
+        else:
+            # Без деталей сумма ровно 0.0, накопленная погрешность сбрасывается
+            del self.counts[manufacturer_id]
+            del self.totals[manufacturer_id]
+        self._rerank(manufacturer_id)
+
+    def _rerank(self, manufacturer_id: int) -> None:
+        key = self._ranking_keys.get(manufacturer_id)
+        if key is not None:
+            del self._ranking[bisect_left(self._ranking, key)]
+            key = (-self.totals.get(manufacturer_id, 0.0), key[1], manufacturer_id)
+            self._ranking_keys[manufacturer_id] = key
+            insort(self._ranking, key)
+
+    def iter_ranked(self) -> Iterator[Tuple[int, float]]:
+        """Пары (ID производителя, сумма) по убыванию суммы"""
+        for _, _, manufacturer_id in self._ranking:
+            yield manufacturer_id, self.totals.get(manufacturer_id, 0.0)
+
+    def iter_above(self, threshold: float) -> Iterator[Tuple[int, float]]:
+        """Пары рейтинга с суммой больше threshold; начало находится бинарным поиском"""
+        # Ключи (-сумма, ...) меньше (-threshold,) ровно у сумм больше threshold
+        stop = bisect_left(self._ranking, (-threshold,))
+        for _, _, manufacturer_id in islice(self._ranking, stop):
+            yield manufacturer_id, self.totals.get(manufacturer_id, 0.0)
+
+    def top(self, k: int) -> List[Tuple[int, float]]:
+        """Первые k пар рейтинга"""
+        return [(manufacturer_id, self.totals.get(manufacturer_id, 0.0))
+                for _, _, manufacturer_id in self._ranking[:k]]
+
+
+class PriceIndex:
+    """Детали, упорядоченные по цене: общий список и списки производителей
+
+    Общий список хранит ключи (цена, ID детали) по возрастанию, списки
+    производителей по Detail.manufacturer_id - ключи (-цена, ID детали),
+    чтобы самые дорогие детали шли первыми. Позиции находятся бинарным
+    поиском; вставка и удаление сдвигают хвост списка.
+    """
+
+    def __init__(self, details: Iterable[Detail]):
+        self._by_price: List[Tuple[float, int]] = []
+        self._by_manufacturer: Dict[int, List[Tuple[float, int]]] = {}
+        for detail in details:
+            self._by_price.append((detail.price, detail.detail_id))
+            self._by_manufacturer.setdefault(detail.manufacturer_id, []).append(
+                (-detail.price, detail.detail_id))
+        self._by_price.sort()
+        for keys in self._by_manufacturer.values():
+            keys.sort()
+
+    def fork(self, manufacturer_ids: Iterable[int]) -> "PriceIndex":
+        """Копия индекса, в которой можно менять детали производителей manufacturer_ids
+
+        Списки остальных производителей общие с исходным индексом.
+        """
+        index = PriceIndex(())
+        index._by_price = list(self._by_price)
+        index._by_manufacturer = dict(self._by_manufacturer)
+        for manufacturer_id in manufacturer_ids:
+            keys = index._by_manufacturer.get(manufacturer_id)
+            if keys is not None:
+                index._by_manufacturer[manufacturer_id] = list(keys)
+        return index
+
+    def add(self, detail: Detail) -> None:
+        """Добавляет деталь в индекс"""
+        insort(self._by_price, (detail.price, detail.detail_id))
+        insort(self._by_manufacturer.setdefault(detail.manufacturer_id, []),
+               (-detail.price, detail.detail_id))
+
+    def remove(self, detail: Detail) -> None:
+        """Удаляет деталь с ее текущими ценой и производителем"""
+        del self._by_price[bisect_left(self._by_price, (detail.price, detail.detail_id))]
+        keys = self._by_manufacturer[detail.manufacturer_id]
+        del keys[bisect_left(keys, (-detail.price, detail.detail_id))]
+        if not keys:
+            del self._by_manufacturer[detail.manufacturer_id]
+
+    def most_expensive(self, manufacturer_id: int, k: int) -> List[int]:
+        """ID k самых дорогих деталей производителя, при равной цене - по ID"""
+        return [detail_id for _, detail_id in self._by_manufacturer.get(manufacturer_id, [])[:k]]
+
+    def count(self, low: float, high: float) -> int:
+        """Число деталей с ценой от low до high включительно, O(log n)"""
+        start = bisect_left(self._by_price, (low, -float("inf")))
+        return max(0, bisect_right(self._by_price, (high, float("inf"))) - start)
+
+    def in_range(self, low: float, high: float) -> Iterator[int]:
+        """ID деталей с ценой от low до high включительно по возрастанию цены"""
+        start = bisect_left(self._by_price, (low, -float("inf")))
+        stop = bisect_right(self._by_price, (high, float("inf")))
+        for _, detail_id in islice(self._by_price, start, stop):
+            yield detail_id
+
+
+def fold_case(text: str) -> str:
+    """Приводит строку к виду для регистронезависимого сравнения (Unicode casefold)"""
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+class TrigramIndex:
+    """Индекс триграмм по названиям производителей
+
+    Названия хранятся в приведенном регистре (fold_case). Для подстроки
+    из трех и более символов кандидаты берутся пересечением списков
+    триграмм, начиная с самого короткого, и затем проверяются точным
+    вхождением. Более короткие подстроки проверяются по всем названиям.
+    """
+
+    def __init__(self):
+        self._folded: Dict[int, str] = {}
+        self._positions: Dict[int, int] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._next_position = 0
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def fork(self, names: Iterable[str]) -> "TrigramIndex":
+        """Копия индекса, в которой можно индексировать и удалять названия names
+
+        Общими с исходным индексом остаются списки триграмм, которых нет
+        в names.
+        """
+        index = TrigramIndex()
+        index._folded = dict(self._folded)
+        index._positions = dict(self._positions)
+        index._postings = self._postings.copy()
+        index._next_position = self._next_position
+        copied: Set[str] = set()
+        for name in names:
+            for trigram in self._trigrams(fold_case(name)) - copied:
+                postings = self._postings.get(trigram)
+                if postings is not None:
+                    index._postings[trigram] = set(postings)
+                copied.add(trigram)
+        return index
+
+    def add(self, manufacturer_id: int, name: str) -> None:
+        """Индексирует название нового производителя"""
+        self._positions[manufacturer_id] = self._next_position
+        self._next_position += 1
+        self._set_name(manufacturer_id, name)
+
+    def update(self, manufacturer_id: int, name: str) -> None:
+        """Переиндексирует название, сохраняя позицию производителя"""
+        self._drop_name(manufacturer_id)
+        self._set_name(manufacturer_id, name)
+
+    def remove(self, manufacturer_id: int) -> None:
+        """Удаляет производителя из индекса"""
+        self._drop_name(manufacturer_id)
+        del self._folded[manufacturer_id]
+        del self._positions[manufacturer_id]
+
+    def _set_name(self, manufacturer_id: int, name: str) -> None:
+        folded = fold_case(name)
+        self._folded[manufacturer_id] = folded
+        for trigram in self._trigrams(folded):
+            self._postings[trigram].add(manufacturer_id)
+
+    def _drop_name(self, manufacturer_id: int) -> None:
+        for trigram in self._trigrams(self._folded[manufacturer_id]):
+            postings = self._postings[trigram]
+            postings.discard(manufacturer_id)
+            if not postings:
+                del self._postings[trigram]
+
+    def search(self, substring: str) -> List[int]:
+        """ID производителей, в названии которых есть подстрока, в порядке добавления"""
+        folded = fold_case(substring)
+        trigrams = self._trigrams(folded)
+        if trigrams:
+            postings = sorted((self._postings.get(trigram, set()) for trigram in trigrams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            candidates = self._folded.keys()
+
+        matches = [manufacturer_id for manufacturer_id in candidates
+                   if folded in self._folded[manufacturer_id]]
+        return sorted(matches, key=self._positions.__getitem__)
+
+
 class ManufacturingService:
-    """Сервис для работы с данными о производителях и деталях"""
+    """Сервис для работы с данными о производителях и деталях
+
+    Индексы (ID -> объект, производитель -> детали) строятся один раз
+    при создании сервиса и поддерживаются в согласованном состоянии
+    методами add_*/update_*/remove_*, поэтому запросы их не пересобирают.
+
+    При incremental_totals=True суммы по производителям и их рейтинг
+    поддерживаются инкрементально (см. ManufacturerTotals), и запрос 2
+    не сканирует детали. Суммы в этом режиме накапливаются в порядке
+    изменений и после переоценки деталей могут отличаться от полного
+    пересчета в последних знаках.
+
+    Вместо Manufacturer, Detail и ManufacturerDetail можно передавать
+    их компактные варианты из compact_records: сервис читает только поля.
+
+    С instrumentation построение индексов и запросы 1-3 измеряются по
+    фазам (см. instrumentation); без него измерения не выполняются.
+
+    fork() строит следующую версию сервиса, не изменяя текущую (см.
+    versioned_service). Версии делят неизмененные индексы, поэтому после
+    fork() обе версии доступны только для чтения: методы
+    add_*/update_*/remove_* и apply_changes() вызывают
+    ReadOnlyServiceError, а следующие изменения передаются в fork().
+    """
 
     def __init__(self, manufacturers: List[Manufacturer],
                  details: List[Detail],
-                 manufacturer_details: List[ManufacturerDetail]):
-        self.manufacturers = manufacturers
-        self.details = details
-        self.manufacturer_details = manufacturer_details
+                 manufacturer_details: List[ManufacturerDetail],
+                 incremental_totals: bool = False,
+                 instrumentation: Optional[Instrumentation] = None):
+        # Словари сохраняют порядок вставки, он же задает порядок обхода
+        self._manufacturers_by_id: Dict[int, Manufacturer] = {}
+        self._details_by_id: Dict[int, Detail] = {}
+        # detail_id -> порядковый номер добавления: деталь, перенесенная к
+        # другому производителю, встает в его группу на место по этому номеру,
+        # и порядок групп совпадает с порядком _details_by_id
+        self._detail_seqs: Dict[int, int] = {}
+        self._next_detail_seq = 0
+        # manufacturer_id -> {detail_id: Detail} по полю Detail.manufacturer_id
+        self._owned_details: Dict[int, Dict[int, Detail]] = {}
+        # Отсортированные ключи _owned_details для запроса 1; строятся при
+        # первом запросе и дальше поддерживаются при изменениях
+        self._owned_ids: Optional[List[int]] = None
+        # manufacturer_id -> отсортированные ID деталей группы; список
+        # строится при первом обходе группы запросом 1 и дальше
+        # поддерживается при изменениях (insort/bisect)
+        self._sorted_detail_ids: Dict[int, List[int]] = {}
+        # manufacturer_id -> [ManufacturerDetail] по таблице связей
+        self._links_by_manufacturer: Dict[int, List[ManufacturerDetail]] = {}
+        self._totals: Optional[ManufacturerTotals] = (
+            ManufacturerTotals() if incremental_totals else None)
+        # Индекс цен строится при первом ценовом запросе
+        self._prices: Optional[PriceIndex] = None
+        self._name_index = TrigramIndex()
+        # Счетчики версий таблиц, увеличиваются при каждом изменении
+        self._versions: Dict[str, int] = {"manufacturers": 0, "details": 0, "links": 0}
+        self.instrumentation = instrumentation
+        self._read_only = False
+
+        with self._record("build") as record:
+            with record.phase("manufacturers"):
+                for manufacturer in manufacturers:
+                    self.add_manufacturer(manufacturer)
+            with record.phase("details"):
+                for detail in details:
+                    self.add_detail(detail)
+            with record.phase("links"):
+                for link in manufacturer_details:
+                    self.add_link(link)
+            record.rows = len(self._details_by_id)
+
+    def _record(self, query: str):
+        """Контекст измерения запроса; без instrumentation ничего не измеряет"""
+        if self.instrumentation is None:
+            return NULL_RECORDER
+        return self.instrumentation.query(query)
+
+    # Списки записей собираются из индексов заново при каждом обращении,
+    # O(n): изменения возвращенного списка не попадают в сервис (для этого
+    # есть add_*/update_*/remove_*), а для числа строк есть get_row_counts()
+
+    @property
+    def manufacturers(self) -> List[Manufacturer]:
+        """Новый список производителей в порядке добавления"""
+        return list(self._manufacturers_by_id.values())
+
+    @property
+    def details(self) -> List[Detail]:
+        """Новый список деталей в порядке добавления"""
+        return list(self._details_by_id.values())
+
+    @property
+    def manufacturer_details(self) -> List[ManufacturerDetail]:
+        """Новый список связей, сгруппированный по производителям
+
+        Производители идут в порядке их первой связи, связи внутри
+        группы - в порядке добавления; общий порядок добавления связей
+        не сохраняется.
+        """
+        return [link
+                for links in self._links_by_manufacturer.values()
+                for link in links]
+
+    def get_row_counts(self, *tables: str) -> Tuple[int, ...]:
+        """Число строк таблиц ("manufacturers", "details", "links"); по умолчанию всех
+
+        Списки не копируются; связи считаются по группам производителей.
+        """
+        counts = []
+        for table in tables or self._versions:
+            if table == "manufacturers":
+                counts.append(len(self._manufacturers_by_id))
+            elif table == "details":
+                counts.append(len(self._details_by_id))
+            elif table == "links":
+                counts.append(sum(map(len, self._links_by_manufacturer.values())))
+            else:
+                raise KeyError(table)
+        return tuple(counts)
+
+    # Изменение данных
+
+    @property
+    def read_only(self) -> bool:
+        """True после fork() и freeze(): индексы версии могут быть общими с другими"""
+        return self._read_only
+
+    def freeze(self) -> None:
+        """Делает сервис доступным только для чтения"""
+        self._read_only = True
+
+    def _check_writable(self) -> None:
+        if self._read_only:
+            raise ReadOnlyServiceError(
+                "Версия сервиса только для чтения; изменения передаются в fork()")
+
+    def add_manufacturer(self, manufacturer: Manufacturer) -> None:
+        """Добавляет производителя"""
+        self._check_writable()
+        if manufacturer.manufacturer_id in self._manufacturers_by_id:
+            raise ValueError(
+                f"Производитель {manufacturer.manufacturer_id} уже существует")
+        self._manufacturers_by_id[manufacturer.manufacturer_id] = manufacturer
+        self._name_index.add(manufacturer.manufacturer_id, manufacturer.manufacturer_name)
+        if self._totals is not None:
+            self._totals.add_member(manufacturer.manufacturer_id)
+        self._versions["manufacturers"] += 1
+
+    def update_manufacturer(self, manufacturer: Manufacturer) -> None:
+        """Заменяет производителя с тем же ID, сохраняя его позицию"""
+        self._check_writable()
+        if manufacturer.manufacturer_id not in self._manufacturers_by_id:
+            raise KeyError(manufacturer.manufacturer_id)
+        self._manufacturers_by_id[manufacturer.manufacturer_id] = manufacturer
+        self._name_index.update(manufacturer.manufacturer_id, manufacturer.manufacturer_name)
+        self._versions["manufacturers"] += 1
+
+    def remove_manufacturer(self, manufacturer_id: int) -> Manufacturer:
+        """Удаляет производителя; его детали и связи остаются без изменений"""
+        self._check_writable()
+        manufacturer = self._manufacturers_by_id.pop(manufacturer_id)
+        self._name_index.remove(manufacturer_id)
+        if self._totals is not None:
+            self._totals.remove_member(manufacturer_id)
+        self._versions["manufacturers"] += 1
+        return manufacturer
+
+    def add_detail(self, detail: Detail) -> None:
+        """Добавляет деталь"""
+        self._check_writable()
+        if detail.detail_id in self._details_by_id:
+            raise ValueError(f"Деталь {detail.detail_id} уже существует")
+        self._details_by_id[detail.detail_id] = detail
+        self._detail_seqs[detail.detail_id] = self._next_detail_seq
+        self._next_detail_seq += 1
+        self._link_owned(detail)
+        if self._totals is not None:
+            self._totals.add_price(detail.manufacturer_id, detail.price)
+        if self._prices is not None:
+            self._prices.add(detail)
+        self._versions["details"] += 1
+
+    def update_detail(self, detail: Detail) -> None:
+        """Заменяет деталь с тем же ID (в том числе при смене производителя)"""
+        self._check_writable()
+        old = self._details_by_id.get(detail.detail_id)
+        if old is None:
+            raise KeyError(detail.detail_id)
+        self._details_by_id[detail.detail_id] = detail
+        if old.manufacturer_id != detail.manufacturer_id:
+            self._unlink_owned(old)
+            self._link_owned(detail)
+        else:
+            self._owned_details[detail.manufacturer_id][detail.detail_id] = detail
+        if self._totals is not None:
+            self._totals.remove_price(old.manufacturer_id, old.price)
+            self._totals.add_price(detail.manufacturer_id, detail.price)
+        if self._prices is not None:
+            self._prices.remove(old)
+            self._prices.add(detail)
+        self._versions["details"] += 1
+
+    def remove_detail(self, detail_id: int) -> Detail:
+        """Удаляет деталь; связи с ней остаются без изменений"""
+        self._check_writable()
+        detail = self._details_by_id.pop(detail_id)
+        self._unlink_owned(detail)
+        del self._detail_seqs[detail_id]
+        if self._totals is not None:
+            self._totals.remove_price(detail.manufacturer_id, detail.price)
+        if self._prices is not None:
+            self._prices.remove(detail)
+        self._versions["details"] += 1
+        return detail
+
+    def _link_owned(self, detail: Detail) -> None:
+        group = self._owned_details.get(detail.manufacturer_id)
+        if group is None:
+            group = self._owned_details[detail.manufacturer_id] = {}
+            if self._owned_ids is not None:
+                insort(self._owned_ids, detail.manufacturer_id)
+        seqs = self._detail_seqs
+        seq = seqs[detail.detail_id]
+        if not group or seqs[next(reversed(group))] < seq:
+            group[detail.detail_id] = detail
+        else:
+            # Перенесенная деталь добавлена раньше последней в группе:
+            # группа пересобирается, O(размер группы)
+            items = list(group.items())
+            position = bisect_left([seqs[detail_id] for detail_id in group], seq)
+            items.insert(position, (detail.detail_id, detail))
+            group.clear()
+            group.update(items)
+        detail_ids = self._sorted_detail_ids.get(detail.manufacturer_id)
+        if detail_ids is not None:
+            insort(detail_ids, detail.detail_id)
+
+    def _unlink_owned(self, detail: Detail) -> None:
+        group = self._owned_details[detail.manufacturer_id]
+        del group[detail.detail_id]
+        detail_ids = self._sorted_detail_ids.get(detail.manufacturer_id)
+        if detail_ids is not None:
+            del detail_ids[bisect_left(detail_ids, detail.detail_id)]
+        if not group:
+            del self._owned_details[detail.manufacturer_id]
+            self._sorted_detail_ids.pop(detail.manufacturer_id, None)
+            if self._owned_ids is not None:
+                del self._owned_ids[bisect_left(self._owned_ids, detail.manufacturer_id)]
+
+    def add_link(self, link: ManufacturerDetail) -> None:
+        """Добавляет связь производителя и детали"""
+        self._check_writable()
+        self._links_by_manufacturer.setdefault(link.manufacturer_id, []).append(link)
+        self._versions["links"] += 1
+
+    def remove_link(self, manufacturer_id: int, detail_id: int) -> ManufacturerDetail:
+        """Удаляет первую связь производителя с деталью"""
+        self._check_writable()
+        links = self._links_by_manufacturer.get(manufacturer_id, [])
+        for position, link in enumerate(links):
+            if link.detail_id == detail_id:
+                del links[position]
+                if not links:
+                    del self._links_by_manufacturer[manufacturer_id]
+                self._versions["links"] += 1
+                return link
+        raise KeyError((manufacturer_id, detail_id))
+
+    _CHANGE_HANDLERS = {
+        (ChangeKind.INSERT, "manufacturers"): add_manufacturer,
+        (ChangeKind.UPDATE, "manufacturers"): update_manufacturer,
+        (ChangeKind.DELETE, "manufacturers"): remove_manufacturer,
+        (ChangeKind.INSERT, "details"): add_detail,
+        (ChangeKind.UPDATE, "details"): update_detail,
+        (ChangeKind.DELETE, "details"): remove_detail,
+        (ChangeKind.INSERT, "links"): add_link,
+        (ChangeKind.DELETE, "links"):
+            lambda self, link: self.remove_link(link.manufacturer_id, link.detail_id),
+    }
+
+    def apply_change(self, change: Change) -> None:
+        """Применяет одно изменение соответствующим методом add_*/update_*/remove_*"""
+        handler = self._CHANGE_HANDLERS.get((change.kind, change.table))
+        if handler is None:
+            raise ValueError(f"Неподдерживаемое изменение: {change.kind.value} {change.table}")
+        handler(self, change.record)
+
+    def apply_changes(self, changes: Iterable[Change]) -> int:
+        """Применяет пакет изменений по порядку и возвращает их количество
+
+        Индексы, суммы и поиск по названиям обновляются по каждому
+        изменению, поэтому стоимость пропорциональна размеру пакета.
+        При ошибке изменения до нее остаются примененными.
+        """
+        applied = 0
+        for change in changes:
+            self.apply_change(change)
+            applied += 1
+        return applied
+
+    def fork(self, changes: Iterable[Change]) -> "ManufacturingService":
+        """Новая версия сервиса с пакетом изменений; self не изменяется
+
+        Версия делит с self записи и все, чего пакет не касается: индексы
+        неизмененных таблиц целиком, а в измененных - группы деталей и
+        связей и списки индексов других производителей. Копируются
+        словари верхнего уровня измененных таблиц (O(n) ссылок для
+        деталей) и группы затронутых производителей. Если изменение не
+        применяется, исключение передается дальше, а self остается
+        прежним, поэтому пакет применяется целиком или никак. После
+        успешного fork() self и новая версия только для чтения.
+        """
+        changes = list(changes)
+        tables = {change.table for change in changes}
+        # Владельцы затронутых групп деталей, производители затронутых
+        # связей и названия, чьи триграммы переиндексируются
+        owner_ids: Set[int] = set()
+        linked_ids: Set[int] = set()
+        names: List[str] = []
+        for change in changes:
+            record = change.record
+            deleted = change.kind is ChangeKind.DELETE
+            if change.table == "manufacturers":
+                old = self._manufacturers_by_id.get(record if deleted else record.manufacturer_id)
+                if old is not None:
+                    names.append(old.manufacturer_name)
+                if not deleted:
+                    names.append(record.manufacturer_name)
+            elif change.table == "details":
+                old = self._details_by_id.get(record if deleted else record.detail_id)
+                if old is not None:
+                    owner_ids.add(old.manufacturer_id)
+                if not deleted:
+                    owner_ids.add(record.manufacturer_id)
+            elif change.table == "links":
+                linked_ids.add(record.manufacturer_id)
+
+        version = copy.copy(self)
+        if "manufacturers" in tables:
+            version._manufacturers_by_id = dict(self._manufacturers_by_id)
+            version._name_index = self._name_index.fork(names)
+        if "details" in tables:
+            version._details_by_id = dict(self._details_by_id)
+            version._detail_seqs = dict(self._detail_seqs)
+            version._owned_details = dict(self._owned_details)
+            for manufacturer_id in owner_ids:
+                group = self._owned_details.get(manufacturer_id)
+                if group is not None:
+                    version._owned_details[manufacturer_id] = dict(group)
+            # Ленивые индексы читаются один раз: читатель self может
+            # построить их во время копирования
+            owned_ids, prices = self._owned_ids, self._prices
+            version._owned_ids = None if owned_ids is None else list(owned_ids)
+            version._sorted_detail_ids = sorted_ids = dict(self._sorted_detail_ids)
+            for manufacturer_id in owner_ids:
+                detail_ids = sorted_ids.get(manufacturer_id)
+                if detail_ids is not None:
+                    sorted_ids[manufacturer_id] = list(detail_ids)
+            version._prices = None if prices is None else prices.fork(owner_ids)
+        if "links" in tables:
+            version._links_by_manufacturer = dict(self._links_by_manufacturer)
+            for manufacturer_id in linked_ids:
+                links = self._links_by_manufacturer.get(manufacturer_id)
+                if links is not None:
+                    version._links_by_manufacturer[manufacturer_id] = list(links)
+        if self._totals is not None and tables & {"manufacturers", "details"}:
+            version._totals = self._totals.copy()
+        version._versions = dict(self._versions)
+        version._read_only = False
+        version.apply_changes(changes)
+        self.freeze()
+        version.freeze()
+        return version
+
+    def get_data_version(self, *tables: str) -> Tuple[int, ...]:
+        """Версии таблиц ("manufacturers", "details", "links"); по умолчанию всех"""
+        return tuple(self._versions[table] for table in tables or self._versions)
+
+    # Поиск по индексам
+
+    def get_manufacturer(self, manufacturer_id: int) -> Optional[Manufacturer]:
+        """Возвращает производителя по ID или None"""
+        return self._manufacturers_by_id.get(manufacturer_id)
+
+    def get_detail(self, detail_id: int) -> Optional[Detail]:
+        """Возвращает деталь по ID или None"""
+        return self._details_by_id.get(detail_id)
+
+    def iter_detail_groups(self) -> Iterator[Tuple[int, Iterable[Detail]]]:
+        """Детали, сгруппированные по Detail.manufacturer_id, в порядке индекса"""
+        for manufacturer_id, group in self._owned_details.items():
+            yield manufacturer_id, group.values()
+
+    def get_group_size(self, manufacturer_id: int, relation: Relation) -> int:
+        """Размер группы производителя, O(1): число его деталей или связей
+
+        Связи с удаленными деталями тоже учитываются.
+        """
+        if relation is Relation.OWNERSHIP:
+            return len(self._owned_details.get(manufacturer_id, ()))
+        return len(self._links_by_manufacturer.get(manufacturer_id, ()))
 
     def get_manufacturers_dict(self) -> Dict[int, Manufacturer]:
         """Создает словарь производителей по ID"""
-        return {m.manufacturer_id: m for m in self.manufacturers}
+        return dict(self._manufacturers_by_id)
 
     def get_details_dict(self) -> Dict[int, Detail]:
         """Создает словарь деталей по ID"""
-        return {d.detail_id: d for d in self.details}
+        return dict(self._details_by_id)
 
     def get_manufacturer_to_details(self) -> Dict[int, List[int]]:
         """Создает словарь соответствия производителя и его деталей"""
         manufacturer_to_details = defaultdict(list)
-        for md in self.manufacturer_details:
-            manufacturer_to_details[md.manufacturer_id].append(md.detail_id)
+        for manufacturer_id, links in self._links_by_manufacturer.items():
+            manufacturer_to_details[manufacturer_id] = [link.detail_id for link in links]
         return manufacturer_to_details
 
-    def get_details_by_manufacturer(self) -> List[Tuple[str, str, float]]:
+    # Запросы
+
+    def get_details_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                    ) -> List[Tuple[str, str, float]]:
         """Запрос 1: Получить детали с их производителями"""
-        manufacturer_dict = self.get_manufacturers_dict()
-        result = []
+        with self._record("get_details_by_manufacturer") as record:
+            if relation is Relation.LINKS:
+                with record.phase("join_sort"):
+                    result = [(manufacturer.manufacturer_name, detail.detail_name, detail.price)
+                              for manufacturer, details in self.iter_sorted_detail_groups(relation)
+                              for detail in details]
+            else:
+                with record.phase("sort"):
+                    groups = self._sorted_detail_groups()
+                with record.phase("materialize"):
+                    result = [(manufacturer.manufacturer_name, group[detail_id].detail_name,
+                               group[detail_id].price)
+                              for manufacturer, group, detail_ids in groups
+                              for detail_id in detail_ids]
+            record.rows = len(result)
+            return result
+
+    def iter_sorted_detail_groups(self, relation: Relation = Relation.OWNERSHIP
+                                  ) -> Iterator[Tuple[Manufacturer, List[Detail]]]:
+        """Производители и их детали в порядке запроса 1
 
-        for detail in sorted(self.details, key=lambda x: (x.manufacturer_id, x.detail_id)):
-            manufacturer = manufacturer_dict.get(detail.manufacturer_id)
+        Производители - по возрастанию ID, только существующие и с
+        деталями (по связям - со связями, группа может быть пустой),
+        детали - как в get_sorted_details().
+        """
+        if relation is Relation.LINKS:
+            manufacturer_ids = sorted(self._links_by_manufacturer)
+        else:
+            manufacturer_ids = self._sorted_owner_ids()
+        for manufacturer_id in manufacturer_ids:
+            manufacturer = self._manufacturers_by_id.get(manufacturer_id)
             if manufacturer:
-                result.append((
-                    manufacturer.manufacturer_name,
-                    detail.detail_name,
-                    detail.price
-                ))
-        return result
+                yield manufacturer, self.get_sorted_details(manufacturer_id, relation)
+
+    def get_sorted_details(self, manufacturer_id: int,
+                           relation: Relation = Relation.OWNERSHIP) -> List[Detail]:
+        """Детали производителя по возрастанию ID
+
+        По связям повторная связь дает деталь повторно, а сортировка
+        устойчива; по Detail.manufacturer_id используется поддерживаемый
+        при изменениях список ID группы.
+        """
+        if relation is Relation.LINKS:
+            return sorted(self.iter_related_details(manufacturer_id, relation),
+                          key=lambda x: x.detail_id)
+        group = self._owned_details.get(manufacturer_id)
+        if not group:
+            return []
+        return list(map(group.__getitem__, self._sorted_group_ids(manufacturer_id)))
+
+    def _sorted_owner_ids(self) -> List[int]:
+        """Отсортированные ключи _owned_details; строятся при первом обращении"""
+        owned_ids = self._owned_ids
+        if owned_ids is None:
+            owned_ids = self._owned_ids = sorted(self._owned_details)
+        return owned_ids
 
-    def get_total_price_by_manufacturer(self) -> List[Tuple[str, float]]:
+    def _sorted_group_ids(self, manufacturer_id: int) -> List[int]:
+        """Отсортированные ID деталей группы; сортируются при первом обращении"""
+        detail_ids = self._sorted_detail_ids.get(manufacturer_id)
+        if detail_ids is None:
+            detail_ids = self._sorted_detail_ids[manufacturer_id] = sorted(
+                self._owned_details[manufacturer_id])
+        return detail_ids
+
+    def _sorted_detail_groups(self) -> List[Tuple[Manufacturer, Dict[int, Detail], List[int]]]:
+        """Группы деталей существующих производителей и отсортированные ID деталей"""
+        groups = []
+        for manufacturer_id in self._sorted_owner_ids():
+            manufacturer = self._manufacturers_by_id.get(manufacturer_id)
+            if manufacturer:
+                group = self._owned_details[manufacturer_id]
+                groups.append((manufacturer, group, self._sorted_group_ids(manufacturer_id)))
+        return groups
+
+    def get_total_price_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                        ) -> List[Tuple[str, float]]:
         """Запрос 2: Получить суммарную стоимость деталей по производителям"""
-        price_totals = defaultdict(float)
+        with self._record("get_total_price_by_manufacturer") as record:
+            if self._totals is not None and relation is Relation.OWNERSHIP:
+                with record.phase("ranking"):
+                    result = [(self._manufacturers_by_id[manufacturer_id].manufacturer_name, total)
+                              for manufacturer_id, total in self._totals.iter_ranked()]
+                record.rows = len(result)
+                return result
 
-        for detail in self.details:
-            price_totals[detail.manufacturer_id] += detail.price
+            result = []
 
-        manufacturer_dict = self.get_manufacturers_dict()
-        result = []
+            with record.phase("aggregate"):
+                for manufacturer in self._manufacturers_by_id.values():
+                    total_price = self._scan_total(manufacturer.manufacturer_id, relation)
+                    result.append((manufacturer.manufacturer_name, total_price))
 
-        for manufacturer in self.manufacturers:
-            total_price = price_totals.get(manufacturer.manufacturer_id, 0.0)
-            result.append((manufacturer.manufacturer_name, total_price))
+            # Сортировка по убыванию суммарной стоимости
+            with record.phase("sort"):
+                result = sorted(result, key=lambda x: x[1], reverse=True)
+            record.rows = len(result)
+            return result
 
-        # Сортировка по убыванию суммарной стоимости
-        return sorted(result, key=lambda x: x[1], reverse=True)
+    def get_top_manufacturers_by_total(self, k: int) -> List[Tuple[str, float]]:
+        """Первые k строк запроса 2"""
+        if self._totals is not None:
+            return [(self._manufacturers_by_id[manufacturer_id].manufacturer_name, total)
+                    for manufacturer_id, total in self._totals.top(k)]
 
-    def get_department_manufacturers_with_details(self) -> Dict[str, List[Tuple[str, float]]]:
-        """Запрос 3: Получить производителей с 'отдел' в названии и их детали"""
-        manufacturer_dict = self.get_manufacturers_dict()
-        detail_dict = self.get_details_dict()
-        manufacturer_to_details = self.get_manufacturer_to_details()
+        # nlargest совпадает с sorted(..., reverse=True)[:k] и при равных суммах
+        totals = ((manufacturer.manufacturer_name,
+                   self._scan_total(manufacturer.manufacturer_id))
+                  for manufacturer in self._manufacturers_by_id.values())
+        return heapq.nlargest(k, totals, key=lambda x: x[1])
+
+    def get_manufacturer_stats(self, manufacturer_id: int) -> Tuple[float, int]:
+        """Суммарная стоимость и количество деталей производителя"""
+        if self._totals is not None:
+            return (self._totals.totals.get(manufacturer_id, 0.0),
+                    self._totals.counts.get(manufacturer_id, 0))
+
+        return (self._scan_total(manufacturer_id),
+                len(self._owned_details.get(manufacturer_id, {})))
+
+    def get_manufacturer_total(self, manufacturer_id: int,
+                               relation: Relation = Relation.OWNERSHIP) -> float:
+        """Сумма цен деталей производителя, как в его строке запроса 2"""
+        if self._totals is not None and relation is Relation.OWNERSHIP:
+            return self._totals.totals.get(manufacturer_id, 0.0)
+        return self._scan_total(manufacturer_id, relation)
+
+    def _scan_total(self, manufacturer_id: int,
+                    relation: Relation = Relation.OWNERSHIP) -> float:
+        total_price = 0.0
+        if relation is Relation.OWNERSHIP:
+            for detail in self._owned_details.get(manufacturer_id, {}).values():
+                total_price += detail.price
+        else:
+            for detail in self.iter_related_details(manufacturer_id, relation):
+                total_price += detail.price
+        return total_price
 
-        result = {}
+    # Ценовые запросы
 
-        for manufacturer in self.manufacturers:
-            if "отдел" in manufacturer.manufacturer_name.lower():
-                detail_ids = manufacturer_to_details.get(manufacturer.manufacturer_id, [])
-                details_list = []
+    def _price_index(self) -> PriceIndex:
+        if self._prices is None:
+            self._prices = PriceIndex(self._details_by_id.values())
+        return self._prices
 
-                for detail_id in detail_ids:
-                    if detail_id in detail_dict:
-                        detail = detail_dict[detail_id]
-                        details_list.append((detail.detail_name, detail.price))
+    def get_most_expensive_details(self, manufacturer_id: int, k: int) -> List[Detail]:
+        """k самых дорогих деталей производителя (по Detail.manufacturer_id), O(log n + k)"""
+        return [self._details_by_id[detail_id]
+                for detail_id in self._price_index().most_expensive(manufacturer_id, k)]
 
-                result[manufacturer.manufacturer_name] = details_list
+    def get_details_in_price_range(self, low: float, high: float,
+                                   limit: Optional[int] = None) -> List[Detail]:
+        """Детали с ценой от low до high включительно по возрастанию цены, O(log n + k)"""
+        detail_ids = islice(self._price_index().in_range(low, high), limit)
+        return [self._details_by_id[detail_id] for detail_id in detail_ids]
 
+    def count_details_in_price_range(self, low: float, high: float,
+                                     build_index: bool = True) -> Optional[int]:
+        """Число деталей с ценой от low до high включительно, O(log n)
+
+        С build_index=False непостроенный индекс цен не строится, и
+        возвращается None.
+        """
+        if self._prices is None and not build_index:
+            return None
+        return self._price_index().count(low, high)
+
+    def get_manufacturers_with_total_above(self, threshold: float) -> List[Tuple[str, float]]:
+        """Строки запроса 2 с суммой больше threshold
+
+        С incremental_totals граница находится бинарным поиском по
+        рейтингу, O(log m + k); без него суммы считаются полным проходом.
+        """
+        if self._totals is not None:
+            return [(self._manufacturers_by_id[manufacturer_id].manufacturer_name, total)
+                    for manufacturer_id, total in self._totals.iter_above(threshold)]
+        return [(name, total) for name, total in self.get_total_price_by_manufacturer()
+                if total > threshold]
+
+    def find_manufacturers(self, substring: str) -> List[Manufacturer]:
+        """Производители, в названии которых есть подстрока (без учета регистра)"""
+        return [self._manufacturers_by_id[manufacturer_id]
+                for manufacturer_id in self._name_index.search(substring)]
+
+    def get_manufacturers_with_details_matching(self, pattern: str,
+                                                relation: Relation = Relation.LINKS
+                                                ) -> Dict[str, List[Tuple[str, float]]]:
+        """Производители с подстрокой pattern в названии и их детали"""
+        with self._record("get_manufacturers_with_details_matching") as record:
+            return self._collect_matching(pattern, relation, record)
+
+    def get_department_manufacturers_with_details(self, relation: Relation = Relation.LINKS
+                                                  ) -> Dict[str, List[Tuple[str, float]]]:
+        """Запрос 3: Получить производителей с 'отдел' в названии и их детали"""
+        with self._record("get_department_manufacturers_with_details") as record:
+            return self._collect_matching("отдел", relation, record)
+
+    def _collect_matching(self, pattern: str, relation: Relation, record
+                          ) -> Dict[str, List[Tuple[str, float]]]:
+        with record.phase("search"):
+            manufacturer_ids = self._name_index.search(pattern)
+        with record.phase("materialize"):
+            result = {
+                self._manufacturers_by_id[manufacturer_id].manufacturer_name: [
+                    (detail.detail_name, detail.price)
+                    for detail in self.iter_related_details(manufacturer_id, relation)]
+                for manufacturer_id in manufacturer_ids
+            }
+        record.rows = len(result)
         return result
 
+    def run_all_reports(self, pattern: str = "отдел") -> Reports:
+        """Запросы 1-3 за один согласованный проход по данным
+
+        Группы деталей обходятся один раз: из него получаются строки
+        запроса 1 и суммы запроса 2. Производители тоже обходятся один
+        раз: в порядке добавления собираются строки запроса 2 и, для
+        найденных по индексу названий, детали запроса 3 по связям.
+        Результаты совпадают с get_details_by_manufacturer(),
+        get_total_price_by_manufacturer() и
+        get_manufacturers_with_details_matching(pattern) с отношениями
+        по умолчанию.
+        """
+        with self._record("run_all_reports") as record:
+            manufacturers = self._manufacturers_by_id
+            details = self._details_by_id
+            links = self._links_by_manufacturer
+            # При incremental_totals суммы и рейтинг уже поддерживаются
+            totals: Optional[Dict[int, float]] = {} if self._totals is None else None
+
+            details_rows: List[Tuple[str, str, float]] = []
+            with record.phase("details"):
+                append_row = details_rows.append
+                for manufacturer_id in self._sorted_owner_ids():
+                    manufacturer = manufacturers.get(manufacturer_id)
+                    if manufacturer is None:
+                        continue
+                    group = self._owned_details[manufacturer_id]
+                    if totals is not None:
+                        # Сумма в порядке вставки, как в _scan_total
+                        total_price = 0.0
+                        for detail in group.values():
+                            total_price += detail.price
+                        totals[manufacturer_id] = total_price
+                    name = manufacturer.manufacturer_name
+                    for detail_id in self._sorted_group_ids(manufacturer_id):
+                        detail = group[detail_id]
+                        append_row((name, detail.detail_name, detail.price))
+
+            total_rows: List[Tuple[str, float]] = []
+            matching: Dict[str, List[Tuple[str, float]]] = {}
+            with record.phase("manufacturers"):
+                matched_ids = set(self._name_index.search(pattern))
+                for manufacturer_id, manufacturer in manufacturers.items():
+                    name = manufacturer.manufacturer_name
+                    if totals is not None:
+                        total_rows.append((name, totals.get(manufacturer_id, 0.0)))
+                    if manufacturer_id in matched_ids:
+                        related = []
+                        for link in links.get(manufacturer_id, ()):
+                            detail = details.get(link.detail_id)
+                            if detail is not None:
+                                related.append((detail.detail_name, detail.price))
+                        matching[name] = related
+
+            with record.phase("sort"):
+                if totals is not None:
+                    total_rows.sort(key=lambda x: x[1], reverse=True)
+                else:
+                    total_rows = [(manufacturers[manufacturer_id].manufacturer_name, total)
+                                  for manufacturer_id, total in self._totals.iter_ranked()]
+            record.rows = len(details_rows) + len(total_rows) + len(matching)
+            return Reports(details_rows, total_rows, matching)
+
+    # Ленивые варианты запросов
+    #
+    # Итераторы читают индексы сервиса по мере выдачи строк, поэтому
+    # их нельзя продолжать после изменения данных.
+
+    def _record_rows(self, query: str, rows: Iterator) -> Iterator:
+        """Выдает rows под измерением запроса query
+
+        Время включает паузы потребителя между строками; недочитанный
+        итератор записывается при закрытии с числом выданных строк.
+        """
+        if self.instrumentation is None:
+            return rows
+        return self._iter_recorded(query, rows)
+
+    def _iter_recorded(self, query: str, rows: Iterator) -> Iterator:
+        with self._record(query) as record:
+            count = 0
+            try:
+                for row in rows:
+                    count += 1
+                    yield row
+            except GeneratorExit:
+                pass
+            finally:
+                record.rows = count
+
+    def iter_details_by_manufacturer(self, offset: int = 0, limit: Optional[int] = None,
+                                     after: Optional[Tuple[int, int]] = None
+                                     ) -> Iterator[Tuple[str, str, float]]:
+        """Запрос 1 по одной строке
+
+        after - ключ (manufacturer_id, detail_id) последней полученной
+        строки: выдача продолжается со следующей за ним. Отсортированные
+        ID производителей и деталей групп не пересортируются при каждом
+        запросе, а поддерживаются при изменениях.
+        """
+        rows = ((manufacturer.manufacturer_name, detail.detail_name, detail.price)
+                for manufacturer, detail in self._iter_sorted_details(after))
+        return self._record_rows("iter_details_by_manufacturer",
+                                 islice(rows, offset, None if limit is None else offset + limit))
+
+    def page_details_by_manufacturer(self, limit: int, after: Optional[Tuple[int, int]] = None
+                                     ) -> Tuple[List[Tuple[str, str, float]],
+                                                Optional[Tuple[int, int]]]:
+        """Страница запроса 1 и курсор следующей страницы (None, если страница последняя)"""
+        with self._record("page_details_by_manufacturer") as record:
+            page = []
+            cursor = None
+            for manufacturer, detail in islice(self._iter_sorted_details(after), limit):
+                page.append((manufacturer.manufacturer_name, detail.detail_name, detail.price))
+                cursor = (manufacturer.manufacturer_id, detail.detail_id)
+            record.rows = len(page)
+            return page, cursor if len(page) == limit else None
+
+    def count_details_by_manufacturer(self) -> int:
+        """Количество строк запроса 1"""
+        with self._record("count_details_by_manufacturer") as record:
+            count = sum(len(group) for manufacturer_id, group in self._owned_details.items()
+                        if manufacturer_id in self._manufacturers_by_id)
+            record.rows = 1
+            return count
+
+    def _iter_sorted_details(self, after: Optional[Tuple[int, int]] = None
+                             ) -> Iterator[Tuple[Manufacturer, Detail]]:
+        """Пары (производитель, деталь) по возрастанию (manufacturer_id, detail_id)"""
+        manufacturer_ids = self._sorted_owner_ids()
+        start = 0 if after is None else bisect_left(manufacturer_ids, after[0])
+
+        for manufacturer_id in islice(manufacturer_ids, start, None):
+            manufacturer = self._manufacturers_by_id.get(manufacturer_id)
+            if manufacturer:
+                group = self._owned_details[manufacturer_id]
+                detail_ids = self._sorted_group_ids(manufacturer_id)
+                start = 0
+                if after is not None and manufacturer_id == after[0]:
+                    start = bisect_right(detail_ids, after[1])
+                for detail_id in islice(detail_ids, start, None):
+                    yield manufacturer, group[detail_id]
+
+    def iter_total_price_by_manufacturer(self, offset: int = 0, limit: Optional[int] = None
+                                         ) -> Iterator[Tuple[str, float]]:
+        """Запрос 2 по одной строке
+
+        Без инкрементальных сумм суммы считаются сразу, а порядок
+        выдается из кучи: первые строки не требуют полной сортировки.
+        """
+        if self._totals is not None:
+            rows = ((self._manufacturers_by_id[manufacturer_id].manufacturer_name, total)
+                    for manufacturer_id, total in self._totals.iter_ranked())
+        else:
+            rows = self._iter_totals_from_heap()
+        return self._record_rows("iter_total_price_by_manufacturer",
+                                 islice(rows, offset, None if limit is None else offset + limit))
+
+    def _iter_totals_from_heap(self) -> Iterator[Tuple[str, float]]:
+        heap = []
+        for position, manufacturer in enumerate(self._manufacturers_by_id.values()):
+            total_price = self._scan_total(manufacturer.manufacturer_id)
+            heap.append((-total_price, position, manufacturer.manufacturer_name, total_price))
+        heapq.heapify(heap)
+
+        while heap:
+            _, _, manufacturer_name, total_price = heapq.heappop(heap)
+            yield manufacturer_name, total_price
+
+    def iter_manufacturers_with_details_matching(self, pattern: str, offset: int = 0,
+                                                 limit: Optional[int] = None,
+                                                 relation: Relation = Relation.LINKS
+                                                 ) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+        """Пары (производитель, его детали) для подстроки pattern по одной"""
+        return self._record_rows("iter_manufacturers_with_details_matching",
+                                 self._iter_matching(pattern, offset, limit, relation))
+
+    def _iter_matching(self, pattern: str, offset: int, limit: Optional[int],
+                       relation: Relation) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+        manufacturer_ids = self._name_index.search(pattern)
+        stop = None if limit is None else offset + limit
+        for manufacturer_id in islice(manufacturer_ids, offset, stop):
+            manufacturer = self._manufacturers_by_id[manufacturer_id]
+            yield manufacturer.manufacturer_name, [
+                (detail.detail_name, detail.price)
+                for detail in self.iter_related_details(manufacturer_id, relation)]
+
+    def iter_department_manufacturers_with_details(self, offset: int = 0,
+                                                   limit: Optional[int] = None
+                                                   ) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+        """Запрос 3 по одному производителю"""
+        return self._record_rows("iter_department_manufacturers_with_details",
+                                 self._iter_matching("отдел", offset, limit, Relation.LINKS))
+
+    def iter_related_details(self, manufacturer_id: int, relation: Relation) -> Iterator[Detail]:
+        """Детали производителя по выбранному отношению
+
+        По таблице связей пропускаются связи с несуществующими деталями,
+        а повторная связь дает деталь повторно, как при соединении таблиц.
+        """
+        if relation is Relation.OWNERSHIP:
+            yield from self._owned_details.get(manufacturer_id, {}).values()
+            return
+        for link in self._links_by_manufacturer.get(manufacturer_id, []):
+            detail = self._details_by_id.get(link.detail_id)
+            if detail is not None:
+                yield detail
+
 
 # Данные для работы
 def get_sample_data() -> Tuple[List[Manufacturer], List[Detail], List[ManufacturerDetail]]:
@@ -144,45 +1190,24 @@ def get_sample_data() -> Tuple[List[Manufacturer], List[Detail], List[Manufactur
 
 
 # Старые функции для обратной совместимости
-def task1_functional():
-    """Запрос 1 в функциональном стиле"""
-    manufacturers, details, manufacturer_details = get_sample_data()
-    service = ManufacturingService(manufacturers, details, manufacturer_details)
-    result = service.get_details_by_manufacturer()
-
-    print("=== ЗАПРОС 1 (функциональный): Детали и производители ===")
-    for manufacturer_name, detail_name, price in result:
-        print(f"Производитель: {manufacturer_name} -> "
-              f"Деталь: {detail_name}, Цена: {price} руб.")
-    print()
-
-def task2_functional():
-    """Запрос 2 в функциональном стиле"""
-    manufacturers, details, manufacturer_details = get_sample_data()
-    service = ManufacturingService(manufacturers, details, manufacturer_details)
-    result = service.get_total_price_by_manufacturer()
-
-    print("=== ЗАПРОС 2 (функциональный): Суммарная стоимость ===")
-    for manufacturer_name, total_price in result:
-        print(f"Производитель: {manufacturer_name}, Суммарная стоимость: {total_price:.2f} руб.")
-    print()
-
-def task3_functional():
-    """Запрос 3 в функциональном стиле"""
-    manufacturers, details, manufacturer_details = get_sample_data()
-    service = ManufacturingService(manufacturers, details, manufacturer_details)
-    result = service.get_department_manufacturers_with_details()
-
-    print("=== ЗАПРОС 3 (функциональный): Производители с 'отдел' в названии ===")
-    for manufacturer_name, details_list in result.items():
-        print(f"\nПроизводитель: {manufacturer_name}")
-        if details_list:
-            for detail_name, price in details_list:
-                print(f"  - Деталь: {detail_name}, Цена: {price} руб.")
-        else:
-            print("  - Нет деталей")
-    print()
+def task1_functional(service: Optional[ManufacturingService] = None):
+    """Запрос 1 в функциональном стиле; без service - по тестовым данным"""
+    _print_report(1, service)
+
+def task2_functional(service: Optional[ManufacturingService] = None):
+    """Запрос 2 в функциональном стиле; без service - по тестовым данным"""
+    _print_report(2, service)
+
+def task3_functional(service: Optional[ManufacturingService] = None):
+    """Запрос 3 в функциональном стиле; без service - по тестовым данным"""
+    _print_report(3, service)
+
+def _print_report(report: int, service: Optional[ManufacturingService]) -> None:
+    from report_renderer import render_reports
 
+    if service is None:
+        service = ManufacturingService(*get_sample_data())
+    render_reports(service, sys.stdout, reports=(report,), binary=False)
 
 if __name__ == "__main__":
     print("ФУНКЦИОНАЛЬНАЯ РЕАЛИЗАЦИЯ:")
@@ -0,0 +1,206 @@
+"""
+Потоковый вывод отчетов по запросам 1-3
+Строки отчетов берутся из ленивых итераторов сервиса и передаются
+потоку кусками, поэтому отчет целиком в памяти не собирается
+Запуск: python report_renderer.py [--format text|csv|jsonl] [--output FILE] [--details N]
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+from refactored_manufacturing import ManufacturingService, get_sample_data
+
+FORMATS = ("text", "csv", "jsonl")
+CSV_HEADER = ("report", "manufacturer", "detail", "price", "total")
+
+
+class _ChunkedWriter:
+    """Буфер отчета: содержимое передается в write, когда набирается chunk_size символов"""
+
+    def __init__(self, write: Callable[[str], object], chunk_size: int):
+        self._write = write
+        self._chunk_size = chunk_size
+        self.buffer = io.StringIO()
+        self.write = self.buffer.write
+        self.written = 0
+
+    def commit(self) -> None:
+        """Передает накопленное, если набран кусок"""
+        if self.buffer.tell() >= self._chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        text = self.buffer.getvalue()
+        if text:
+            self._write(text)
+            self.written += len(text)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+
+def _batches(rows: Iterable, size: int = 1024) -> Iterator[list]:
+    """Строки пачками: форматирование и запись идут по пачке, а не по строке"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _render_text(service: ManufacturingService, reports: Iterable[int],
+                 out: _ChunkedWriter) -> None:
+    """Текст в формате task*_functional"""
+    for report in reports:
+        if report == 1:
+            out.write("=== ЗАПРОС 1 (функциональный): Детали и производители ===\n")
+            for batch in _batches(service.iter_details_by_manufacturer()):
+                out.write("".join([f"Производитель: {manufacturer_name} -> "
+                                   f"Деталь: {detail_name}, Цена: {price} руб.\n"
+                                   for manufacturer_name, detail_name, price in batch]))
+                out.commit()
+        elif report == 2:
+            out.write("=== ЗАПРОС 2 (функциональный): Суммарная стоимость ===\n")
+            for batch in _batches(service.iter_total_price_by_manufacturer()):
+                out.write("".join([f"Производитель: {manufacturer_name}, "
+                                   f"Суммарная стоимость: {total_price:.2f} руб.\n"
+                                   for manufacturer_name, total_price in batch]))
+                out.commit()
+        else:
+            out.write("=== ЗАПРОС 3 (функциональный): Производители с 'отдел' в названии ===\n")
+            for batch in _batches(service.iter_department_manufacturers_with_details(), 256):
+                for manufacturer_name, details_list in batch:
+                    out.write(f"\nПроизводитель: {manufacturer_name}\n")
+                    if details_list:
+                        out.write("".join([f"  - Деталь: {detail_name}, Цена: {price} руб.\n"
+                                           for detail_name, price in details_list]))
+                    else:
+                        out.write("  - Нет деталей\n")
+                out.commit()
+        out.write("\n")
+
+
+def _render_csv(service: ManufacturingService, reports: Iterable[int],
+                out: _ChunkedWriter) -> None:
+    """Одна таблица CSV_HEADER; номер отчета в первом столбце"""
+    writer = csv.writer(out.buffer)
+    writer.writerow(CSV_HEADER)
+    for report in reports:
+        if report == 1:
+            for batch in _batches(service.iter_details_by_manufacturer()):
+                writer.writerows([(1, manufacturer_name, detail_name, price, "")
+                                  for manufacturer_name, detail_name, price in batch])
+                out.commit()
+        elif report == 2:
+            for batch in _batches(service.iter_total_price_by_manufacturer()):
+                writer.writerows([(2, manufacturer_name, "", "", total_price)
+                                  for manufacturer_name, total_price in batch])
+                out.commit()
+        else:
+            for batch in _batches(service.iter_department_manufacturers_with_details(), 256):
+                writer.writerows([(3, manufacturer_name, detail_name, price, "")
+                                  if details_list else (3, manufacturer_name, "", "", "")
+                                  for manufacturer_name, details_list in batch
+                                  for detail_name, price in (details_list or [("", "")])])
+                out.commit()
+
+
+def _render_jsonl(service: ManufacturingService, reports: Iterable[int],
+                  out: _ChunkedWriter) -> None:
+    """Объект JSON на строку; в запросе 3 - производитель со списком деталей
+
+    Ключи подставляются в шаблон, в JSON кодируются только значения.
+    """
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    for report in reports:
+        if report == 1:
+            for batch in _batches(service.iter_details_by_manufacturer()):
+                out.write("".join([f'{{"report": 1, "manufacturer": {encode(manufacturer_name)}, '
+                                   f'"detail": {encode(detail_name)}, "price": {encode(price)}}}\n'
+                                   for manufacturer_name, detail_name, price in batch]))
+                out.commit()
+        elif report == 2:
+            for batch in _batches(service.iter_total_price_by_manufacturer()):
+                out.write("".join([f'{{"report": 2, "manufacturer": {encode(manufacturer_name)}, '
+                                   f'"total": {encode(total_price)}}}\n'
+                                   for manufacturer_name, total_price in batch]))
+                out.commit()
+        else:
+            for batch in _batches(service.iter_department_manufacturers_with_details(), 256):
+                out.write("".join([f'{{"report": 3, "manufacturer": {encode(manufacturer_name)}, '
+                                   f'"details": {encode(details_list)}}}\n'
+                                   for manufacturer_name, details_list in batch]))
+                out.commit()
+
+
+_RENDERERS = {"text": _render_text, "csv": _render_csv, "jsonl": _render_jsonl}
+
+
+def _is_binary(stream) -> bool:
+    """Бинарными считаются только потоки io с байтовым интерфейсом; обертки
+    над stdout (tee, логирование) без базового класса io считаются текстовыми"""
+    return isinstance(stream, (io.RawIOBase, io.BufferedIOBase))
+
+
+def render_reports(service: ManufacturingService, stream, fmt: str = "text",
+                   reports: Iterable[int] = (1, 2, 3), chunk_size: int = 1 << 16,
+                   encoding: str = "utf-8", binary: Optional[bool] = None) -> int:
+    """Пишет отчеты в текстовый или бинарный поток, возвращает число символов
+
+    В бинарный поток текст кодируется в encoding по кускам. По умолчанию
+    (binary=None) поток бинарный, если он наследует io.RawIOBase или
+    io.BufferedIOBase; любой другой объект с write() получает str.
+    """
+    if fmt not in _RENDERERS:
+        raise ValueError(f"Неизвестный формат отчета: {fmt}")
+    reports = list(reports)
+    if not set(reports) <= {1, 2, 3}:
+        raise ValueError(f"Неизвестные номера отчетов: {reports}")
+
+    if binary is None:
+        binary = _is_binary(stream)
+    if not binary:
+        write = stream.write
+    else:
+        def write(text: str):
+            return stream.write(text.encode(encoding))
+    out = _ChunkedWriter(write, chunk_size)
+    _RENDERERS[fmt](service, reports, out)
+    out.flush()
+    return out.written
+
+
+def write_reports(service: ManufacturingService, path: Optional[str] = None,
+                  fmt: str = "text", reports: Iterable[int] = (1, 2, 3),
+                  encoding: str = "utf-8", buffer_size: int = 1 << 20) -> int:
+    """Пишет отчеты в файл path (по умолчанию в stdout), возвращает число символов"""
+    if path is None:
+        return render_reports(service, sys.stdout, fmt, reports)
+    with open(path, "w", encoding=encoding, newline="", buffering=buffer_size) as stream:
+        return render_reports(service, stream, fmt, reports)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=FORMATS, default="text")
+    parser.add_argument("--output", help="файл отчета (по умолчанию stdout)")
+    parser.add_argument("--details", type=int, default=0,
+                        help="размер синтетического каталога (0 - тестовые данные)")
+    args = parser.parse_args(argv)
+
+    if args.details:
+        from benchmark import make_catalog
+        service = ManufacturingService(*make_catalog(args.details))
+    else:
+        service = ManufacturingService(*get_sample_data())
+    write_reports(service, args.output, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Сценарии изменения цен ("что если") над каталогом ManufacturingService
+Сценарий - последовательность массовых преобразований цен (наценка
+на детали производителя, надбавка на связанные детали). Новые цены
+хранятся разреженным наложением поверх цен каталога: каталог не
+копируется и не изменяется, а суммы пересчитываются только у
+затронутых производителей
+"""
+
+from bisect import bisect_left
+from dataclasses import dataclass
+from heapq import merge
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from refactored_manufacturing import Detail, ManufacturingService, Relation
+
+
+@dataclass(frozen=True)
+class Markup:
+    """Цены деталей производителя умножаются на factor (1.07 - наценка 7%)"""
+    manufacturer_id: int
+    factor: float
+    relation: Relation = Relation.OWNERSHIP
+
+
+@dataclass(frozen=True)
+class Surcharge:
+    """К ценам деталей производителя прибавляется amount (по умолчанию - деталям по связям)"""
+    manufacturer_id: int
+    amount: float
+    relation: Relation = Relation.LINKS
+
+
+Transform = Union[Markup, Surcharge]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """Именованная последовательность преобразований; применяются по порядку"""
+    name: str
+    transforms: Tuple[Transform, ...]
+
+    def __init__(self, name: str, transforms: Iterable[Transform]):
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "transforms", tuple(transforms))
+        for transform in self.transforms:
+            if not isinstance(transform, (Markup, Surcharge)):
+                raise TypeError(f"Неизвестное преобразование цен: {transform!r}")
+
+
+class _Base:
+    """Данные каталога одной версии, общие для всех сценариев пакета
+
+    Рейтинг и обратный индекс связей строятся при первом обращении.
+    """
+
+    def __init__(self, service: ManufacturingService):
+        self.service = service
+        self.version = service.get_data_version()
+        self.manufacturers = service.get_manufacturers_dict()
+        self.positions = {manufacturer_id: position for position, manufacturer_id
+                          in enumerate(self.manufacturers)}
+        self._rankings: Dict[Relation, Tuple[List[Tuple[float, int, int]], Dict[int, float]]] = {}
+        self._ranked_rows: Dict[Relation, List[Tuple[str, float]]] = {}
+        self._linked_by: Optional[Dict[int, List[int]]] = None
+        self._details_rows: Dict[Relation, Tuple[list, Dict[int, List[int]]]] = {}
+        self._matching: Dict[Tuple[str, Relation], Tuple[dict, Dict[int, str]]] = {}
+
+    def check_version(self) -> None:
+        if self.service.get_data_version() != self.version:
+            raise ValueError("Данные сервиса изменились после расчета сценариев")
+
+    def ranking(self, relation: Relation) -> Tuple[List[Tuple[float, int, int]], Dict[int, float]]:
+        """Ключи (-сумма, позиция, ID) по возрастанию и суммы производителей"""
+        cached = self._rankings.get(relation)
+        if cached is None:
+            get_total = self.service.get_manufacturer_total
+            totals = {manufacturer_id: get_total(manufacturer_id, relation)
+                      for manufacturer_id in self.positions}
+            keys = sorted((-total, self.positions[manufacturer_id], manufacturer_id)
+                          for manufacturer_id, total in totals.items())
+            cached = self._rankings[relation] = (keys, totals)
+        return cached
+
+    def ranked_rows(self, relation: Relation) -> List[Tuple[str, float]]:
+        """Строки рейтинга каталога в порядке ключей ranking(relation)"""
+        rows = self._ranked_rows.get(relation)
+        if rows is None:
+            keys, totals = self.ranking(relation)
+            manufacturers = self.manufacturers
+            rows = self._ranked_rows[relation] = [
+                (manufacturers[manufacturer_id].manufacturer_name, totals[manufacturer_id])
+                for _, _, manufacturer_id in keys]
+        return rows
+
+    def linked_by(self) -> Dict[int, List[int]]:
+        """detail_id -> производители, связанные с деталью (без повторов)"""
+        if self._linked_by is None:
+            linked_by: Dict[int, List[int]] = {}
+            for manufacturer_id, detail_ids in self.service.get_manufacturer_to_details().items():
+                for detail_id in detail_ids:
+                    owners = linked_by.setdefault(detail_id, [])
+                    if not owners or owners[-1] != manufacturer_id:
+                        owners.append(manufacturer_id)
+            self._linked_by = linked_by
+        return self._linked_by
+
+    def affected(self, detail_ids: Iterable[int], relation: Relation) -> Iterator[int]:
+        """Производители, суммы которых зависят от цен деталей detail_ids"""
+        if relation is Relation.OWNERSHIP:
+            get_detail = self.service.get_detail
+            for detail_id in detail_ids:
+                yield get_detail(detail_id).manufacturer_id
+        else:
+            linked_by = self.linked_by()
+            for detail_id in detail_ids:
+                yield from linked_by.get(detail_id, ())
+
+    def details_rows(self, relation: Relation) -> Tuple[list, Dict[int, List[int]]]:
+        """Строки запроса 1 и позиции строк каждой детали"""
+        cached = self._details_rows.get(relation)
+        if cached is None:
+            self.check_version()
+            rows = []
+            row_positions: Dict[int, List[int]] = {}
+            for manufacturer, details in self.service.iter_sorted_detail_groups(relation):
+                name = manufacturer.manufacturer_name
+                for detail in details:
+                    row_positions.setdefault(detail.detail_id, []).append(len(rows))
+                    rows.append((name, detail.detail_name, detail.price))
+            cached = self._details_rows[relation] = (rows, row_positions)
+        return cached
+
+    def matching(self, pattern: str, relation: Relation) -> Tuple[dict, Dict[int, str]]:
+        """Результат поиска по названию и ID производителей, чьи списки в него попали"""
+        cached = self._matching.get((pattern, relation))
+        if cached is None:
+            self.check_version()
+            result = self.service.get_manufacturers_with_details_matching(pattern, relation)
+            # При совпадающих названиях в результате остается последний производитель
+            winners = {}
+            for manufacturer in self.service.find_manufacturers(pattern):
+                winners[manufacturer.manufacturer_name] = manufacturer.manufacturer_id
+            cached = self._matching[(pattern, relation)] = (
+                result, {manufacturer_id: name for name, manufacturer_id in winners.items()})
+        return cached
+
+
+class ScenarioResult:
+    """Результат сценария: новые цены и суммы затронутых производителей
+
+    Остальные производители сохраняют суммы каталога, поэтому рейтинг
+    получается слиянием рейтинга каталога без затронутых производителей
+    с их новыми ключами. Запросы 1 и 3 строятся по запросу из строк
+    каталога с подстановкой новых цен. Результат действителен, пока
+    сервис не изменился.
+    """
+
+    def __init__(self, scenario: Scenario, base: _Base, relation: Relation,
+                 prices: Dict[int, float], totals: Dict[int, float]):
+        self.scenario = scenario
+        self.relation = relation
+        self.prices = prices
+        self.totals = totals
+        self._base = base
+        positions = base.positions
+        self._keys = sorted((-total, positions[manufacturer_id], manufacturer_id)
+                            for manufacturer_id, total in totals.items())
+
+    def iter_ranked(self) -> Iterator[Tuple[int, float]]:
+        """Пары (ID производителя, сумма) по убыванию суммы"""
+        keys, _ = self._base.ranking(self.relation)
+        changed = self.totals
+        unchanged = (key for key in keys if key[2] not in changed)
+        for negative_total, _, manufacturer_id in merge(unchanged, self._keys):
+            yield manufacturer_id, -negative_total
+
+    def top(self, k: int) -> List[Tuple[str, float]]:
+        """Первые k строк рейтинга"""
+        manufacturers = self._base.manufacturers
+        return [(manufacturers[manufacturer_id].manufacturer_name, total)
+                for manufacturer_id, total in islice(self.iter_ranked(), k)]
+
+    def ranked_totals(self) -> List[Tuple[str, float]]:
+        """Рейтинг как в get_total_price_by_manufacturer(relation) по новым ценам
+
+        Копируются строки рейтинга каталога; строки затронутых
+        производителей удаляются и вставляются по позициям, найденным
+        бинарным поиском.
+        """
+        base = self._base
+        base.check_version()
+        keys, totals = base.ranking(self.relation)
+        rows = list(base.ranked_rows(self.relation))
+        positions = base.positions
+        removed = sorted(bisect_left(keys, (-totals[manufacturer_id], positions[manufacturer_id],
+                                            manufacturer_id))
+                         for manufacturer_id in self.totals)
+        for index in reversed(removed):
+            del rows[index]
+        manufacturers = base.manufacturers
+        removed_before = 0
+        for inserted, key in enumerate(self._keys):
+            index = bisect_left(keys, key)
+            while removed_before < len(removed) and removed[removed_before] < index:
+                removed_before += 1
+            rows.insert(index - removed_before + inserted,
+                        (manufacturers[key[2]].manufacturer_name, -key[0]))
+        return rows
+
+    def details_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                ) -> List[Tuple[str, str, float]]:
+        """Запрос 1 по новым ценам"""
+        rows, row_positions = self._base.details_rows(relation)
+        rows = list(rows)
+        for detail_id, price in self.prices.items():
+            for position in row_positions.get(detail_id, ()):
+                manufacturer_name, detail_name, _ = rows[position]
+                rows[position] = (manufacturer_name, detail_name, price)
+        return rows
+
+    def manufacturers_with_details_matching(self, pattern: str = "отдел",
+                                            relation: Relation = Relation.LINKS
+                                            ) -> Dict[str, List[Tuple[str, float]]]:
+        """Запрос 3 по новым ценам; заново собираются только затронутые списки"""
+        base_result, names = self._base.matching(pattern, relation)
+        result = dict(base_result)
+        prices = self.prices
+        for manufacturer_id in set(self._base.affected(prices, relation)):
+            name = names.get(manufacturer_id)
+            if name is not None:
+                result[name] = [(detail.detail_name, prices.get(detail.detail_id, detail.price))
+                                for detail in self._base.service.iter_related_details(
+                                    manufacturer_id, relation)]
+        return result
+
+
+class ScenarioEngine:
+    """Расчет пакетов сценариев над одним сервисом
+
+    Сервис не изменяется. Общие для сценариев данные (рейтинг каталога,
+    обратный индекс связей, строки запросов) строятся один раз на
+    версию данных и пересобираются, если сервис изменился.
+    """
+
+    def __init__(self, service: ManufacturingService):
+        self.service = service
+        self._base = _Base(service)
+
+    def _current_base(self) -> _Base:
+        if self.service.get_data_version() != self._base.version:
+            self._base = _Base(self.service)
+        return self._base
+
+    def evaluate(self, scenario: Scenario, relation: Relation = Relation.OWNERSHIP
+                 ) -> ScenarioResult:
+        """Новые цены и суммы производителей по отношению relation"""
+        return self.evaluate_batch([scenario], relation)[0]
+
+    def evaluate_batch(self, scenarios: Sequence[Scenario],
+                       relation: Relation = Relation.OWNERSHIP) -> List[ScenarioResult]:
+        """Результаты сценариев в порядке scenarios"""
+        base = self._current_base()
+        base.ranking(relation)
+        return [ScenarioResult(scenario, base, relation, prices,
+                               self._totals(base, prices, relation))
+                for scenario in scenarios
+                for prices in (self._prices(scenario),)]
+
+    def _prices(self, scenario: Scenario) -> Dict[int, float]:
+        """Наложение новых цен: detail_id -> цена после всех преобразований"""
+        service = self.service
+        prices: Dict[int, float] = {}
+        for transform in scenario.transforms:
+            details: Dict[int, Detail] = {
+                detail.detail_id: detail
+                for detail in service.iter_related_details(transform.manufacturer_id,
+                                                           transform.relation)}
+            if isinstance(transform, Markup):
+                factor = transform.factor
+                for detail_id, detail in details.items():
+                    prices[detail_id] = prices.get(detail_id, detail.price) * factor
+            else:
+                amount = transform.amount
+                for detail_id, detail in details.items():
+                    prices[detail_id] = prices.get(detail_id, detail.price) + amount
+        return prices
+
+    def _totals(self, base: _Base, prices: Dict[int, float],
+                relation: Relation) -> Dict[int, float]:
+        """Суммы затронутых производителей, в том же порядке сложения, что и у сервиса"""
+        service = self.service
+        totals = {}
+        for manufacturer_id in base.affected(prices, relation):
+            if manufacturer_id in totals or manufacturer_id not in base.positions:
+                continue
+            total_price = 0.0
+            for detail in service.iter_related_details(manufacturer_id, relation):
+                total_price += prices.get(detail.detail_id, detail.price)
+            totals[manufacturer_id] = total_price
+        return totals
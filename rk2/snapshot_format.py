@@ -0,0 +1,343 @@
+"""
+Бинарный снимок ManufacturingService для быстрого запуска
+Снимок хранит столбцы данных, таблицу строк и готовые индексы и
+открывается через mmap без копирования: процессы, открывшие один файл,
+разделяют одни и те же страницы памяти
+
+Формат (все числа little-endian):
+    заголовок   magic, версия, число секций, crc32, позиция журнала
+                изменений, размер данных
+    секции      имя, код типа array, смещение, число элементов
+    данные      массивы секций, выровненные по 8 байт
+crc32 считается по всему, что следует за заголовком.
+"""
+
+import os
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from refactored_manufacturing import (
+    Manufacturer,
+    Detail,
+    ManufacturerDetail,
+    ManufacturingService,
+    fold_case
+)
+
+MAGIC = b"RKPLPSNP"
+FORMAT_VERSION = 2
+_HEADER = struct.Struct("<8sIIIIQ")  # magic, версия, секций, crc32, журнал, размер данных
+_SECTION = struct.Struct("<16s4sQQ")  # имя, код типа, смещение, число элементов
+_ALIGNMENT = 8
+
+
+class SnapshotError(ValueError):
+    """Файл не является корректным снимком"""
+
+
+def _string_table(strings: Dict[str, int], value: str) -> int:
+    return strings.setdefault(value, len(strings))
+
+
+def build_sections(service: ManufacturingService) -> Dict[str, array]:
+    """Столбцы и индексы снимка для сервиса"""
+    strings: Dict[str, int] = {}
+    manufacturers = service.manufacturers
+    details = service.details
+    links = service.manufacturer_details
+
+    manufacturer_positions = {m.manufacturer_id: i for i, m in enumerate(manufacturers)}
+    totals = [service.get_manufacturer_stats(m.manufacturer_id)[0] for m in manufacturers]
+
+    # Запрос 1: детали с существующим производителем по (manufacturer_id, detail_id)
+    details_order = sorted(
+        (i for i, d in enumerate(details) if d.manufacturer_id in manufacturer_positions),
+        key=lambda i: (details[i].manufacturer_id, details[i].detail_id))
+    owned_group_ids, owned_group_starts = _groups(
+        [details[i].manufacturer_id for i in details_order])
+
+    # Связи идут в порядке сервиса, сгруппированными по производителям;
+    # группы индексируются по возрастанию manufacturer_id
+    link_groups, link_starts = _groups([link.manufacturer_id for link in links])
+    link_order = sorted(range(len(link_groups)), key=link_groups.__getitem__)
+
+    sections = {
+        "m_ids": array("q", (m.manufacturer_id for m in manufacturers)),
+        "m_names": array("q", (_string_table(strings, m.manufacturer_name)
+                               for m in manufacturers)),
+        "m_totals": array("d", totals),
+        "d_ids": array("q", (d.detail_id for d in details)),
+        "d_names": array("q", (_string_table(strings, d.detail_name) for d in details)),
+        "d_prices": array("d", (d.price for d in details)),
+        "d_owners": array("q", (d.manufacturer_id for d in details)),
+        "d_owner_pos": array("q", (manufacturer_positions.get(d.manufacturer_id, -1)
+                                   for d in details)),
+        "l_manufacturers": array("q", (link.manufacturer_id for link in links)),
+        "l_details": array("q", (link.detail_id for link in links)),
+        "l_group_ids": array("q", (link_groups[i] for i in link_order)),
+        "l_group_starts": array("q", (link_starts[i] for i in link_order)),
+        "l_group_stops": array("q", (link_starts[i + 1] for i in link_order)),
+        "q1_order": array("q", details_order),
+        "own_group_ids": array("q", owned_group_ids),
+        "own_group_starts": array("q", owned_group_starts[:-1]),
+        "own_group_stops": array("q", owned_group_starts[1:]),
+        # Запрос 2: стабильная сортировка по убыванию суммы, как в сервисе
+        "q2_order": array("q", sorted(range(len(manufacturers)),
+                                      key=totals.__getitem__, reverse=True)),
+    }
+    for name, ids in (("m", sections["m_ids"]), ("d", sections["d_ids"])):
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        sections[f"{name}_sorted_ids"] = array("q", (ids[i] for i in order))
+        sections[f"{name}_sorted_pos"] = array("q", order)
+
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections["s_offsets"] = array("q", offsets)
+    sections["s_blob"] = array("B", b"".join(encoded))
+    return sections
+
+
+def _groups(keys: List[int]) -> Tuple[List[int], List[int]]:
+    """Ключи групп подряд идущих равных ключей и их начала (с концом в конце)"""
+    group_ids: List[int] = []
+    starts: List[int] = []
+    for position, key in enumerate(keys):
+        if not group_ids or group_ids[-1] != key:
+            group_ids.append(key)
+            starts.append(position)
+    starts.append(len(keys))
+    return group_ids, starts
+
+
+def write_snapshot(service: ManufacturingService, path: str, log_position: int = 0) -> None:
+    """Записывает снимок сервиса в файл
+
+    log_position - число записей ChangeLog, уже отраженных в сервисе;
+    после открытия снимка журнал воспроизводится с этой позиции.
+    """
+    sections = build_sections(service)
+
+    table_size = _SECTION.size * len(sections)
+    offset = _align(_HEADER.size + table_size)
+    entries = []
+    payload = []
+    for name, values in sections.items():
+        if sys.byteorder != "little":
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        entries.append(_SECTION.pack(name.encode("ascii"), values.typecode.encode("ascii"),
+                                     offset, len(values)))
+        padding = _align(len(data)) - len(data)
+        payload.append(data + bytes(padding))
+        offset += len(data) + padding
+
+    body = b"".join(entries)
+    body += bytes(_align(_HEADER.size + len(body)) - _HEADER.size - len(body))
+    body += b"".join(payload)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), zlib.crc32(body), log_position,
+                          len(body))
+    with open(path, "wb") as stream:
+        stream.write(header)
+        stream.write(body)
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SnapshotService:
+    """Сервис только для чтения поверх снимка в mmap
+
+    Столбцы - это memoryview над отображенным файлом, строки
+    декодируются при первом обращении. Для изменения данных снимок
+    переводится в обычный сервис методом to_service().
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        if sys.byteorder != "little":
+            raise SnapshotError("Снимок открывается без копирования только на little-endian")
+        with open(path, "rb") as stream:
+            # mmap не отображает пустой файл, а короткий проверяется до отображения
+            if os.fstat(stream.fileno()).st_size < _HEADER.size:
+                raise SnapshotError("Файл короче заголовка")
+            self._mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._views = self._map_sections(verify)
+        except Exception:
+            self._mmap.close()
+            raise
+        self._strings: Dict[int, str] = {}
+        self.log_position = _HEADER.unpack_from(self._mmap)[4]
+        for name, view in self._views.items():
+            setattr(self, f"_{name}", view)
+
+    def _map_sections(self, verify: bool) -> Dict[str, memoryview]:
+        views: Dict[str, memoryview] = {}
+        with memoryview(self._mmap) as buffer:
+            try:
+                self._read_sections(buffer, verify, views)
+            except Exception:
+                for view in views.values():
+                    view.release()
+                raise
+        return views
+
+    @staticmethod
+    def _read_sections(buffer: memoryview, verify: bool, views: Dict[str, memoryview]) -> None:
+        if len(buffer) < _HEADER.size:
+            raise SnapshotError("Файл короче заголовка")
+        magic, version, section_count, checksum, _, body_size = _HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise SnapshotError("Неверная сигнатура снимка")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"Неподдерживаемая версия снимка: {version}")
+        if len(buffer) != _HEADER.size + body_size:
+            raise SnapshotError("Размер файла не совпадает с заголовком")
+        if verify:
+            with buffer[_HEADER.size:] as body:
+                if zlib.crc32(body) != checksum:
+                    raise SnapshotError("Контрольная сумма не совпадает")
+
+        # Без проверки crc32 таблица секций может быть повреждена: границы
+        # секций проверяются, чтобы ошибка была SnapshotError
+        data_start = _HEADER.size + section_count * _SECTION.size
+        if data_start > len(buffer):
+            raise SnapshotError("Таблица секций выходит за пределы файла")
+        for index in range(section_count):
+            raw_name, raw_type, offset, count = _SECTION.unpack_from(
+                buffer, _HEADER.size + index * _SECTION.size)
+            try:
+                name = raw_name.rstrip(b"\0").decode("ascii")
+                typecode = raw_type.rstrip(b"\0").decode("ascii")
+                itemsize = array(typecode).itemsize
+            except (UnicodeDecodeError, ValueError, TypeError):
+                raise SnapshotError(f"Некорректное описание секции {index}") from None
+            size = count * itemsize
+            if offset < data_start or offset % itemsize or offset + size > len(buffer):
+                raise SnapshotError(f"Секция {name} выходит за пределы данных")
+            views[name] = buffer[offset:offset + size].cast(typecode)
+
+    def close(self) -> None:
+        """Освобождает представления и закрывает отображение файла
+
+        Если на отображение еще ссылаются срезы представлений, файл
+        отображения закрывается при освобождении последнего из них.
+        """
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string(self, index: int) -> str:
+        value = self._strings.get(index)
+        if value is None:
+            start, stop = self._s_offsets[index], self._s_offsets[index + 1]
+            value = self._strings[index] = bytes(self._s_blob[start:stop]).decode("utf-8")
+        return value
+
+    @staticmethod
+    def _position(sorted_ids: memoryview, positions: memoryview, key: int) -> int:
+        index = bisect_left(sorted_ids, key)
+        if index < len(sorted_ids) and sorted_ids[index] == key:
+            return positions[index]
+        return -1
+
+    def _manufacturer_at(self, position: int) -> Manufacturer:
+        return Manufacturer(self._m_ids[position], self._string(self._m_names[position]))
+
+    def _detail_at(self, position: int) -> Detail:
+        return Detail(self._d_ids[position], self._string(self._d_names[position]),
+                      self._d_prices[position], self._d_owners[position])
+
+    def get_manufacturer(self, manufacturer_id: int) -> Optional[Manufacturer]:
+        """Возвращает производителя по ID или None"""
+        position = self._position(self._m_sorted_ids, self._m_sorted_pos, manufacturer_id)
+        return self._manufacturer_at(position) if position >= 0 else None
+
+    def get_detail(self, detail_id: int) -> Optional[Detail]:
+        """Возвращает деталь по ID или None"""
+        position = self._position(self._d_sorted_ids, self._d_sorted_pos, detail_id)
+        return self._detail_at(position) if position >= 0 else None
+
+    @staticmethod
+    def _group(group_ids: memoryview, starts: memoryview, stops: memoryview,
+               key: int) -> Tuple[int, int]:
+        """Границы группы key в сгруппированном столбце, пустые если ее нет"""
+        group = bisect_left(group_ids, key)
+        if group < len(group_ids) and group_ids[group] == key:
+            return starts[group], stops[group]
+        return 0, 0
+
+    def iter_owned_details(self, manufacturer_id: int) -> Iterator[Detail]:
+        """Детали производителя по Detail.manufacturer_id в порядке detail_id"""
+        start, stop = self._group(self._own_group_ids, self._own_group_starts,
+                                  self._own_group_stops, manufacturer_id)
+        # Позиции читаются по одной: срез q1_order держал бы отображение
+        # файла, пока итератор не завершен
+        q1_order = self._q1_order
+        for index in range(start, stop):
+            yield self._detail_at(q1_order[index])
+
+    def get_details_by_manufacturer(self) -> List[Tuple[str, str, float]]:
+        """Запрос 1: Получить детали с их производителями"""
+        string, names, prices, owners = (self._string, self._d_names, self._d_prices,
+                                         self._d_owner_pos)
+        manufacturer_names = self._m_names
+        return [(string(manufacturer_names[owners[position]]), string(names[position]),
+                 prices[position])
+                for position in self._q1_order]
+
+    def get_total_price_by_manufacturer(self) -> List[Tuple[str, float]]:
+        """Запрос 2: Получить суммарную стоимость деталей по производителям"""
+        return [(self._string(self._m_names[position]), self._m_totals[position])
+                for position in self._q2_order]
+
+    def get_manufacturers_with_details_matching(self, pattern: str
+                                                ) -> Dict[str, List[Tuple[str, float]]]:
+        """Производители с подстрокой pattern в названии и их детали по связям"""
+        folded = fold_case(pattern)
+        result = {}
+        for position, manufacturer_id in enumerate(self._m_ids):
+            name = self._string(self._m_names[position])
+            if folded not in fold_case(name):
+                continue
+            start, stop = self._group(self._l_group_ids, self._l_group_starts,
+                                      self._l_group_stops, manufacturer_id)
+            details_list = []
+            for detail_id in self._l_details[start:stop]:
+                detail_position = self._position(self._d_sorted_ids, self._d_sorted_pos,
+                                                 detail_id)
+                if detail_position >= 0:
+                    details_list.append((self._string(self._d_names[detail_position]),
+                                         self._d_prices[detail_position]))
+            result[name] = details_list
+        return result
+
+    def get_department_manufacturers_with_details(self) -> Dict[str, List[Tuple[str, float]]]:
+        """Запрос 3: Получить производителей с 'отдел' в названии и их детали"""
+        return self.get_manufacturers_with_details_matching("отдел")
+
+    def to_service(self, **service_options) -> ManufacturingService:
+        """Создает изменяемый сервис с данными снимка"""
+        return ManufacturingService(
+            [self._manufacturer_at(i) for i in range(len(self._m_ids))],
+            [self._detail_at(i) for i in range(len(self._d_ids))],
+            [ManufacturerDetail(m, d) for m, d in zip(self._l_manufacturers, self._l_details)],
+            **service_options)
@@ -0,0 +1,397 @@
+"""
+Хранение каталога в SQLite с выполнением запросов 1-3 в SQL
+API и результаты совпадают с ManufacturingService; порядок вставки
+хранится в столбцах seq, чтобы порядок строк и выбор при равных суммах
+были такими же, как у словарей в памяти
+"""
+
+import sqlite3
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from refactored_manufacturing import (
+    Manufacturer,
+    Detail,
+    ManufacturerDetail,
+    Relation,
+    Change,
+    ChangeKind,
+    fold_case
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manufacturers (
+    seq INTEGER PRIMARY KEY,
+    manufacturer_id INTEGER NOT NULL UNIQUE,
+    manufacturer_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS details (
+    seq INTEGER PRIMARY KEY,
+    detail_id INTEGER NOT NULL UNIQUE,
+    detail_name TEXT NOT NULL,
+    price REAL NOT NULL,
+    manufacturer_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS details_by_manufacturer
+    ON details (manufacturer_id, detail_id);
+CREATE TABLE IF NOT EXISTS links (
+    seq INTEGER PRIMARY KEY,
+    manufacturer_id INTEGER NOT NULL,
+    detail_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_by_manufacturer ON links (manufacturer_id, seq);
+-- порядок групп связей, как у ключей словаря связей в памяти
+CREATE TABLE IF NOT EXISTS link_groups (
+    seq INTEGER PRIMARY KEY,
+    manufacturer_id INTEGER NOT NULL UNIQUE
+);
+"""
+
+# Запрос 1: ORDER BY по индексу details_by_manufacturer
+_DETAILS_BY_MANUFACTURER = {
+    Relation.OWNERSHIP: """
+        SELECT m.manufacturer_name, d.detail_name, d.price
+        FROM details d JOIN manufacturers m ON m.manufacturer_id = d.manufacturer_id
+        ORDER BY d.manufacturer_id, d.detail_id""",
+    Relation.LINKS: """
+        SELECT m.manufacturer_name, d.detail_name, d.price
+        FROM links l
+        JOIN manufacturers m ON m.manufacturer_id = l.manufacturer_id
+        JOIN details d ON d.detail_id = l.detail_id
+        ORDER BY l.manufacturer_id, d.detail_id, l.seq""",
+}
+
+# Запрос 2: LEFT JOIN оставляет производителей без деталей с суммой 0.0
+_TOTALS = {
+    Relation.OWNERSHIP: """
+        SELECT m.manufacturer_name, COALESCE(SUM(d.price), 0.0) AS total
+        FROM manufacturers m LEFT JOIN details d ON d.manufacturer_id = m.manufacturer_id
+        GROUP BY m.seq
+        ORDER BY total DESC, m.seq""",
+    Relation.LINKS: """
+        SELECT m.manufacturer_name, COALESCE(SUM(d.price), 0.0) AS total
+        FROM manufacturers m
+        LEFT JOIN links l ON l.manufacturer_id = m.manufacturer_id
+        LEFT JOIN details d ON d.detail_id = l.detail_id
+        GROUP BY m.seq
+        ORDER BY total DESC, m.seq""",
+}
+
+# Запрос 3: фильтр по названию и соединение с деталями
+_MATCHING = {
+    Relation.OWNERSHIP: """
+        SELECT m.seq, m.manufacturer_name, d.detail_name, d.price
+        FROM manufacturers m LEFT JOIN details d ON d.manufacturer_id = m.manufacturer_id
+        WHERE instr(fold_case(m.manufacturer_name), ?) > 0
+        ORDER BY m.seq, d.seq""",
+    Relation.LINKS: """
+        SELECT m.seq, m.manufacturer_name, d.detail_name, d.price
+        FROM manufacturers m
+        LEFT JOIN links l ON l.manufacturer_id = m.manufacturer_id
+        LEFT JOIN details d ON d.detail_id = l.detail_id
+        WHERE instr(fold_case(m.manufacturer_name), ?) > 0
+        ORDER BY m.seq, l.seq""",
+}
+
+
+class SQLiteManufacturingService:
+    """Сервис с данными в базе SQLite
+
+    Одно соединение используется для всех запросов (sqlite3 кэширует
+    подготовленные выражения соединения). Пакетная загрузка идет через
+    executemany по batch_size записей в транзакции; при ошибке пакеты до
+    нее остаются загруженными. Суммы запроса 2 считает SQLite в порядке
+    индекса и на нецелых ценах могут отличаться от ManufacturingService
+    в последних знаках.
+    """
+
+    def __init__(self, manufacturers: Iterable[Manufacturer] = (),
+                 details: Iterable[Detail] = (),
+                 manufacturer_details: Iterable[ManufacturerDetail] = (),
+                 path: str = ":memory:", batch_size: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.create_function("fold_case", 1, fold_case, deterministic=True)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(SCHEMA)
+        self.load(manufacturers, details, manufacturer_details)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Пакетная загрузка
+
+    def load(self, manufacturers: Iterable[Manufacturer] = (),
+             details: Iterable[Detail] = (),
+             manufacturer_details: Iterable[ManufacturerDetail] = ()) -> None:
+        """Добавляет записи пакетами по batch_size, каждый пакет - в своей транзакции
+
+        Загрузка не атомарна: при ошибке откатывается только пакет с
+        ошибкой, а пакеты до него остаются в базе.
+        """
+        self._insert_batches(
+            "manufacturers", ("manufacturer_id", "manufacturer_name"),
+            ((m.manufacturer_id, m.manufacturer_name) for m in manufacturers))
+        self._insert_batches(
+            "details", ("detail_id", "detail_name", "price", "manufacturer_id"),
+            ((d.detail_id, d.detail_name, d.price, d.manufacturer_id) for d in details))
+        self._insert_batches(
+            "links", ("manufacturer_id", "detail_id"),
+            ((md.manufacturer_id, md.detail_id) for md in manufacturer_details))
+
+    def _insert_batches(self, table: str, columns: Tuple[str, ...], rows: Iterable[tuple]) -> None:
+        statement = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                     f"VALUES ({', '.join('?' * len(columns))})")
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            try:
+                with self._transaction():
+                    (last_seq,) = self._connection.execute(
+                        f"SELECT COALESCE(MAX(seq), 0) FROM {table}").fetchone()
+                    self._connection.executemany(statement, batch)
+                    if table == "links":
+                        self._connection.execute(
+                            "INSERT OR IGNORE INTO link_groups (manufacturer_id) "
+                            "SELECT manufacturer_id FROM links WHERE seq > ? ORDER BY seq",
+                            (last_seq,))
+            except sqlite3.IntegrityError as error:
+                if not _is_duplicate_key(error):
+                    raise
+                raise ValueError(f"Повторяющийся ID в пакете {table}: {error}") from None
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    # Записи
+
+    @property
+    def manufacturers(self) -> List[Manufacturer]:
+        """Список производителей в порядке добавления"""
+        return [Manufacturer(*row) for row in self._connection.execute(
+            "SELECT manufacturer_id, manufacturer_name FROM manufacturers ORDER BY seq")]
+
+    @property
+    def details(self) -> List[Detail]:
+        """Список деталей в порядке добавления"""
+        return [Detail(*row) for row in self._connection.execute(
+            "SELECT detail_id, detail_name, price, manufacturer_id FROM details ORDER BY seq")]
+
+    @property
+    def manufacturer_details(self) -> List[ManufacturerDetail]:
+        """Список связей, сгруппированный по производителям"""
+        return [ManufacturerDetail(*row) for row in self._connection.execute(
+            "SELECT l.manufacturer_id, l.detail_id FROM links l "
+            "JOIN link_groups g ON g.manufacturer_id = l.manufacturer_id "
+            "ORDER BY g.seq, l.seq")]
+
+    def get_manufacturer(self, manufacturer_id: int) -> Optional[Manufacturer]:
+        """Возвращает производителя по ID или None"""
+        row = self._connection.execute(
+            "SELECT manufacturer_id, manufacturer_name FROM manufacturers "
+            "WHERE manufacturer_id = ?", (manufacturer_id,)).fetchone()
+        return Manufacturer(*row) if row else None
+
+    def get_detail(self, detail_id: int) -> Optional[Detail]:
+        """Возвращает деталь по ID или None"""
+        row = self._connection.execute(
+            "SELECT detail_id, detail_name, price, manufacturer_id FROM details "
+            "WHERE detail_id = ?", (detail_id,)).fetchone()
+        return Detail(*row) if row else None
+
+    # Изменение данных
+
+    def add_manufacturer(self, manufacturer: Manufacturer) -> None:
+        """Добавляет производителя"""
+        try:
+            with self._transaction():
+                self._connection.execute(
+                    "INSERT INTO manufacturers (manufacturer_id, manufacturer_name) VALUES (?, ?)",
+                    (manufacturer.manufacturer_id, manufacturer.manufacturer_name))
+        except sqlite3.IntegrityError as error:
+            if not _is_duplicate_key(error):
+                raise
+            raise ValueError(
+                f"Производитель {manufacturer.manufacturer_id} уже существует") from None
+
+    def update_manufacturer(self, manufacturer: Manufacturer) -> None:
+        """Заменяет производителя с тем же ID, сохраняя его позицию"""
+        with self._transaction():
+            cursor = self._connection.execute(
+                "UPDATE manufacturers SET manufacturer_name = ? WHERE manufacturer_id = ?",
+                (manufacturer.manufacturer_name, manufacturer.manufacturer_id))
+        if not cursor.rowcount:
+            raise KeyError(manufacturer.manufacturer_id)
+
+    def remove_manufacturer(self, manufacturer_id: int) -> Manufacturer:
+        """Удаляет производителя; его детали и связи остаются без изменений"""
+        manufacturer = self.get_manufacturer(manufacturer_id)
+        if manufacturer is None:
+            raise KeyError(manufacturer_id)
+        with self._transaction():
+            self._connection.execute(
+                "DELETE FROM manufacturers WHERE manufacturer_id = ?", (manufacturer_id,))
+        return manufacturer
+
+    def add_detail(self, detail: Detail) -> None:
+        """Добавляет деталь"""
+        try:
+            with self._transaction():
+                self._connection.execute(
+                    "INSERT INTO details (detail_id, detail_name, price, manufacturer_id) "
+                    "VALUES (?, ?, ?, ?)",
+                    (detail.detail_id, detail.detail_name, detail.price, detail.manufacturer_id))
+        except sqlite3.IntegrityError as error:
+            if not _is_duplicate_key(error):
+                raise
+            raise ValueError(f"Деталь {detail.detail_id} уже существует") from None
+
+    def update_detail(self, detail: Detail) -> None:
+        """Заменяет деталь с тем же ID (в том числе при смене производителя)"""
+        old = self.get_detail(detail.detail_id)
+        if old is None:
+            raise KeyError(detail.detail_id)
+        # seq не меняется: и при смене производителя деталь стоит в его
+        # группе в порядке добавления, как в ManufacturingService
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE details SET detail_name = ?, price = ?, manufacturer_id = ? "
+                "WHERE detail_id = ?",
+                (detail.detail_name, detail.price, detail.manufacturer_id, detail.detail_id))
+
+    def remove_detail(self, detail_id: int) -> Detail:
+        """Удаляет деталь; связи с ней остаются без изменений"""
+        detail = self.get_detail(detail_id)
+        if detail is None:
+            raise KeyError(detail_id)
+        with self._transaction():
+            self._connection.execute("DELETE FROM details WHERE detail_id = ?", (detail_id,))
+        return detail
+
+    def add_link(self, link: ManufacturerDetail) -> None:
+        """Добавляет связь производителя и детали"""
+        with self._transaction():
+            self._connection.execute(
+                "INSERT INTO links (manufacturer_id, detail_id) VALUES (?, ?)",
+                (link.manufacturer_id, link.detail_id))
+            self._connection.execute(
+                "INSERT OR IGNORE INTO link_groups (manufacturer_id) VALUES (?)",
+                (link.manufacturer_id,))
+
+    def remove_link(self, manufacturer_id: int, detail_id: int) -> ManufacturerDetail:
+        """Удаляет первую связь производителя с деталью"""
+        with self._transaction():
+            row = self._connection.execute(
+                "SELECT seq FROM links WHERE manufacturer_id = ? AND detail_id = ? "
+                "ORDER BY seq LIMIT 1", (manufacturer_id, detail_id)).fetchone()
+            if row is None:
+                raise KeyError((manufacturer_id, detail_id))
+            self._connection.execute("DELETE FROM links WHERE seq = ?", row)
+            self._connection.execute(
+                "DELETE FROM link_groups WHERE manufacturer_id = ? AND NOT EXISTS "
+                "(SELECT 1 FROM links WHERE manufacturer_id = ?)",
+                (manufacturer_id, manufacturer_id))
+        return ManufacturerDetail(manufacturer_id, detail_id)
+
+    _CHANGE_HANDLERS = {
+        (ChangeKind.INSERT, "manufacturers"): add_manufacturer,
+        (ChangeKind.UPDATE, "manufacturers"): update_manufacturer,
+        (ChangeKind.DELETE, "manufacturers"): remove_manufacturer,
+        (ChangeKind.INSERT, "details"): add_detail,
+        (ChangeKind.UPDATE, "details"): update_detail,
+        (ChangeKind.DELETE, "details"): remove_detail,
+        (ChangeKind.INSERT, "links"): add_link,
+        (ChangeKind.DELETE, "links"):
+            lambda self, link: self.remove_link(link.manufacturer_id, link.detail_id),
+    }
+
+    def apply_change(self, change: Change) -> None:
+        """Применяет одно изменение соответствующим методом add_*/update_*/remove_*"""
+        handler = self._CHANGE_HANDLERS.get((change.kind, change.table))
+        if handler is None:
+            raise ValueError(f"Неподдерживаемое изменение: {change.kind.value} {change.table}")
+        handler(self, change.record)
+
+    def apply_changes(self, changes: Iterable[Change]) -> int:
+        """Применяет пакет изменений по порядку и возвращает их количество"""
+        applied = 0
+        for change in changes:
+            self.apply_change(change)
+            applied += 1
+        return applied
+
+    # Запросы
+
+    def get_details_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                    ) -> List[Tuple[str, str, float]]:
+        """Запрос 1: Получить детали с их производителями"""
+        return self._connection.execute(_DETAILS_BY_MANUFACTURER[relation]).fetchall()
+
+    def get_total_price_by_manufacturer(self, relation: Relation = Relation.OWNERSHIP
+                                        ) -> List[Tuple[str, float]]:
+        """Запрос 2: Получить суммарную стоимость деталей по производителям"""
+        return self._connection.execute(_TOTALS[relation]).fetchall()
+
+    def get_top_manufacturers_by_total(self, k: int) -> List[Tuple[str, float]]:
+        """Первые k строк запроса 2"""
+        return self._connection.execute(
+            _TOTALS[Relation.OWNERSHIP] + " LIMIT ?", (k,)).fetchall()
+
+    def get_manufacturer_stats(self, manufacturer_id: int) -> Tuple[float, int]:
+        """Суммарная стоимость и количество деталей производителя"""
+        return self._connection.execute(
+            "SELECT COALESCE(SUM(price), 0.0), COUNT(*) FROM details WHERE manufacturer_id = ?",
+            (manufacturer_id,)).fetchone()
+
+    def get_manufacturers_with_details_matching(self, pattern: str,
+                                                relation: Relation = Relation.LINKS
+                                                ) -> Dict[str, List[Tuple[str, float]]]:
+        """Производители с подстрокой pattern в названии и их детали"""
+        result: Dict[str, List[Tuple[str, float]]] = {}
+        current_seq = None
+        for seq, manufacturer_name, detail_name, price in self._connection.execute(
+                _MATCHING[relation], (fold_case(pattern),)):
+            if seq != current_seq:
+                current_seq = seq
+                details_list = result[manufacturer_name] = []
+            if detail_name is not None:
+                details_list.append((detail_name, price))
+        return result
+
+    def get_department_manufacturers_with_details(self, relation: Relation = Relation.LINKS
+                                                  ) -> Dict[str, List[Tuple[str, float]]]:
+        """Запрос 3: Получить производителей с 'отдел' в названии и их детали"""
+        return self.get_manufacturers_with_details_matching("отдел", relation)
+
+
+class _Transaction:
+    """BEGIN/COMMIT вокруг блока; вложенные блоки входят во внешнюю транзакцию"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+        self._owner = False
+
+    def __enter__(self):
+        if not self._connection.in_transaction:
+            self._connection.execute("BEGIN")
+            self._owner = True
+
+    def __exit__(self, exc_type, *exc_info):
+        if self._owner:
+            self._connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _is_duplicate_key(error: sqlite3.IntegrityError) -> bool:
+    """Нарушение UNIQUE или PRIMARY KEY, а не, например, NOT NULL"""
+    return str(error).startswith("UNIQUE constraint failed")
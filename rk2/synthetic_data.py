@@ -0,0 +1,76 @@
+"""
+Генератор синтетических каталогов для тестов производительности
+"""
+
+import random
+from typing import List, Tuple
+
+from refactored_manufacturing import Manufacturer, Detail, ManufacturerDetail
+
+_LETTERS = "абвгдежзиклмнопрстуфхцчшэюя"
+
+
+def _padded(rng: random.Random, name: str, length: int) -> str:
+    """Дополняет название случайными буквами до длины length"""
+    if len(name) >= length:
+        return name
+    return name + " " + "".join(rng.choice(_LETTERS) for _ in range(length - len(name) - 1))
+
+
+def generate_catalog(manufacturer_count: int = 100,
+                     details_per_manufacturer: int = 10,
+                     link_fanout: float = 1.0,
+                     name_length: int = 0,
+                     skew: float = 0.0,
+                     department_share: float = 0.5,
+                     distinct_detail_names: int = 1000,
+                     seed: int = 0
+                     ) -> Tuple[List[Manufacturer], List[Detail], List[ManufacturerDetail]]:
+    """Создает случайный каталог
+
+    manufacturer_count * details_per_manufacturer деталей распределяются
+    по производителям равномерно (skew=0) или по закону Ципфа с
+    показателем skew. Каждая деталь в среднем имеет link_fanout связей:
+    первая - со своим производителем, остальные - со случайными.
+    Названия дополняются случайными буквами до name_length символов,
+    доля department_share производителей содержит "отдел" в названии,
+    а названия деталей повторяются с периодом distinct_detail_names.
+    """
+    rng = random.Random(seed)
+    manufacturer_ids = list(range(1, manufacturer_count + 1))
+
+    manufacturers = [
+        Manufacturer(manufacturer_id, _padded(
+            rng,
+            f"{'Отдел' if rng.random() < department_share else 'Производитель'} {manufacturer_id}",
+            name_length))
+        for manufacturer_id in manufacturer_ids
+    ]
+
+    detail_count = manufacturer_count * details_per_manufacturer
+    if skew > 0:
+        weights = [1 / rank ** skew for rank in range(1, manufacturer_count + 1)]
+        owners = rng.choices(manufacturer_ids, weights=weights, k=detail_count)
+    else:
+        owners = [i % manufacturer_count + 1 for i in range(detail_count)]
+
+    detail_names = [_padded(rng, f"Деталь {i}", name_length)
+                    for i in range(min(distinct_detail_names, detail_count))]
+    details = [
+        Detail(detail_id, detail_names[detail_id % len(detail_names)],
+               round(rng.uniform(1, 1000), 2), owner)
+        for detail_id, owner in enumerate(owners, 1)
+    ]
+
+    manufacturer_details = []
+    whole_links = int(link_fanout)
+    extra_share = link_fanout - whole_links
+    for detail in details:
+        link_count = whole_links + (rng.random() < extra_share)
+        if link_count:
+            manufacturer_details.append(ManufacturerDetail(detail.manufacturer_id, detail.detail_id))
+        for _ in range(link_count - 1):
+            manufacturer_details.append(
+                ManufacturerDetail(rng.choice(manufacturer_ids), detail.detail_id))
+
+    return manufacturers, details, manufacturer_details
@@ -3,14 +3,69 @@
 Используется TDD-фреймворк unittest
 """
 
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import tracemalloc
 import unittest
+from contextlib import redirect_stdout
 from refactored_manufacturing import (
     Manufacturer,
     Detail,
     ManufacturerDetail,
     ManufacturingService,
-    get_sample_data
+    Relation,
+    Change,
+    ChangeKind,
+    ReadOnlyServiceError,
+    Reports,
+    fold_case,
+    get_sample_data,
+    task1_functional,
+    task2_functional,
+    task3_functional
 )
+from loaders import LoadError, iter_records, load_into, load_service
+from parallel_queries import ShardedQueryExecutor
+from query_cache import CachedManufacturingService
+from compact_records import FrozenDetail, NamePool, SlottedDetail, to_compact
+from synthetic_data import generate_catalog
+from joins import check_integrity, group_details, join_details
+from async_service import AsyncManufacturingService, ServiceOverloadedError
+from benchmark_suite import compare_with_baseline, measure, percentile
+from snapshot_format import SnapshotError, SnapshotService, write_snapshot
+from change_log import ChangeLog
+from report_renderer import CSV_HEADER, render_reports, write_reports
+from sqlite_backend import SQLiteManufacturingService
+from versioned_service import LockedManufacturingService, VersionedManufacturingService
+from scenarios import Markup, Scenario, ScenarioEngine, Surcharge
+from query_planner import (
+    Collect, Count, Max, Min, Query, Sum, details_by_manufacturer_query,
+    manufacturers_with_details_matching_query, total_price_by_manufacturer_query
+)
+from instrumentation import (
+    CallbackSink, HistogramSink, Instrumentation, JsonLogSink, Sink, profile_call,
+    trace_allocations
+)
+
+try:
+    from columnar_storage import ColumnarManufacturingService
+except ImportError:  # NumPy не установлен
+    ColumnarManufacturingService = None
+
+try:
+    import arrow_io
+except ImportError:  # pyarrow не установлен
+    arrow_io = None
 
 
 class TestManufacturingService(unittest.TestCase):
@@ -130,6 +185,1976 @@ class TestManufacturingService(unittest.TestCase):
         print("✓ Тест с пустыми данными пройден")
 
 
+class TestServiceIndexes(unittest.TestCase):
+    """Тесты для индексов ManufacturingService и методов изменения данных"""
+
+    def setUp(self):
+        """Настройка тестовых данных перед каждым тестом"""
+        self.service = ManufacturingService(*get_sample_data())
+
+    def test_lookup_by_id(self):
+        """Поиск производителя и детали по ID"""
+        self.assertEqual(self.service.get_manufacturer(2).manufacturer_name,
+                         "Отдел металлообработки")
+        self.assertEqual(self.service.get_detail(4).price, 250.00)
+        self.assertIsNone(self.service.get_manufacturer(100))
+        self.assertIsNone(self.service.get_detail(100))
+
+    def test_add_detail_and_link(self):
+        """Добавленная деталь и связь видны во всех запросах"""
+        self.service.add_detail(Detail(11, "Пружина", 4.00, 3))
+        self.service.add_link(ManufacturerDetail(3, 11))
+
+        self.assertIn(("Электротехнический отдел", "Пружина", 4.00),
+                      self.service.get_details_by_manufacturer())
+        totals = dict(self.service.get_total_price_by_manufacturer())
+        self.assertAlmostEqual(totals["Электротехнический отдел"], 4.00)
+        department = self.service.get_department_manufacturers_with_details()
+        self.assertIn(("Пружина", 4.00), department["Электротехнический отдел"])
+
+    def test_update_detail_moves_between_manufacturers(self):
+        """Смена производителя у детали переносит ее стоимость"""
+        self.service.update_detail(Detail(10, "Шестерня модуль 1", 120.00, 2))
+
+        totals = dict(self.service.get_total_price_by_manufacturer())
+        self.assertAlmostEqual(totals["Основной производственный отдел"], 45.00)
+        self.assertAlmostEqual(totals["Отдел металлообработки"], 149.00)
+
+    def test_moved_detail_keeps_insertion_order(self):
+        """Группы деталей после переноса совпадают с сервисом, собранным заново"""
+        service = ManufacturingService(
+            [Manufacturer(1, "Отдел 1"), Manufacturer(2, "Отдел 2")],
+            [Detail(1, "a", 1.0, 1), Detail(2, "b", 2.0, 2), Detail(3, "c", 3.0, 2)], [])
+        service.update_detail(Detail(1, "a", 1.0, 2))
+        self.assertEqual(service.get_manufacturers_with_details_matching("отдел 2",
+                                                                         Relation.OWNERSHIP),
+                         {"Отдел 2": [("a", 1.0), ("b", 2.0), ("c", 3.0)]})
+
+        for seed in range(3):
+            data = make_random_catalog(seed)
+            service = ManufacturingService(*data)
+            service.apply_changes(make_random_changes(ManufacturingService(*data), seed))
+            fresh = ManufacturingService(service.manufacturers, service.details,
+                                         service.manufacturer_details)
+            with self.subTest(seed=seed):
+                self.assertEqual([(manufacturer_id, list(group)) for manufacturer_id, group
+                                  in sorted(service.iter_detail_groups())],
+                                 [(manufacturer_id, list(group)) for manufacturer_id, group
+                                  in sorted(fresh.iter_detail_groups())])
+                self.assertEqual(service.get_department_manufacturers_with_details(
+                    Relation.OWNERSHIP),
+                    fresh.get_department_manufacturers_with_details(Relation.OWNERSHIP))
+
+    def test_remove_detail_manufacturer_and_link(self):
+        """Удаление данных согласованно отражается в запросах"""
+        self.service.remove_detail(4)
+        self.service.remove_link(2, 1)
+        self.service.remove_manufacturer(5)
+
+        names = [detail for _, detail, _ in self.service.get_details_by_manufacturer()]
+        self.assertNotIn("Микроконтроллер ATmega328", names)
+        self.assertNotIn("Винт саморез", names)
+        department = self.service.get_department_manufacturers_with_details()
+        self.assertNotIn("Отдел крепежных изделий", department)
+        self.assertEqual(len(department["Отдел металлообработки"]), 2)
+
+    def test_invalid_mutations(self):
+        """Ошибки при дублировании и удалении несуществующих данных"""
+        with self.assertRaises(ValueError):
+            self.service.add_manufacturer(Manufacturer(1, "Дубликат"))
+        with self.assertRaises(ValueError):
+            self.service.add_detail(Detail(1, "Дубликат", 1.0, 1))
+        with self.assertRaises(KeyError):
+            self.service.update_detail(Detail(100, "Нет", 1.0, 1))
+        with self.assertRaises(KeyError):
+            self.service.remove_link(1, 1)
+
+    def test_record_lists_are_copies(self):
+        """Списки записей - копии; число строк доступно без копирования"""
+        manufacturers, details, links = get_sample_data()
+        self.service.details.append(Detail(11, "Пружина", 4.00, 3))
+        self.assertEqual(self.service.details, details)
+        self.assertEqual(self.service.get_row_counts(),
+                         (len(manufacturers), len(details), len(links)))
+        self.assertEqual(self.service.get_row_counts("links", "details"),
+                         (len(links), len(details)))
+        with self.assertRaises(KeyError):
+            self.service.get_row_counts("orders")
+
+
+class TestIncrementalTotals(unittest.TestCase):
+    """Сравнение инкрементальных сумм с полным пересчетом"""
+
+    def assert_same_totals(self, incremental, full_scan):
+        """Результаты запроса 2 и top-k совпадают в обоих режимах"""
+        self.assertEqual(incremental.get_total_price_by_manufacturer(),
+                         full_scan.get_total_price_by_manufacturer())
+        for k in (0, 1, 3):
+            self.assertEqual(incremental.get_top_manufacturers_by_total(k),
+                             full_scan.get_top_manufacturers_by_total(k))
+
+    def test_sample_data(self):
+        """На тестовых данных режимы дают одинаковый результат"""
+        incremental = ManufacturingService(*get_sample_data(), incremental_totals=True)
+        full_scan = ManufacturingService(*get_sample_data())
+        self.assert_same_totals(incremental, full_scan)
+        self.assertEqual(incremental.get_manufacturer_stats(2),
+                         full_scan.get_manufacturer_stats(2))
+
+    def test_randomized_mutations(self):
+        """Случайные добавления, удаления, переоценки и переносы деталей"""
+        rng = random.Random(2024)
+        incremental = ManufacturingService([], [], [], incremental_totals=True)
+        full_scan = ManufacturingService([], [], [])
+        manufacturer_ids = list(range(1, 9))
+        for manufacturer_id in manufacturer_ids:
+            for service in (incremental, full_scan):
+                service.add_manufacturer(Manufacturer(manufacturer_id, f"Производитель {manufacturer_id}"))
+
+        next_detail_id = 1
+        for _ in range(2000):
+            detail_ids = list(incremental.get_details_dict())
+            operation = rng.random()
+            # Цены кратны 0.25 и складываются в двоичной арифметике без погрешности
+            price = rng.randint(0, 400) / 4
+            manufacturer_id = rng.choice(manufacturer_ids)
+
+            if operation < 0.4 or not detail_ids:
+                detail = Detail(next_detail_id, f"Деталь {next_detail_id}", price, manufacturer_id)
+                next_detail_id += 1
+                incremental.add_detail(detail)
+                full_scan.add_detail(detail)
+            elif operation < 0.6:
+                detail_id = rng.choice(detail_ids)
+                incremental.remove_detail(detail_id)
+                full_scan.remove_detail(detail_id)
+            elif operation < 0.8:
+                old = incremental.get_detail(rng.choice(detail_ids))
+                detail = Detail(old.detail_id, old.detail_name, price, old.manufacturer_id)
+                incremental.update_detail(detail)
+                full_scan.update_detail(detail)
+            elif operation < 0.97:
+                old = incremental.get_detail(rng.choice(detail_ids))
+                detail = Detail(old.detail_id, old.detail_name, old.price, manufacturer_id)
+                incremental.update_detail(detail)
+                full_scan.update_detail(detail)
+            else:
+                removed = incremental.remove_manufacturer(manufacturer_id)
+                full_scan.remove_manufacturer(manufacturer_id)
+                incremental.add_manufacturer(removed)
+                full_scan.add_manufacturer(removed)
+
+            self.assert_same_totals(incremental, full_scan)
+
+        for manufacturer_id in manufacturer_ids:
+            self.assertEqual(incremental.get_manufacturer_stats(manufacturer_id),
+                             full_scan.get_manufacturer_stats(manufacturer_id))
+
+
+class TestManufacturerNameSearch(unittest.TestCase):
+    """Тесты поиска производителей по подстроке названия"""
+
+    def setUp(self):
+        """Настройка тестовых данных перед каждым тестом"""
+        self.service = ManufacturingService(*get_sample_data())
+
+    def names(self, substring):
+        """Названия найденных производителей"""
+        return [m.manufacturer_name for m in self.service.find_manufacturers(substring)]
+
+    def test_case_insensitive_cyrillic(self):
+        """Регистр кириллицы не влияет на поиск, порядок - порядок добавления"""
+        expected = ["Основной производственный отдел", "Отдел металлообработки",
+                    "Электротехнический отдел", "Отдел крепежных изделий"]
+        self.assertEqual(self.names("отдел"), expected)
+        self.assertEqual(self.names("ОТДЕЛ"), expected)
+        self.assertEqual(self.names("ОтДеЛ"), expected)
+
+    def test_short_and_missing_substrings(self):
+        """Подстроки короче триграммы и отсутствующие подстроки"""
+        self.assertEqual(self.names("эл"), ["Электротехнический отдел",
+                                            "Производитель электронных компонентов"])
+        self.assertEqual(len(self.names("")), 5)
+        self.assertEqual(self.names("склад"), [])
+
+    def test_index_follows_mutations(self):
+        """Индекс обновляется при изменении и удалении производителей"""
+        self.service.update_manufacturer(Manufacturer(4, "Отдел электроники"))
+        self.service.remove_manufacturer(2)
+        self.service.add_manufacturer(Manufacturer(6, "СКЛАДСКОЙ ОТДЕЛ"))
+
+        self.assertEqual(self.names("отдел"), [
+            "Основной производственный отдел", "Электротехнический отдел",
+            "Отдел электроники", "Отдел крепежных изделий", "СКЛАДСКОЙ ОТДЕЛ"])
+        self.assertEqual(self.names("металл"), [])
+
+    def test_matching_details(self):
+        """Детали производителей, найденных по произвольной подстроке"""
+        result = self.service.get_manufacturers_with_details_matching("КРЕПЕЖ")
+        self.assertEqual(result, {"Отдел крепежных изделий": [("Винт саморез", 12.00),
+                                                              ("Дюбель пластиковый", 7.50)]})
+
+
+def make_random_catalog(seed, manufacturer_count=20, detail_count=300, link_count=400):
+    """Случайный каталог с пропущенными ID, связями без деталей и равными суммами"""
+    rng = random.Random(seed)
+    manufacturers = [
+        Manufacturer(manufacturer_id, rng.choice(["Отдел", "Цех", "ОТДЕЛЕНИЕ", "Завод"])
+                     + f" {manufacturer_id}")
+        for manufacturer_id in rng.sample(range(1, 40), manufacturer_count)
+    ]
+    details = [
+        Detail(detail_id, f"Деталь {detail_id % 50}", rng.randint(0, 40) / 4, rng.randint(1, 40))
+        for detail_id in rng.sample(range(1, 1000), detail_count)
+    ]
+    manufacturer_details = [
+        ManufacturerDetail(rng.randint(1, 40), rng.randint(1, 1000))
+        for _ in range(link_count)
+    ]
+    return manufacturers, details, manufacturer_details
+
+
+@unittest.skipIf(ColumnarManufacturingService is None, "NumPy не установлен")
+class TestColumnarStorage(unittest.TestCase):
+    """Колоночное хранилище дает те же результаты, что и ManufacturingService"""
+
+    def assert_same_results(self, data):
+        """Результаты всех запросов совпадают, включая типы значений"""
+        expected = ManufacturingService(*data)
+        columnar = ColumnarManufacturingService(*data)
+
+        self.assertEqual(columnar.get_details_by_manufacturer(),
+                         expected.get_details_by_manufacturer())
+        self.assertEqual(columnar.get_total_price_by_manufacturer(),
+                         expected.get_total_price_by_manufacturer())
+        self.assertEqual(columnar.get_department_manufacturers_with_details(),
+                         expected.get_department_manufacturers_with_details())
+        for name, detail_name, price in columnar.get_details_by_manufacturer():
+            self.assertIs(type(price), float)
+
+    def test_sample_data(self):
+        """Тестовые данные"""
+        self.assert_same_results(get_sample_data())
+
+    def test_empty_data(self):
+        """Пустые данные"""
+        self.assert_same_results(([], [], []))
+
+    def test_random_catalogs(self):
+        """Случайные каталоги"""
+        for seed in range(5):
+            self.assert_same_results(make_random_catalog(seed))
+
+    def test_string_table_interns_names(self):
+        """Повторяющиеся названия хранятся один раз"""
+        columnar = ColumnarManufacturingService(*make_random_catalog(0))
+        self.assertLessEqual(len(columnar.strings), 50 + 20)
+
+
+class TestLazyQueries(unittest.TestCase):
+    """Тесты ленивых вариантов запросов и постраничного вывода"""
+
+    def services(self):
+        """Сервисы на тестовых и случайных данных в обоих режимах сумм"""
+        for data in (get_sample_data(), make_random_catalog(1), make_random_catalog(2)):
+            yield ManufacturingService(*data)
+            yield ManufacturingService(*data, incremental_totals=True)
+
+    def test_iterators_match_eager_queries(self):
+        """Итераторы выдают те же строки в том же порядке"""
+        for service in self.services():
+            self.assertEqual(list(service.iter_details_by_manufacturer()),
+                             service.get_details_by_manufacturer())
+            self.assertEqual(list(service.iter_total_price_by_manufacturer()),
+                             service.get_total_price_by_manufacturer())
+            self.assertEqual(dict(service.iter_department_manufacturers_with_details()),
+                             service.get_department_manufacturers_with_details())
+            self.assertEqual(service.count_details_by_manufacturer(),
+                             len(service.get_details_by_manufacturer()))
+            for relation in Relation:
+                self.assertEqual([(manufacturer.manufacturer_name, detail.detail_name,
+                                   detail.price)
+                                  for manufacturer, details
+                                  in service.iter_sorted_detail_groups(relation)
+                                  for detail in details],
+                                 service.get_details_by_manufacturer(relation))
+                totals = dict(service.get_total_price_by_manufacturer(relation))
+                for manufacturer in service.manufacturers:
+                    self.assertEqual(service.get_manufacturer_total(
+                        manufacturer.manufacturer_id, relation),
+                        totals[manufacturer.manufacturer_name])
+
+    def test_offset_and_limit(self):
+        """offset/limit соответствуют срезу полного результата"""
+        for service in self.services():
+            details = service.get_details_by_manufacturer()
+            totals = service.get_total_price_by_manufacturer()
+            department = list(service.get_department_manufacturers_with_details().items())
+            for offset, limit in ((0, 3), (2, 5), (4, None), (100, 1)):
+                stop = None if limit is None else offset + limit
+                self.assertEqual(list(service.iter_details_by_manufacturer(offset, limit)),
+                                 details[offset:stop])
+                self.assertEqual(list(service.iter_total_price_by_manufacturer(offset, limit)),
+                                 totals[offset:stop])
+                self.assertEqual(list(service.iter_department_manufacturers_with_details(offset, limit)),
+                                 department[offset:stop])
+
+    def test_keyset_pagination(self):
+        """Страницы по курсору складываются в полный результат запроса 1"""
+        for service in self.services():
+            rows = []
+            page, cursor = service.page_details_by_manufacturer(7)
+            rows.extend(page)
+            while cursor is not None:
+                page, cursor = service.page_details_by_manufacturer(7, after=cursor)
+                rows.extend(page)
+            self.assertEqual(rows, service.get_details_by_manufacturer())
+
+    def test_resume_after_key(self):
+        """Продолжение после ключа (manufacturer_id, detail_id)"""
+        service = ManufacturingService(*get_sample_data())
+        self.assertEqual(next(service.iter_details_by_manufacturer(after=(2, 1))),
+                         ("Отдел металлообработки", "Гайка М8", 8.30))
+        self.assertEqual(next(service.iter_details_by_manufacturer(after=(3, 0))),
+                         ("Производитель электронных компонентов",
+                          "Микроконтроллер ATmega328", 250.00))
+        self.assertEqual(list(service.iter_details_by_manufacturer(after=(5, 8))), [])
+
+    def test_sorted_groups_follow_changes(self):
+        """Порядок запроса 1 после изменений и fork() совпадает со сборкой с нуля"""
+        data = make_random_catalog(5)
+        changes = make_random_changes(ManufacturingService(*data), 5, count=300)
+        service = ManufacturingService(*data)
+        before = service.get_details_by_manufacturer()  # группы уже отсортированы
+        for start in range(0, len(changes), 50):
+            service.apply_changes(changes[start:start + 50])
+            fresh = ManufacturingService(service.manufacturers, service.details,
+                                         service.manufacturer_details)
+            expected = fresh.get_details_by_manufacturer()
+            self.assertEqual(service.get_details_by_manufacturer(), expected)
+            self.assertEqual(list(service.iter_details_by_manufacturer()), expected)
+            self.assertEqual(service.page_details_by_manufacturer(5, after=(3, 0)),
+                             fresh.page_details_by_manufacturer(5, after=(3, 0)))
+            self.assertEqual(service.run_all_reports().details_by_manufacturer, expected)
+
+        parent = ManufacturingService(*data)
+        parent.get_details_by_manufacturer()
+        version = parent.fork(changes)
+        self.assertEqual(parent.get_details_by_manufacturer(), before)
+        self.assertEqual(version.get_details_by_manufacturer(), expected)
+
+
+class TestQueryCache(unittest.TestCase):
+    """Тесты кэша результатов запросов"""
+
+    def setUp(self):
+        """Настройка тестовых данных перед каждым тестом"""
+        self.service = ManufacturingService(*get_sample_data())
+        self.cached = CachedManufacturingService(self.service, maxsize=3)
+
+    def test_hits_and_same_results(self):
+        """Повторный запрос берется из кэша и совпадает с запросом сервиса"""
+        first = self.cached.get_total_price_by_manufacturer()
+        second = self.cached.get_total_price_by_manufacturer()
+
+        self.assertIs(first, second)
+        self.assertEqual(list(first), self.service.get_total_price_by_manufacturer())
+        self.assertEqual(dict(self.cached.get_department_manufacturers_with_details()),
+                         {name: tuple(details_list) for name, details_list
+                          in self.service.get_department_manufacturers_with_details().items()})
+        info = self.cached.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+
+    def test_invalidates_only_affected_entries(self):
+        """Изменение связей не сбрасывает запросы 1 и 2, изменение деталей сбрасывает"""
+        self.cached.get_details_by_manufacturer()
+        self.cached.get_department_manufacturers_with_details()
+
+        self.service.remove_link(2, 1)
+        self.cached.get_details_by_manufacturer()
+        department = self.cached.get_department_manufacturers_with_details()
+        self.assertEqual(len(department["Отдел металлообработки"]), 2)
+        self.assertEqual(self.cached.cache_info().invalidations, 1)
+
+        self.service.update_detail(Detail(1, "Болт М8", 20.00, 2))
+        rows = self.cached.get_details_by_manufacturer()
+        self.assertIn(("Отдел металлообработки", "Болт М8", 20.00), rows)
+        self.assertEqual(self.cached.cache_info().invalidations, 2)
+
+    def test_lru_eviction(self):
+        """Вытесняется давно не использованная запись"""
+        for k in (1, 2, 3):
+            self.cached.get_top_manufacturers_by_total(k)
+        self.cached.get_top_manufacturers_by_total(1)
+        self.cached.get_top_manufacturers_by_total(4)
+
+        info = self.cached.cache_info()
+        self.assertEqual((info.evictions, info.size), (1, 3))
+        self.cached.get_top_manufacturers_by_total(1)
+        self.assertEqual(self.cached.cache_info().hits, 2)
+        self.cached.get_top_manufacturers_by_total(2)
+        self.assertEqual(self.cached.cache_info().misses, 5)
+
+    def test_row_budget(self):
+        """Суммарное число строк в кэше ограничено max_rows"""
+        cached = CachedManufacturingService(self.service, max_rows=12)
+        cached.get_details_by_manufacturer()
+        cached.get_total_price_by_manufacturer()
+        self.assertEqual(cached.cache_info().size, 1)
+        self.assertLessEqual(cached.cache_info().rows, 12)
+
+    def test_results_are_immutable(self):
+        """Результаты нельзя изменить"""
+        department = self.cached.get_department_manufacturers_with_details()
+        with self.assertRaises(TypeError):
+            department["Новый"] = ()
+        with self.assertRaises(AttributeError):
+            department["Отдел металлообработки"].append(("Деталь", 1.0))
+        with self.assertRaises(AttributeError):
+            self.cached.get_details_by_manufacturer().append(("a", "b", 1.0))
+
+
+class TestAsyncService(unittest.IsolatedAsyncioTestCase):
+    """Тесты асинхронного фасада"""
+
+    def setUp(self):
+        """Настройка тестовых данных перед каждым тестом"""
+        self.service = ManufacturingService(*get_sample_data())
+
+    async def test_results_match_service(self):
+        """Асинхронные запросы дают те же результаты"""
+        facade = AsyncManufacturingService(self.service)
+        self.assertEqual(list(await facade.get_details_by_manufacturer()),
+                         self.service.get_details_by_manufacturer())
+        self.assertEqual(list(await facade.get_total_price_by_manufacturer(Relation.LINKS)),
+                         self.service.get_total_price_by_manufacturer(Relation.LINKS))
+        department = await facade.get_department_manufacturers_with_details()
+        self.assertEqual({name: list(details_list) for name, details_list in department.items()},
+                         self.service.get_department_manufacturers_with_details())
+
+    async def test_identical_requests_are_coalesced(self):
+        """Одновременные одинаковые запросы выполняются один раз и получают
+        один неизменяемый результат"""
+        facade = AsyncManufacturingService(self.service, coalesce_window=0.01)
+        results = await asyncio.gather(
+            *(facade.get_total_price_by_manufacturer() for _ in range(50)))
+
+        self.assertEqual(facade.computations, 1)
+        self.assertEqual(facade.coalesced, 49)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(list(results[0]), self.service.get_total_price_by_manufacturer())
+        with self.assertRaises(AttributeError):
+            results[0].clear()
+        department = await asyncio.gather(
+            *(facade.get_department_manufacturers_with_details() for _ in range(2)))
+        self.assertIs(department[0], department[1])
+        with self.assertRaises(TypeError):
+            department[0]["Отдел"] = ()
+
+    async def test_backpressure(self):
+        """Запросы сверх max_pending отклоняются"""
+        facade = AsyncManufacturingService(self.service, max_pending=1,
+                                           coalesce_window=0.01, single_flight=False)
+        results = await asyncio.gather(
+            facade.get_details_by_manufacturer(),
+            facade.get_details_by_manufacturer(),
+            return_exceptions=True)
+
+        self.assertIsInstance(results[1], ServiceOverloadedError)
+        self.assertEqual(list(results[0]), self.service.get_details_by_manufacturer())
+
+    async def test_apply_mutation(self):
+        """Изменение через apply видно следующим запросам"""
+        facade = AsyncManufacturingService(self.service)
+        await facade.apply(lambda service: service.remove_manufacturer(4))
+        totals = await facade.get_total_price_by_manufacturer()
+        self.assertEqual(len(totals), 4)
+
+    def block_totals(self):
+        """Запрос 2 сервиса ждет release; возвращает (started, release)"""
+        started, release = threading.Event(), threading.Event()
+        query = self.service.get_total_price_by_manufacturer
+
+        def blocked(*args):
+            started.set()
+            release.wait(5)
+            return query(*args)
+        self.service.get_total_price_by_manufacturer = blocked
+        return started, release
+
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        """Отмена первого запроса не отменяет объединенные с ним"""
+        started, release = self.block_totals()
+        facade = AsyncManufacturingService(self.service)
+        leader = asyncio.ensure_future(facade.get_total_price_by_manufacturer())
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(facade.get_total_price_by_manufacturer())
+        await asyncio.to_thread(started.wait, 5)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual(list(await follower), self.service.get_total_price_by_manufacturer())
+        self.assertEqual((facade.computations, facade.coalesced), (1, 1))
+
+    async def test_cancelled_read_holds_reader_until_computed(self):
+        """После отмены чтения apply() ждет, пока вычисление в потоке не закончится"""
+        started, release = self.block_totals()
+        facade = AsyncManufacturingService(self.service)
+        events = []
+        read = asyncio.ensure_future(facade.get_total_price_by_manufacturer())
+        await asyncio.to_thread(started.wait, 5)
+        read.cancel()
+        write = asyncio.ensure_future(facade.apply(lambda service: events.append("apply")))
+        await asyncio.sleep(0.05)
+        self.assertEqual(events, [])
+        release.set()
+        await write
+        self.assertEqual(events, ["apply"])
+
+
+class TestShardedQueries(unittest.TestCase):
+    """Параллельные запросы совпадают с последовательными"""
+
+    def test_matches_serial_results(self):
+        """Случайный каталог, несколько шардов, обновление после изменений"""
+        service = ManufacturingService(*make_random_catalog(3))
+        with ShardedQueryExecutor(service, shard_count=3, max_workers=2) as executor:
+            for _ in range(2):
+                self.assertEqual(executor.get_details_by_manufacturer(),
+                                 service.get_details_by_manufacturer())
+                self.assertEqual(list(executor.iter_details_by_manufacturer()),
+                                 service.get_details_by_manufacturer())
+                self.assertEqual(executor.get_total_price_by_manufacturer(),
+                                 service.get_total_price_by_manufacturer())
+                self.assertEqual(executor.get_department_manufacturers_with_details(),
+                                 service.get_department_manufacturers_with_details())
+
+                detail = service.details[0]
+                service.update_detail(Detail(detail.detail_id, detail.detail_name,
+                                             detail.price, detail.manufacturer_id + 1))
+                manufacturer = service.manufacturers[0]
+                service.update_manufacturer(Manufacturer(manufacturer.manufacturer_id,
+                                                         manufacturer.manufacturer_name + " №2"))
+                executor.refresh()
+
+    def test_empty_catalog(self):
+        """Пустой каталог"""
+        with ShardedQueryExecutor(ManufacturingService([], [], []), shard_count=2) as executor:
+            self.assertEqual(executor.get_details_by_manufacturer(), [])
+            self.assertEqual(executor.get_total_price_by_manufacturer(), [])
+
+
+class TestRelationsAndIntegrity(unittest.TestCase):
+    """Тесты выбора отношения в запросах и проверки целостности"""
+
+    def setUp(self):
+        """Настройка тестовых данных перед каждым тестом"""
+        self.data = get_sample_data()
+        self.service = ManufacturingService(*self.data)
+
+    def test_queries_by_relation(self):
+        """Запросы по таблице связей и по Detail.manufacturer_id различаются"""
+        totals = dict(self.service.get_total_price_by_manufacturer(Relation.LINKS))
+        self.assertAlmostEqual(totals["Электротехнический отдел"], 6.30)
+        self.assertAlmostEqual(totals["Производитель электронных компонентов"], 256.30)
+
+        rows = self.service.get_details_by_manufacturer(Relation.LINKS)
+        self.assertEqual(len(rows), 12)
+        self.assertIn(("Электротехнический отдел", "Резистор 100 Ом", 2.50), rows)
+
+        department = self.service.get_department_manufacturers_with_details(Relation.OWNERSHIP)
+        self.assertEqual(department["Электротехнический отдел"], [])
+        self.assertEqual(len(department["Отдел металлообработки"]), 3)
+
+    def test_views_match_service(self):
+        """Хеш-соединения дают те же группы, что и индексы сервиса"""
+        for relation in Relation:
+            view = group_details(*self.data, relation=relation)
+            expected = self.service.get_manufacturers_with_details_matching("", relation)
+            for manufacturer in self.data[0]:
+                self.assertEqual(
+                    sorted((d.detail_name, d.price)
+                           for d in view.get(manufacturer.manufacturer_id, [])),
+                    sorted(expected[manufacturer.manufacturer_name]))
+        self.assertEqual(len(list(join_details(*self.data, relation=Relation.LINKS))), 12)
+        self.assertEqual(len(list(join_details(*self.data))), 10)
+
+    def test_integrity_of_sample_data(self):
+        """В тестовых данных детали 5 и 6 связаны с чужим производителем"""
+        report = check_integrity(*self.data)
+        self.assertEqual(report.conflicting_links, [(3, 5), (3, 6)])
+        self.assertFalse(report.is_consistent)
+        self.assertEqual(sum(report.summary().values()), 2)
+
+    def test_integrity_problems(self):
+        """Висячие ID, повторы и детали без связи"""
+        manufacturers = [Manufacturer(1, "А"), Manufacturer(1, "Б")]
+        details = [Detail(1, "a", 1.0, 1), Detail(1, "b", 1.0, 1), Detail(2, "c", 1.0, 9)]
+        links = [ManufacturerDetail(1, 1), ManufacturerDetail(1, 1),
+                 ManufacturerDetail(7, 1), ManufacturerDetail(1, 3)]
+        report = check_integrity(manufacturers, details, links)
+
+        self.assertEqual(report.duplicate_manufacturer_ids, [1])
+        self.assertEqual(report.duplicate_detail_ids, [1])
+        self.assertEqual(report.details_with_unknown_manufacturer, [2])
+        self.assertEqual(report.duplicate_links, [(1, 1)])
+        self.assertEqual(report.links_with_unknown_manufacturer, [(7, 1)])
+        self.assertEqual(report.links_with_unknown_detail, [(1, 3)])
+        self.assertEqual(report.conflicting_links, [(7, 1)])
+        self.assertEqual(report.details_without_own_link, [2])
+        self.assertTrue(check_integrity([], [], []).is_consistent)
+
+
+class TestLoaders(unittest.TestCase):
+    """Тесты потоковой загрузки из CSV и JSON Lines"""
+
+    def setUp(self):
+        """Временный каталог для файлов"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        """Путь к файлу во временном каталоге"""
+        return os.path.join(self.directory.name, name)
+
+    def write_csv(self, name, records):
+        """Записывает dataclass-записи в CSV"""
+        with open(self.path(name), "w", encoding="utf-8", newline="") as stream:
+            writer = csv.DictWriter(stream, fieldnames=list(vars(records[0])))
+            writer.writeheader()
+            writer.writerows(vars(record) for record in records)
+        return self.path(name)
+
+    def write_jsonl(self, name, records, opener=open):
+        """Записывает dataclass-записи в JSON Lines"""
+        with opener(self.path(name), "wt", encoding="utf-8") as stream:
+            for record in records:
+                stream.write(json.dumps(vars(record), ensure_ascii=False) + "\n")
+        return self.path(name)
+
+    def test_load_matches_sample_service(self):
+        """Сервис из CSV, JSONL и JSONL.gz совпадает с сервисом из списков"""
+        manufacturers, details, manufacturer_details = get_sample_data()
+        service = load_service(
+            self.write_csv("manufacturers.csv", manufacturers),
+            self.write_jsonl("details.jsonl", details),
+            self.write_jsonl("links.jsonl.gz", manufacturer_details, opener=gzip.open),
+        )
+        expected = ManufacturingService(manufacturers, details, manufacturer_details)
+
+        self.assertEqual(service.get_details_by_manufacturer(),
+                         expected.get_details_by_manufacturer())
+        self.assertEqual(service.get_total_price_by_manufacturer(),
+                         expected.get_total_price_by_manufacturer())
+        self.assertEqual(service.get_department_manufacturers_with_details(),
+                         expected.get_department_manufacturers_with_details())
+
+    def test_invalid_lines_are_reported(self):
+        """Ошибки типов, полей, JSON и повторные ID сообщаются с номером строки"""
+        path = self.path("details.jsonl")
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write('{"detail_id": 1, "detail_name": "Болт", "price": 10, "manufacturer_id": 1}\n')
+            stream.write('{"detail_id": "2", "detail_name": "Гайка", "price": 1.5, "manufacturer_id": 1}\n')
+            stream.write('{"detail_id": 3, "detail_name": "Шайба", "manufacturer_id": 1}\n')
+            stream.write('{"detail_id": 4,\n')
+            stream.write('{"detail_id": 1, "detail_name": "Болт", "price": 10, "manufacturer_id": 1}\n')
+
+        errors = []
+        service = ManufacturingService([], [], [])
+        self.assertEqual(load_into(service, path, Detail, on_error=errors.append), 1)
+        self.assertEqual([error.line_number for error in errors], [2, 3, 4, 5])
+        self.assertIsInstance(service.get_detail(1).price, float)
+
+        with self.assertRaises(LoadError) as context:
+            list(iter_records(path, Detail))
+        self.assertEqual(context.exception.line_number, 2)
+
+    def test_csv_type_validation(self):
+        """Строки CSV с некорректными числами"""
+        path = self.path("manufacturers.csv")
+        with open(path, "w", encoding="utf-8", newline="") as stream:
+            stream.write("manufacturer_id,manufacturer_name\n1,Отдел\nx,Цех\n")
+
+        errors = []
+        records = list(iter_records(path, Manufacturer, on_error=errors.append))
+        self.assertEqual(records, [(2, Manufacturer(1, "Отдел"))])
+        self.assertEqual(errors[0].line_number, 3)
+
+    def test_non_finite_prices_and_bom(self):
+        """NaN и бесконечные цены отклоняются с номером строки, BOM в начале файла пропускается"""
+        path = self.path("details.csv")
+        with open(path, "w", encoding="utf-8-sig", newline="") as stream:
+            stream.write("detail_id,detail_name,price,manufacturer_id\n1,Болт,10,1\n"
+                         "2,Гайка,nan,1\n3,Шайба,-inf,1\n4,Винт,1e999,1\n")
+        errors = []
+        records = list(iter_records(path, Detail, on_error=errors.append))
+        self.assertEqual(records, [(2, Detail(1, "Болт", 10.0, 1))])
+        self.assertEqual([error.line_number for error in errors], [3, 4, 5])
+        self.assertIn("поле 'price'", errors[0].message)
+
+        path = self.path("details.jsonl")
+        with open(path, "w", encoding="utf-8-sig") as stream:
+            stream.write('{"detail_id": 1, "detail_name": "Болт", "price": 10, "manufacturer_id": 1}\n')
+            stream.write('{"detail_id": 2, "detail_name": "Гайка", "price": NaN, "manufacturer_id": 1}\n')
+            stream.write('{"detail_id": 3, "detail_name": "Шайба", "price": Infinity, "manufacturer_id": 1}\n')
+        errors = []
+        service = ManufacturingService([], [], [])
+        self.assertEqual(load_into(service, path, Detail, on_error=errors.append), 1)
+        self.assertEqual([error.line_number for error in errors], [2, 3])
+
+    def test_encoding_and_csv_errors_are_per_line(self):
+        """Байты не в UTF-8 и ошибки CSV сообщаются по строкам и не прерывают загрузку"""
+        path = self.path("manufacturers.csv")
+        with open(path, "wb") as stream:
+            stream.write("manufacturer_id,manufacturer_name\n1,Отдел\n".encode("utf-8"))
+            stream.write(b"2,\xff\xfe\n")
+            stream.write('3,"Цех\nсборки"\n'.encode("utf-8"))
+            stream.write(b"4,a\rb\n")
+            stream.write("5,Склад\n".encode("utf-8"))
+        errors = []
+        records = list(iter_records(path, Manufacturer, on_error=errors.append))
+        self.assertEqual(records, [(2, Manufacturer(1, "Отдел")),
+                                   (5, Manufacturer(3, "Цех\nсборки")),
+                                   (7, Manufacturer(5, "Склад"))])
+        self.assertEqual([error.line_number for error in errors], [3, 6])
+        self.assertIn("UTF-8", errors[0].message)
+        self.assertIn("CSV", errors[1].message)
+
+        path = self.path("details.jsonl.gz")
+        with gzip.open(path, "wb") as stream:
+            stream.write(b'{"detail_id": 1, "detail_name": "\xff", "price": 1, "manufacturer_id": 1}\n')
+            stream.write(b'{"detail_id": 2, "detail_name": "ok", "price": 1, "manufacturer_id": 1}\n')
+        errors = []
+        service = ManufacturingService([], [], [])
+        self.assertEqual(load_into(service, path, Detail, on_error=errors.append), 1)
+        self.assertEqual([error.line_number for error in errors], [1])
+        with self.assertRaises(LoadError) as context:
+            list(iter_records(path, Detail))
+        self.assertEqual(context.exception.line_number, 1)
+
+class TestCompactRecords(unittest.TestCase):
+    """Тесты компактных вариантов записей"""
+
+    def test_service_accepts_compact_records(self):
+        """Сервис дает те же результаты на компактных записях"""
+        expected = ManufacturingService(*get_sample_data())
+        for frozen in (False, True):
+            service = ManufacturingService(*to_compact(*get_sample_data(), frozen=frozen))
+            self.assertEqual(service.get_details_by_manufacturer(),
+                             expected.get_details_by_manufacturer())
+            self.assertEqual(service.get_total_price_by_manufacturer(),
+                             expected.get_total_price_by_manufacturer())
+            self.assertEqual(service.get_department_manufacturers_with_details(),
+                             expected.get_department_manufacturers_with_details())
+
+    def test_slots_and_frozen(self):
+        """У записей нет __dict__, замороженные записи хешируемы и неизменяемы"""
+        detail = SlottedDetail(1, "Болт", 1.0, 1)
+        frozen = FrozenDetail(1, "Болт", 1.0, 1)
+
+        self.assertFalse(hasattr(detail, "__dict__"))
+        self.assertFalse(hasattr(frozen, "__dict__"))
+        self.assertEqual(len({frozen, FrozenDetail(1, "Болт", 1.0, 1)}), 1)
+        with self.assertRaises(AttributeError):
+            frozen.price = 2.0
+
+    def test_names_are_shared(self):
+        """Одинаковые названия деталей ссылаются на один объект"""
+        pool = NamePool()
+        details = [Detail(i, "".join(["Бол", "т"]), 1.0, 1) for i in range(3)]
+        _, compact, _ = to_compact([], details, [], pool=pool)
+
+        self.assertIs(compact[0].detail_name, compact[2].detail_name)
+        self.assertEqual(len(pool), 1)
+
+
+class TestBenchmarkTools(unittest.TestCase):
+    """Тесты генератора данных и сравнения с базовыми результатами"""
+
+    def test_generate_catalog_shape(self):
+        """Размеры, связи и длина названий соответствуют параметрам"""
+        manufacturers, details, links = generate_catalog(
+            manufacturer_count=50, details_per_manufacturer=20, link_fanout=2.0,
+            name_length=40, skew=1.5, seed=7)
+
+        self.assertEqual(len(manufacturers), 50)
+        self.assertEqual(len(details), 1000)
+        self.assertEqual(len(links), 2000)
+        self.assertTrue(all(len(m.manufacturer_name) == 40 for m in manufacturers))
+        owners = [d.manufacturer_id for d in details]
+        self.assertGreater(owners.count(1), owners.count(50))
+        self.assertEqual(generate_catalog(seed=7), generate_catalog(seed=7))
+
+    def test_percentile(self):
+        """Перцентили по ближайшему рангу"""
+        samples = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(samples, 0.5), 3)
+        self.assertEqual(percentile(samples, 0.99), 5)
+        self.assertEqual(percentile(samples, 0.0), 1)
+
+    def test_compare_with_baseline(self):
+        """Замедление выше порога обнаруживается, короткие замеры игнорируются"""
+        baseline = {"sizes": {"1000": {"q1": {"p50_s": 0.010, "loops": 10},
+                                       "q2": {"p50_s": 0.0001},
+                                       "q4": {"p50_s": 0.0001, "loops": 1000}}}}
+        current = {"sizes": {"1000": {"q1": {"p50_s": 0.014}, "q2": {"p50_s": 0.001},
+                                      "q3": {"p50_s": 1.0}, "q4": {"p50_s": 0.00011}}}}
+        self.assertEqual(compare_with_baseline(current, baseline, threshold=0.5), [])
+        regressions = compare_with_baseline(current, baseline, threshold=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("q1 @ 1000"))
+        regressions = compare_with_baseline(current, baseline, threshold=0.05)
+        self.assertEqual([line.split()[0] for line in regressions], ["q1", "q4"])
+
+    def test_measure_autoranges_fast_calls(self):
+        """Быстрый вызов выполняется в замере много раз"""
+        stats = measure(lambda: 3, repeats=2)
+        self.assertGreater(stats["loops"], 1)
+        self.assertEqual((stats["repeats"], stats["rows"]), (2, 3))
+        self.assertLess(stats["p50_s"], 0.01)
+
+
+class TestSnapshotFormat(unittest.TestCase):
+    """Снимок в mmap отвечает так же, как исходный сервис"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "catalog.snap")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_snapshot(self, service, **options):
+        write_snapshot(service, self.path)
+        snapshot = SnapshotService(self.path, **options)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_queries_match_service(self):
+        """Все три запроса совпадают на образце и на случайных каталогах"""
+        catalogs = [get_sample_data()] + [make_random_catalog(seed) for seed in range(5)]
+        for data in catalogs:
+            service = ManufacturingService(*data)
+            with self.subTest(manufacturers=len(data[0])):
+                write_snapshot(service, self.path)
+                with SnapshotService(self.path) as snapshot:
+                    self.assertEqual(snapshot.get_details_by_manufacturer(),
+                                     service.get_details_by_manufacturer())
+                    self.assertEqual(snapshot.get_total_price_by_manufacturer(),
+                                     service.get_total_price_by_manufacturer())
+                    self.assertEqual(snapshot.get_department_manufacturers_with_details(),
+                                     service.get_department_manufacturers_with_details())
+
+    def test_lookups_and_owned_details(self):
+        """Поиск по ID и детали производителя берутся из готовых индексов"""
+        service = ManufacturingService(*make_random_catalog(7))
+        snapshot = self.open_snapshot(service)
+        for manufacturer in service.manufacturers:
+            self.assertEqual(snapshot.get_manufacturer(manufacturer.manufacturer_id), manufacturer)
+            expected = sorted((d for d in service.details
+                               if d.manufacturer_id == manufacturer.manufacturer_id),
+                              key=lambda d: d.detail_id)
+            self.assertEqual(list(snapshot.iter_owned_details(manufacturer.manufacturer_id)),
+                             expected)
+        for detail in service.details:
+            self.assertEqual(snapshot.get_detail(detail.detail_id), detail)
+        self.assertIsNone(snapshot.get_manufacturer(10 ** 6))
+        self.assertIsNone(snapshot.get_detail(-1))
+
+    def test_to_service_round_trip(self):
+        """Изменяемый сервис из снимка содержит те же записи"""
+        service = ManufacturingService(*make_random_catalog(3))
+        restored = self.open_snapshot(service).to_service()
+        self.assertEqual(restored.manufacturers, service.manufacturers)
+        self.assertEqual(restored.details, service.details)
+        self.assertEqual(restored.get_department_manufacturers_with_details(),
+                         service.get_department_manufacturers_with_details())
+
+    def test_corruption_is_detected(self):
+        """Испорченные данные, сигнатура и версия отклоняются"""
+        write_snapshot(ManufacturingService(*get_sample_data()), self.path)
+        with open(self.path, "rb") as stream:
+            original = bytearray(stream.read())
+
+        for position, label in ((len(original) - 1, "контрольная сумма"),
+                                (0, "сигнатура"), (8, "версия")):
+            corrupted = bytearray(original)
+            corrupted[position] ^= 0xFF
+            with open(self.path, "wb") as stream:
+                stream.write(corrupted)
+            with self.subTest(label), self.assertRaises(SnapshotError):
+                SnapshotService(self.path)
+
+        for size, label in ((len(original) - 8, "обрезанные данные"),
+                            (10, "обрезанный заголовок"), (0, "пустой файл")):
+            with open(self.path, "wb") as stream:
+                stream.write(original[:size])
+            with self.subTest(label), self.assertRaises(SnapshotError):
+                SnapshotService(self.path, verify=False)
+
+    def test_corrupt_section_table_without_verify(self):
+        """Без проверки crc32 испорченная таблица секций дает SnapshotError"""
+        write_snapshot(ManufacturingService(*get_sample_data()), self.path)
+        with open(self.path, "rb") as stream:
+            original = bytearray(stream.read())
+        # Заголовок "<8sIIIIQ" (32 байта), затем секции "<16s4sQQ" (36 байт)
+        section_count = struct.unpack_from("<I", original, 12)[0]
+        patches = [("число секций", 12, "<I", 10 ** 9),
+                   ("код типа", 32 + 16, "<4s", b"Z"),
+                   ("смещение", 32 + 20, "<Q", len(original)),
+                   ("число элементов", 32 + 28, "<Q", 10 ** 12),
+                   ("смещение в таблице", 32 + 36 * (section_count - 1) + 20, "<Q", 8)]
+        for label, position, layout, value in patches:
+            corrupted = bytearray(original)
+            struct.pack_into(layout, corrupted, position, value)
+            with open(self.path, "wb") as stream:
+                stream.write(corrupted)
+            with self.subTest(label), self.assertRaises(SnapshotError):
+                SnapshotService(self.path, verify=False).close()
+
+    def test_close_with_unfinished_iterator(self):
+        """close() не мешает незавершенный итератор деталей"""
+        snapshot = self.open_snapshot(ManufacturingService(*get_sample_data()))
+        details = snapshot.iter_owned_details(2)
+        self.assertEqual(next(details).detail_name, "Болт М8")
+        snapshot.close()
+        with self.assertRaises(ValueError):
+            next(details)
+
+
+def make_random_changes(service, seed, count=200):
+    """Случайные допустимые изменения; применяются к service по мере создания"""
+    rng = random.Random(seed)
+    changes = []
+    for _ in range(count):
+        manufacturers, details = service.manufacturers, service.details
+        links = service.manufacturer_details
+        table = rng.choice(["manufacturers", "details", "details", "links"])
+        kind = rng.choice(list(ChangeKind))
+        if table == "manufacturers":
+            if kind is ChangeKind.INSERT or not manufacturers:
+                manufacturer_id = max([m.manufacturer_id for m in manufacturers], default=0) + 1
+                change = Change(ChangeKind.INSERT, table, Manufacturer(
+                    manufacturer_id, rng.choice(["Отдел", "Цех"]) + f" {manufacturer_id}"))
+            elif kind is ChangeKind.UPDATE:
+                old = rng.choice(manufacturers)
+                change = Change(kind, table, Manufacturer(
+                    old.manufacturer_id, rng.choice(["Отдел", "Цех"]) + f" {rng.random()}"))
+            else:
+                change = Change(kind, table, rng.choice(manufacturers).manufacturer_id)
+        elif table == "details":
+            if kind is ChangeKind.INSERT or not details:
+                detail_id = max([d.detail_id for d in details], default=0) + 1
+                change = Change(ChangeKind.INSERT, table, Detail(
+                    detail_id, f"Деталь {detail_id}", rng.randint(0, 40) / 4, rng.randint(1, 45)))
+            elif kind is ChangeKind.UPDATE:
+                old = rng.choice(details)
+                change = Change(kind, table, Detail(
+                    old.detail_id, old.detail_name, rng.randint(0, 40) / 4,
+                    rng.choice([old.manufacturer_id, rng.randint(1, 45)])))
+            else:
+                change = Change(kind, table, rng.choice(details).detail_id)
+        elif kind is ChangeKind.DELETE and links:
+            change = Change(kind, table, rng.choice(links))
+        else:
+            change = Change(ChangeKind.INSERT, table,
+                            ManufacturerDetail(rng.randint(1, 45), rng.randint(1, 1000)))
+        service.apply_change(change)
+        changes.append(change)
+    return changes
+
+
+class TestChangeLog(unittest.TestCase):
+    """Пакеты изменений и их воспроизведение дают то же, что сборка с нуля"""
+
+    def assert_same_service(self, actual, expected):
+        """Одинаковые записи и результаты всех запросов"""
+        self.assertEqual(actual.manufacturers, expected.manufacturers)
+        self.assertEqual(actual.details, expected.details)
+        self.assertEqual(actual.manufacturer_details, expected.manufacturer_details)
+        self.assertEqual(actual.get_details_by_manufacturer(),
+                         expected.get_details_by_manufacturer())
+        self.assertEqual(actual.get_total_price_by_manufacturer(),
+                         expected.get_total_price_by_manufacturer())
+        self.assertEqual(actual.get_department_manufacturers_with_details(),
+                         expected.get_department_manufacturers_with_details())
+
+    def test_batch_matches_fresh_build(self):
+        """После пакета изменений сервис совпадает с собранным из итоговых списков"""
+        for seed in range(5):
+            data = make_random_catalog(seed)
+            changes = make_random_changes(ManufacturingService(*data), seed)
+            for incremental_totals in (False, True):
+                with self.subTest(seed=seed, incremental_totals=incremental_totals):
+                    service = ManufacturingService(*data, incremental_totals=incremental_totals)
+                    service.get_details_by_manufacturer()  # индексы запроса 1 уже построены
+                    self.assertEqual(service.apply_changes(changes), len(changes))
+                    fresh = ManufacturingService(service.manufacturers, service.details,
+                                                 service.manufacturer_details)
+                    self.assert_same_service(service, fresh)
+
+    def test_snapshot_plus_replay(self):
+        """Снимок и журнал после него восстанавливают текущее состояние"""
+        data = make_random_catalog(11)
+        service = ManufacturingService(*data)
+        changes = make_random_changes(ManufacturingService(*data), 11, count=300)
+        with tempfile.TemporaryDirectory() as directory:
+            log = ChangeLog(os.path.join(directory, "changes.jsonl"))
+            log.apply(service, changes[:100])
+            snapshot_path = os.path.join(directory, "catalog.snap")
+            write_snapshot(service, snapshot_path, log_position=len(log))
+            log.apply(service, changes[100:])
+
+            stored_log = ChangeLog.load(log.path)
+            self.assertEqual(list(stored_log), changes)
+            with SnapshotService(snapshot_path) as snapshot:
+                restored = snapshot.to_service()
+                self.assertEqual(snapshot.log_position, 100)
+                stored_log.replay(restored, start=snapshot.log_position)
+        self.assert_same_service(restored, service)
+
+        replayed = ManufacturingService(*data)
+        log.replay(replayed)
+        self.assert_same_service(replayed, service)
+
+    def test_failed_change_is_not_logged(self):
+        """В журнал попадают только примененные изменения"""
+        service = ManufacturingService(*get_sample_data())
+        log = ChangeLog()
+        changes = [
+            Change(ChangeKind.UPDATE, "details", Detail(1, "Болт М10", 20.00, 1)),
+            Change(ChangeKind.DELETE, "details", 100),
+            Change(ChangeKind.INSERT, "links", ManufacturerDetail(1, 2)),
+        ]
+        with self.assertRaises(KeyError):
+            log.apply(service, changes)
+        self.assertEqual(list(log), changes[:1])
+        self.assertEqual(service.get_detail(1).price, 20.00)
+        with self.assertRaises(ValueError):
+            service.apply_change(Change(ChangeKind.UPDATE, "links", ManufacturerDetail(1, 1)))
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Измерения запросов передаются приемникам и не меняют результаты"""
+
+    def test_sinks_receive_phases_and_rows(self):
+        """Каждый запрос дает измерение с фазами и числом строк"""
+        collected = []
+        log = io.StringIO()
+        histogram = HistogramSink()
+        instrumentation = Instrumentation([histogram, JsonLogSink(log),
+                                           CallbackSink(collected.append)])
+        service = ManufacturingService(*get_sample_data(), instrumentation=instrumentation)
+        plain = ManufacturingService(*get_sample_data())
+
+        self.assertEqual(service.get_details_by_manufacturer(),
+                         plain.get_details_by_manufacturer())
+        self.assertEqual(service.get_total_price_by_manufacturer(),
+                         plain.get_total_price_by_manufacturer())
+        self.assertEqual(service.get_department_manufacturers_with_details(),
+                         plain.get_department_manufacturers_with_details())
+
+        self.assertEqual([stats.query for stats in collected], [
+            "build", "get_details_by_manufacturer", "get_total_price_by_manufacturer",
+            "get_department_manufacturers_with_details"])
+        self.assertEqual([stats.rows for stats in collected], [10, 10, 5, 4])
+        self.assertEqual(set(collected[1].phases), {"sort", "materialize"})
+        self.assertEqual(set(collected[2].phases), {"aggregate", "sort"})
+        for stats in collected:
+            self.assertGreaterEqual(stats.seconds, sum(stats.phases.values()))
+
+        records = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual([record["query"] for record in records],
+                         [stats.query for stats in collected])
+        self.assertIn("materialize", records[1]["phase_blocks"])
+        self.assertIn("get_total_price_by_manufacturer", histogram.report())
+
+    def test_lazy_queries_are_recorded(self):
+        """Ленивые и постраничные запросы тоже дают измерения"""
+        collected = []
+        service = ManufacturingService(*get_sample_data(), instrumentation=Instrumentation(
+            [CallbackSink(collected.append)]))
+        plain = ManufacturingService(*get_sample_data())
+
+        self.assertEqual(list(service.iter_details_by_manufacturer()),
+                         list(plain.iter_details_by_manufacturer()))
+        self.assertEqual(next(service.iter_total_price_by_manufacturer()),
+                         next(plain.iter_total_price_by_manufacturer()))
+        self.assertEqual(dict(service.iter_department_manufacturers_with_details()),
+                         dict(plain.iter_department_manufacturers_with_details()))
+        self.assertEqual(len(list(service.iter_manufacturers_with_details_matching("отдел"))), 4)
+        self.assertEqual(service.page_details_by_manufacturer(3),
+                         plain.page_details_by_manufacturer(3))
+        self.assertEqual(service.count_details_by_manufacturer(), 10)
+
+        self.assertEqual([(stats.query, stats.rows) for stats in collected[1:]], [
+            ("iter_details_by_manufacturer", 10),
+            ("iter_total_price_by_manufacturer", 1),
+            ("iter_department_manufacturers_with_details", 4),
+            ("iter_manufacturers_with_details_matching", 4),
+            ("page_details_by_manufacturer", 3),
+            ("count_details_by_manufacturer", 1)])
+
+    def test_histogram_percentiles(self):
+        """Перцентили берутся по верхним границам корзин"""
+        histogram = HistogramSink()
+        for seconds in [0.000003] * 9 + [0.001]:
+            histogram._add("запрос", "total", seconds)
+        self.assertEqual(histogram.histogram("запрос"), {4.0: 9, 1024.0: 1})
+        self.assertEqual(histogram.percentile("запрос", 0.5), 4e-6)
+        self.assertEqual(histogram.percentile("запрос", 0.99), 1024e-6)
+        self.assertEqual(histogram.percentile("нет", 0.5), 0.0)
+
+    def test_sink_is_abstract(self):
+        """Приемник без emit() нельзя создать"""
+        class Incomplete(Sink):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+        self.assertEqual(CallbackSink(print).callback, print)
+
+    def test_profiling_wrappers(self):
+        """Обертки cProfile и tracemalloc возвращают результат запроса и пишут отчет"""
+        service = ManufacturingService(*get_sample_data())
+        for wrapper in (profile_call, trace_allocations):
+            report = io.StringIO()
+            result = wrapper(service.get_total_price_by_manufacturer, stream=report)
+            self.assertEqual(result, service.get_total_price_by_manufacturer())
+            self.assertTrue(report.getvalue())
+
+    def test_trace_allocations_resets_peak(self):
+        """Пик памяти считается только для переданной функции"""
+        tracemalloc.start()
+        try:
+            buffer = bytearray(10 * 1024 * 1024)
+            del buffer
+            report = io.StringIO()
+            trace_allocations(lambda: None, stream=report)
+        finally:
+            tracemalloc.stop()
+        peak = float(report.getvalue().split()[2])
+        self.assertLess(peak, 1024)
+
+
+class TestPriceQueries(unittest.TestCase):
+    """Ценовые запросы совпадают с полным перебором и после изменений"""
+
+    def assert_matches_scan(self, service):
+        details = service.details
+        for manufacturer_id in range(0, 46):
+            expected = sorted((d for d in details if d.manufacturer_id == manufacturer_id),
+                              key=lambda d: (-d.price, d.detail_id))
+            for k in (0, 1, 3, 100):
+                self.assertEqual(service.get_most_expensive_details(manufacturer_id, k),
+                                 expected[:k])
+        by_price = sorted(details, key=lambda d: (d.price, d.detail_id))
+        for low, high in ((0, 10), (2.5, 2.5), (3.25, 7.75), (8, 2), (-1, 0)):
+            self.assertEqual(service.get_details_in_price_range(low, high),
+                             [d for d in by_price if low <= d.price <= high])
+        self.assertEqual(service.get_details_in_price_range(0, 10, limit=5), by_price[:5])
+        ranked = service.get_total_price_by_manufacturer()
+        for threshold in (-1.0, 0.0, 10.0, 37.5, 1000.0):
+            self.assertEqual(service.get_manufacturers_with_total_above(threshold),
+                             [row for row in ranked if row[1] > threshold])
+
+    def test_random_mutations(self):
+        """Вставка, переоценка, перенос и удаление деталей обновляют индексы"""
+        for seed in range(4):
+            data = make_random_catalog(seed)
+            changes = make_random_changes(ManufacturingService(*data), seed, count=150)
+            for incremental_totals in (False, True):
+                with self.subTest(seed=seed, incremental_totals=incremental_totals):
+                    service = ManufacturingService(*data, incremental_totals=incremental_totals)
+                    self.assert_matches_scan(service)
+                    for start in range(0, len(changes), 30):
+                        service.apply_changes(changes[start:start + 30])
+                        self.assert_matches_scan(service)
+
+    def test_sample_data(self):
+        """Самые дорогие детали и диапазон цен на образце"""
+        service = ManufacturingService(*get_sample_data())
+        self.assertEqual([d.detail_name for d in service.get_most_expensive_details(4, 2)],
+                         ["Микроконтроллер ATmega328", "Конденсатор 10мкФ"])
+        self.assertEqual([d.price for d in service.get_details_in_price_range(5.0, 12.0)],
+                         [5.2, 7.5, 8.3, 12.0])
+        self.assertEqual(service.get_manufacturers_with_total_above(100.0), [
+            ("Производитель электронных компонентов", 256.30),
+            ("Основной производственный отдел", 165.00)])
+
+
+class TestReportRenderer(unittest.TestCase):
+    """Потоковые отчеты совпадают с результатами запросов"""
+
+    def setUp(self):
+        self.service = ManufacturingService(*make_random_catalog(5))
+
+    def test_text_matches_task_printers(self):
+        """Текст совпадает с выводом task*_functional, в том числе кусками"""
+        printed = io.StringIO()
+        with redirect_stdout(printed):
+            for task in (task1_functional, task2_functional, task3_functional):
+                task(self.service)
+        for chunk_size in (1, 100, 1 << 16):
+            stream = io.StringIO()
+            written = render_reports(self.service, stream, chunk_size=chunk_size)
+            self.assertEqual(stream.getvalue(), printed.getvalue())
+            self.assertEqual(written, len(printed.getvalue()))
+
+    def test_duck_typed_text_streams(self):
+        """Обертки над stdout без базового класса io получают str"""
+        class Tee:
+            def __init__(self, *streams):
+                self.streams = streams
+
+            def write(self, text):
+                for stream in self.streams:
+                    stream.write(text)
+                return len(text)
+
+            def flush(self):
+                pass
+
+        first, second = io.StringIO(), io.StringIO()
+        with redirect_stdout(Tee(first, second)):
+            task2_functional(self.service)
+        expected = io.StringIO()
+        render_reports(self.service, expected, reports=(2,))
+        self.assertEqual(first.getvalue(), expected.getvalue())
+        self.assertEqual(second.getvalue(), expected.getvalue())
+
+        stream = io.StringIO()
+        render_reports(self.service, Tee(stream), "csv", reports=(2,))
+        self.assertEqual(stream.getvalue().splitlines()[0], ",".join(CSV_HEADER))
+        binary = io.BytesIO()
+        render_reports(self.service, Tee(binary), "csv", reports=(2,), binary=True)
+        self.assertEqual(binary.getvalue().decode("utf-8"), stream.getvalue())
+
+    def test_csv_and_jsonl_rows(self):
+        """Строки CSV и JSONL содержат результаты всех трех запросов"""
+        department = self.service.get_department_manufacturers_with_details()
+        stream = io.StringIO()
+        render_reports(self.service, stream, "csv")
+        rows = list(csv.reader(io.StringIO(stream.getvalue())))
+        self.assertEqual(tuple(rows[0]), CSV_HEADER)
+        self.assertEqual([(m, d, float(p)) for r, m, d, p, _ in rows if r == "1"],
+                         self.service.get_details_by_manufacturer())
+        self.assertEqual([(m, float(t)) for r, m, _, _, t in rows if r == "2"],
+                         self.service.get_total_price_by_manufacturer())
+        self.assertEqual(len([row for row in rows if row[0] == "3"]),
+                         sum(max(1, len(details)) for details in department.values()))
+
+        stream = io.BytesIO()
+        render_reports(self.service, stream, "jsonl", reports=(2, 3))
+        records = [json.loads(line) for line in stream.getvalue().decode("utf-8").splitlines()]
+        self.assertEqual([(r["manufacturer"], r["total"]) for r in records if r["report"] == 2],
+                         self.service.get_total_price_by_manufacturer())
+        self.assertEqual({r["manufacturer"]: [tuple(d) for d in r["details"]]
+                          for r in records if r["report"] == 3}, department)
+
+    def test_write_to_file_and_errors(self):
+        """Запись в файл и отказ для неизвестных формата и отчета"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.csv")
+            written = write_reports(self.service, path, "csv", reports=(1,))
+            with open(path, encoding="utf-8", newline="") as stream:
+                self.assertEqual(len(stream.read()), written)
+        with self.assertRaises(ValueError):
+            render_reports(self.service, io.StringIO(), "xml")
+        with self.assertRaises(ValueError):
+            render_reports(self.service, io.StringIO(), reports=(4,))
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    """SQLite и память дают одинаковые записи и результаты запросов"""
+
+    def assert_equivalent(self, sqlite_service, service):
+        self.assertEqual(sqlite_service.manufacturers, service.manufacturers)
+        self.assertEqual(sqlite_service.details, service.details)
+        self.assertEqual(sqlite_service.manufacturer_details, service.manufacturer_details)
+        for relation in Relation:
+            self.assertEqual(sqlite_service.get_details_by_manufacturer(relation),
+                             service.get_details_by_manufacturer(relation))
+            self.assertEqual(sqlite_service.get_total_price_by_manufacturer(relation),
+                             service.get_total_price_by_manufacturer(relation))
+            self.assertEqual(sqlite_service.get_department_manufacturers_with_details(relation),
+                             service.get_department_manufacturers_with_details(relation))
+        self.assertEqual(sqlite_service.get_top_manufacturers_by_total(3),
+                         service.get_top_manufacturers_by_total(3))
+        for manufacturer_id in (1, 7, 40):
+            self.assertEqual(sqlite_service.get_manufacturer(manufacturer_id),
+                             service.get_manufacturer(manufacturer_id))
+            self.assertEqual(sqlite_service.get_manufacturer_stats(manufacturer_id),
+                             service.get_manufacturer_stats(manufacturer_id))
+
+    def test_sample_and_empty_data(self):
+        """Образец и пустой каталог"""
+        for data in (get_sample_data(), ([], [], [])):
+            with SQLiteManufacturingService(*data) as sqlite_service:
+                self.assert_equivalent(sqlite_service, ManufacturingService(*data))
+
+    def test_random_catalogs_and_changes(self):
+        """Случайные каталоги, загруженные малыми пакетами, и одинаковые изменения"""
+        for seed in range(4):
+            data = make_random_catalog(seed)
+            changes = make_random_changes(ManufacturingService(*data), seed, count=150)
+            with self.subTest(seed=seed), \
+                    SQLiteManufacturingService(*data, batch_size=7) as sqlite_service:
+                service = ManufacturingService(*data)
+                self.assert_equivalent(sqlite_service, service)
+                for start in range(0, len(changes), 50):
+                    sqlite_service.apply_changes(changes[start:start + 50])
+                    service.apply_changes(changes[start:start + 50])
+                    self.assert_equivalent(sqlite_service, service)
+
+    def test_file_database_is_reopened(self):
+        """Данные в файле сохраняются между соединениями"""
+        data = make_random_catalog(9)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "catalog.db")
+            with SQLiteManufacturingService(*data, path=path) as sqlite_service:
+                sqlite_service.update_detail(Detail(data[1][0].detail_id, "Новая", 1.0, 1))
+            service = ManufacturingService(*data)
+            service.update_detail(Detail(data[1][0].detail_id, "Новая", 1.0, 1))
+            with SQLiteManufacturingService(path=path) as reopened:
+                self.assert_equivalent(reopened, service)
+
+    def test_errors_match_service(self):
+        """Те же исключения, что и у сервиса в памяти"""
+        with SQLiteManufacturingService(*get_sample_data()) as sqlite_service:
+            with self.assertRaises(ValueError):
+                sqlite_service.add_manufacturer(Manufacturer(1, "Дубликат"))
+            with self.assertRaises(ValueError):
+                sqlite_service.add_detail(Detail(1, "Дубликат", 1.0, 1))
+            with self.assertRaises(ValueError) as context:
+                sqlite_service.load(details=[Detail(1, "Дубликат", 1.0, 1)])
+            self.assertIn("Повторяющийся ID", str(context.exception))
+            with self.assertRaises(sqlite3.IntegrityError) as context:
+                sqlite_service.load(details=[Detail(100, None, 1.0, 1)])
+            self.assertIn("NOT NULL", str(context.exception))
+            with self.assertRaises(sqlite3.IntegrityError):
+                sqlite_service.add_detail(Detail(100, "Без цены", None, 1))
+            with self.assertRaises(KeyError):
+                sqlite_service.update_detail(Detail(100, "Нет", 1.0, 1))
+            with self.assertRaises(KeyError):
+                sqlite_service.remove_link(1, 1)
+            with self.assertRaises(KeyError):
+                sqlite_service.remove_manufacturer(100)
+            self.assertEqual(len(sqlite_service.details), 10)
+
+    def test_load_commits_each_batch(self):
+        """Каждый пакет загрузки - отдельная транзакция: пакеты до ошибки остаются"""
+        details = [Detail(detail_id, f"Деталь {detail_id}", 1.0, 1) for detail_id in range(1, 8)]
+        details.append(Detail(2, "Дубликат", 1.0, 1))
+        with SQLiteManufacturingService(batch_size=3) as sqlite_service:
+            with self.assertRaises(ValueError):
+                sqlite_service.load(details=details)
+            self.assertEqual([detail.detail_id for detail in sqlite_service.details],
+                             [1, 2, 3, 4, 5, 6])
+
+
+class TestRunAllReports(unittest.TestCase):
+    """run_all_reports совпадает с отдельными запросами 1-3"""
+
+    def assert_matches_queries(self, service, pattern="отдел"):
+        self.assertEqual(service.run_all_reports(pattern), Reports(
+            service.get_details_by_manufacturer(),
+            service.get_total_price_by_manufacturer(),
+            service.get_manufacturers_with_details_matching(pattern)))
+
+    def test_sample_and_empty_data(self):
+        """Образец, пустой каталог и другой шаблон"""
+        service = ManufacturingService(*get_sample_data())
+        self.assert_matches_queries(service)
+        self.assert_matches_queries(service, "ПРОИЗВОД")
+        self.assert_matches_queries(service, "нет такого")
+        self.assert_matches_queries(ManufacturingService([], [], []))
+
+    def test_random_catalogs_and_changes(self):
+        """Случайные каталоги и изменения с обычными и инкрементальными суммами"""
+        for seed in range(4):
+            data = make_random_catalog(seed)
+            changes = make_random_changes(ManufacturingService(*data), seed, count=150)
+            for incremental_totals in (False, True):
+                with self.subTest(seed=seed, incremental_totals=incremental_totals):
+                    service = ManufacturingService(*data, incremental_totals=incremental_totals)
+                    self.assert_matches_queries(service)
+                    for start in range(0, len(changes), 50):
+                        service.apply_changes(changes[start:start + 50])
+                        self.assert_matches_queries(service)
+                        self.assert_matches_queries(service, "цех")
+
+    def test_phases_are_recorded(self):
+        """Измеряются фазы общего прохода и число строк всех отчетов"""
+        stats = []
+        service = ManufacturingService(*get_sample_data(),
+                                       instrumentation=Instrumentation([CallbackSink(stats.append)]))
+        service.run_all_reports()
+        self.assertEqual(stats[-1].query, "run_all_reports")
+        self.assertEqual(list(stats[-1].phases), ["details", "manufacturers", "sort"])
+        self.assertEqual(stats[-1].rows, 10 + 5 + 4)
+
+
+def query_results(service):
+    """Результаты запросов 1-3 по обоим отношениям и ценовых запросов"""
+    return ([(service.get_details_by_manufacturer(relation),
+              service.get_total_price_by_manufacturer(relation),
+              service.get_department_manufacturers_with_details(relation))
+             for relation in Relation],
+            service.get_top_manufacturers_by_total(5),
+            service.get_details_in_price_range(2.5, 7.5),
+            service.get_most_expensive_details(7, 3),
+            service.find_manufacturers("цех"),
+            service.get_data_version())
+
+
+class TestVersionedService(unittest.TestCase):
+    """Версии сервиса не меняются после публикации и согласованы при конкурентной записи"""
+
+    def test_fork_matches_changes_in_place(self):
+        """fork дает то же, что изменения на месте, и не меняет исходную версию"""
+        for seed in range(4):
+            data = make_random_catalog(seed)
+            changes = make_random_changes(ManufacturingService(*data), seed, count=150)
+            for incremental_totals in (False, True):
+                with self.subTest(seed=seed, incremental_totals=incremental_totals):
+                    expected = ManufacturingService(*data, incremental_totals=incremental_totals)
+                    version = ManufacturingService(*data, incremental_totals=incremental_totals)
+                    for start in range(0, len(changes), 25):
+                        before = query_results(version)  # строит и ленивые индексы
+                        batch = changes[start:start + 25]
+                        forked = version.fork(batch)
+                        expected.apply_changes(batch)
+                        self.assertEqual(query_results(version), before)
+                        self.assertEqual(query_results(forked), query_results(expected))
+                        version = forked
+
+    def test_snapshot_survives_writes(self):
+        """Взятая версия и начатый ленивый запрос не видят новых изменений"""
+        versioned = VersionedManufacturingService(ManufacturingService(*get_sample_data()))
+        snapshot = versioned.snapshot()
+        before = query_results(snapshot)
+        rows = snapshot.iter_details_by_manufacturer()
+        first = next(rows)
+        versioned.apply_changes([Change(ChangeKind.DELETE, "details", detail_id)
+                                 for detail_id in range(1, 11)])
+        versioned.apply_changes([Change(ChangeKind.UPDATE, "manufacturers",
+                                        Manufacturer(1, "Цех 1"))])
+        self.assertEqual([first] + list(rows), before[0][0][0])
+        self.assertEqual(query_results(snapshot), before)
+        self.assertEqual(versioned.read(lambda service: service.details), [])
+        self.assertEqual(len(versioned.snapshot().get_department_manufacturers_with_details()), 3)
+
+    def test_versions_are_read_only(self):
+        """Запись в версию, общую с другими, отклоняется и не портит их"""
+        service = ManufacturingService(*get_sample_data())
+        version = service.fork([Change(ChangeKind.INSERT, "links", ManufacturerDetail(1, 1))])
+        before = query_results(service)
+        writes = [
+            lambda target: target.add_detail(Detail(99, "Новая", 1.0, 1)),
+            lambda target: target.update_detail(Detail(1, "Новая", 1.0, 1)),
+            lambda target: target.remove_detail(1),
+            lambda target: target.add_manufacturer(Manufacturer(99, "Новый")),
+            lambda target: target.update_manufacturer(Manufacturer(1, "Новый")),
+            lambda target: target.remove_manufacturer(5),
+            lambda target: target.add_link(ManufacturerDetail(2, 2)),
+            lambda target: target.remove_link(1, 1),
+            lambda target: target.apply_changes([Change(ChangeKind.DELETE, "details", 1)]),
+        ]
+        for target in (service, version):
+            self.assertTrue(target.read_only)
+            for write in writes:
+                with self.assertRaises(ReadOnlyServiceError):
+                    write(target)
+        self.assertEqual(query_results(service), before)
+        self.assertIsNone(version.get_detail(99))
+        self.assertIsNotNone(version.get_manufacturer(5))
+        # Следующая версия строится через fork и не меняет предыдущие
+        third = version.fork([Change(ChangeKind.INSERT, "details", Detail(99, "Новая", 1.0, 1))])
+        self.assertIsNone(service.get_detail(99))
+        self.assertIsNone(version.get_detail(99))
+        self.assertEqual(third.get_detail(99), Detail(99, "Новая", 1.0, 1))
+
+        versioned = VersionedManufacturingService(ManufacturingService(*get_sample_data()))
+        with self.assertRaises(ReadOnlyServiceError):
+            versioned.snapshot().add_detail(Detail(99, "Новая", 1.0, 1))
+        versioned.apply_changes([Change(ChangeKind.DELETE, "details", 1)])
+        with self.assertRaises(ReadOnlyServiceError):
+            versioned.snapshot().remove_manufacturer(5)
+
+    def test_failed_batch_is_not_published(self):
+        """Пакет с ошибкой не публикуется ни частично, ни целиком"""
+        versioned = VersionedManufacturingService(ManufacturingService(*get_sample_data()))
+        snapshot = versioned.snapshot()
+        with self.assertRaises(KeyError):
+            versioned.apply_changes([
+                Change(ChangeKind.INSERT, "details", Detail(11, "Новая", 1.0, 1)),
+                Change(ChangeKind.DELETE, "details", 100),
+            ])
+        self.assertIs(versioned.snapshot(), snapshot)
+        self.assertIsNone(snapshot.get_detail(11))
+
+    def test_concurrent_readers_and_writers(self):
+        """Читатели всегда видят согласованную версию, пока писатели публикуют новые"""
+        def writer(service_wrapper, writer_id, errors):
+            rng = random.Random(writer_id)
+            own_ids = []
+            try:
+                for step in range(60):
+                    detail_id = 10000 * (writer_id + 1) + step
+                    batch = [Change(ChangeKind.INSERT, "details", Detail(
+                        detail_id, f"Деталь {detail_id}", rng.randint(0, 40) / 4,
+                        rng.randint(1, 45)))]
+                    own_ids.append(detail_id)
+                    if len(own_ids) > 5:
+                        batch.append(Change(ChangeKind.UPDATE, "details", Detail(
+                            own_ids[0], "Перенесенная", rng.randint(0, 40) / 4,
+                            rng.randint(1, 45))))
+                        batch.append(Change(ChangeKind.DELETE, "details", own_ids.pop(1)))
+                    batch.append(Change(ChangeKind.INSERT, "links",
+                                        ManufacturerDetail(rng.randint(1, 45), detail_id)))
+                    service_wrapper.apply_changes(batch)
+            except Exception as error:  # pragma: no cover - сообщается в основном потоке
+                errors.append(error)
+
+        def reader(service_wrapper, stop, errors, checks):
+            try:
+                while not stop.is_set():
+                    results, rebuilt = service_wrapper.read(
+                        lambda service: (query_results(service)[0], ManufacturingService(
+                            service.manufacturers, service.details,
+                            service.manufacturer_details)))
+                    if results != query_results(rebuilt)[0]:
+                        errors.append(AssertionError("несогласованная версия"))
+                    checks.append(1)
+            except Exception as error:  # pragma: no cover
+                errors.append(error)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        try:
+            for wrapper_type in (VersionedManufacturingService, LockedManufacturingService):
+                with self.subTest(wrapper=wrapper_type.__name__):
+                    wrapper = wrapper_type(ManufacturingService(*make_random_catalog(5)))
+                    stop, errors, checks = threading.Event(), [], []
+                    readers = [threading.Thread(target=reader, args=(wrapper, stop, errors, checks))
+                               for _ in range(4)]
+                    writers = [threading.Thread(target=writer, args=(wrapper, writer_id, errors))
+                               for writer_id in range(2)]
+                    for thread in readers + writers:
+                        thread.start()
+                    for thread in writers:
+                        thread.join()
+                    stop.set()
+                    for thread in readers:
+                        thread.join()
+                    self.assertEqual(errors, [])
+                    self.assertGreater(len(checks), 0)
+                    self.assertEqual(len(wrapper.read(lambda service: service.details)), 300 + 2 * 5)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+
+def reference_query(service, relation, outer, aggregates=None, manufacturer_ids=None,
+                    name_contains=None, detail_ids=None, price_between=None):
+    """Строки запроса полным перебором списков сервиса (столбцы по умолчанию)"""
+    details_by_id = {detail.detail_id: detail for detail in service.details}
+    rows = []
+    for manufacturer in service.manufacturers:
+        if manufacturer_ids is not None and manufacturer.manufacturer_id not in manufacturer_ids:
+            continue
+        if name_contains is not None and \
+                fold_case(name_contains) not in fold_case(manufacturer.manufacturer_name):
+            continue
+        if relation is Relation.OWNERSHIP:
+            related = [detail for detail in service.details
+                       if detail.manufacturer_id == manufacturer.manufacturer_id]
+        else:
+            related = [details_by_id[link.detail_id] for link in service.manufacturer_details
+                       if link.manufacturer_id == manufacturer.manufacturer_id
+                       and link.detail_id in details_by_id]
+        related = [detail for detail in related
+                   if (price_between is None or price_between[0] <= detail.price <= price_between[1])
+                   and (detail_ids is None or detail.detail_id in detail_ids)]
+        head = (manufacturer.manufacturer_id, manufacturer.manufacturer_name)
+        if aggregates is None:
+            rows += [head + (detail.detail_id, detail.detail_name, detail.price)
+                     for detail in related]
+            if outer and not related:
+                rows.append(head + (None, None, None))
+            continue
+        if not related and not outer:
+            continue
+        values = []
+        for aggregate in aggregates.values():
+            if isinstance(aggregate, Sum):
+                values.append(sum((getattr(d, aggregate.column) for d in related), 0.0))
+            elif isinstance(aggregate, Count):
+                values.append(len(related))
+            elif isinstance(aggregate, Collect):
+                if len(aggregate.columns) == 1:
+                    values.append([getattr(d, aggregate.columns[0]) for d in related])
+                else:
+                    values.append([tuple(getattr(d, column) for column in aggregate.columns)
+                                   for d in related])
+            else:
+                prices = [getattr(d, aggregate.column) for d in related]
+                values.append((min if isinstance(aggregate, Min) else max)(prices, default=None))
+        rows.append(head + tuple(values))
+    return rows
+
+
+def normalized(rows):
+    """Строки с отсортированными списками и в отсортированном порядке"""
+    return sorted((tuple(sorted(value) if isinstance(value, list) else value for value in row)
+                   for row in rows), key=repr)
+
+
+class TestQueryPlanner(unittest.TestCase):
+    """Декларативные запросы совпадают с запросами сервиса и полным перебором"""
+
+    def test_service_queries_are_reproduced(self):
+        """Запросы 1-3 через слой запросов дают те же результаты, и после изменений"""
+        for seed in range(3):
+            data = make_random_catalog(seed)
+            service = ManufacturingService(*data)
+            changes = make_random_changes(ManufacturingService(*data), seed, count=100)
+            for batch in (changes[:0], changes[:50], changes[50:]):
+                service.apply_changes(batch)
+                for relation in Relation:
+                    with self.subTest(seed=seed, relation=relation):
+                        self.assertEqual(details_by_manufacturer_query(service, relation).run(),
+                                         service.get_details_by_manufacturer(relation))
+                        self.assertEqual(total_price_by_manufacturer_query(service, relation).run(),
+                                         service.get_total_price_by_manufacturer(relation))
+                        for pattern in ("отдел", "цех", "ОТД"):
+                            self.assertEqual(
+                                dict(manufacturers_with_details_matching_query(
+                                    service, pattern, relation).run()),
+                                service.get_manufacturers_with_details_matching(pattern, relation))
+
+    def test_random_queries_match_reference(self):
+        """Случайные фильтры, группировки, сортировки и ограничения"""
+        aggregate_choices = [Sum(), Count(), Min(), Max("detail_id"), Collect("detail_id")]
+        for seed in range(6):
+            rng = random.Random(seed)
+            service = ManufacturingService(*make_random_catalog(seed))
+            if seed % 2:
+                service.get_details_in_price_range(0, 0)  # построение индекса цен
+            for _ in range(60):
+                relation = rng.choice(list(Relation))
+                outer = rng.random() < 0.3
+                filters = {}
+                if rng.random() < 0.3:
+                    filters["manufacturer_ids"] = rng.sample(range(1, 45), rng.randint(0, 10))
+                if rng.random() < 0.3:
+                    filters["name_contains"] = rng.choice(["отдел", "ЦЕХ", "1", "нет"])
+                if rng.random() < 0.3:
+                    filters["detail_ids"] = rng.sample(range(1, 1000), rng.randint(0, 40))
+                if rng.random() < 0.5:
+                    low = rng.randint(0, 40) / 4
+                    filters["price_between"] = (low, low + rng.choice([0, 0.5, 2, 10]))
+                aggregates = None
+                if rng.random() < 0.5:
+                    aggregates = {f"a{position}": aggregate for position, aggregate in
+                                  enumerate(rng.sample(aggregate_choices, rng.randint(1, 3)))}
+
+                query = Query(service).join(relation, outer).where(**filters)
+                if aggregates is not None:
+                    query = query.group_by(**aggregates)
+                columns = ["manufacturer_id", "manufacturer_name"] + (
+                    list(aggregates) if aggregates is not None
+                    else ["detail_id", "detail_name", "price"])
+                ordering = [rng.choice(["", "-"]) + column
+                            for column in rng.sample(columns, rng.randint(0, 2))]
+                if ordering:
+                    query = query.order_by(*ordering)
+                limit = rng.choice([None, None, 0, 1, 5])
+                if limit is not None:
+                    query = query.limit(limit)
+                expected = reference_query(service, relation, outer, aggregates, **filters)
+
+                with self.subTest(seed=seed, plan=query.explain()):
+                    result = query.run()
+                    if limit is None:
+                        self.assertEqual(normalized(result), normalized(expected))
+                    else:
+                        self.assertEqual(len(result), min(limit, len(expected)))
+                    if ordering:
+                        def key(row):
+                            return tuple((row[columns.index(column.lstrip("-"))] is not None,
+                                          row[columns.index(column.lstrip("-"))])
+                                         for column in ordering)
+                        for column in reversed(ordering):
+                            position = columns.index(column.lstrip("-"))
+                            expected.sort(key=lambda row: (row[position] is not None, row[position]),
+                                          reverse=column.startswith("-"))
+                        self.assertEqual([key(row) for row in result],
+                                         [key(row) for row in expected[:len(result)]])
+
+    def test_planner_choices(self):
+        """План выбирает индексы по статистике и показывается в explain()"""
+        service = ManufacturingService(*make_random_catalog(1, detail_count=600))
+        self.assertIn("Просмотр всех производителей", Query(service).explain())
+        self.assertIn("Сортировка не нужна",
+                      details_by_manufacturer_query(service).explain())
+        self.assertIn("поиск по ID", Query(service).where(manufacturer_ids=[3]).explain())
+        self.assertIn("поиск по триграммам 'отдел'",
+                      Query(service).where(name_contains="отдел").explain())
+        self.assertIn("Поиск деталей по ID", Query(service).where(detail_ids=[5, 7]).explain())
+        # Пока индекс цен не построен, узкий диапазон проверяется фильтром
+        narrow = Query(service).where(price_between=(2.5, 2.5))
+        self.assertIn("Фильтр деталей", narrow.explain())
+        service.get_details_in_price_range(0, 0)
+        self.assertIn("индекса цен", narrow.explain())
+        self.assertIn("Хеш-соединение", narrow.explain())
+        self.assertIn("Хеш-таблица деталей", narrow.join(Relation.LINKS).explain())
+        # Широкий диапазон дешевле проверить при обходе групп
+        self.assertNotIn("индекса цен",
+                         Query(service).where(price_between=(0, 10)).explain())
+        self.assertIn("def execute(", narrow.explain(verbose=True))
+
+    def test_statistics_accessors(self):
+        """Планировщик не строит индекс цен ради оценки"""
+        service = ManufacturingService(*get_sample_data())
+        self.assertIsNone(service.count_details_in_price_range(2, 8, build_index=False))
+        Query(service).where(price_between=(2, 8)).plan()
+        self.assertIsNone(service.count_details_in_price_range(2, 8, build_index=False))
+        self.assertEqual(service.count_details_in_price_range(2, 8), 4)
+        self.assertEqual(service.count_details_in_price_range(2, 8, build_index=False), 4)
+        self.assertEqual(service.get_group_size(3, Relation.OWNERSHIP), 0)
+        self.assertEqual(service.get_group_size(3, Relation.LINKS), 2)
+        self.assertEqual(service.get_group_size(99, Relation.LINKS), 0)
+
+    def test_invalid_queries(self):
+        """Неизвестные столбцы, агрегаты и отрицательное ограничение"""
+        service = ManufacturingService(*get_sample_data())
+        with self.assertRaises(ValueError):
+            Query(service).select("total").run()
+        with self.assertRaises(ValueError):
+            Query(service).group_by(total=Sum()).order_by("price").run()
+        with self.assertRaises(ValueError):
+            Query(service).group_by(total=Sum("manufacturer_name")).run()
+        with self.assertRaises(ValueError):
+            Query(service).group_by(total=Sum("detail_name")).plan()
+        with self.assertRaises(TypeError):
+            Query(service).group_by(total=sum).run()
+        with self.assertRaises(ValueError):
+            Query(service).limit(-1).run()
+
+
+@unittest.skipIf(arrow_io is None, "pyarrow не установлен")
+class TestArrowExport(unittest.TestCase):
+    """Таблицы Arrow и файлы Arrow/Parquet совпадают с данными сервиса"""
+
+    @staticmethod
+    def table_rows(table):
+        return list(zip(*(column.to_pylist() for column in table.columns)))
+
+    def test_query_tables(self):
+        """Запросы 1 и 2 таблицами совпадают со списками кортежей"""
+        catalogs = [get_sample_data(), ([], [], [])] + [make_random_catalog(seed)
+                                                        for seed in range(3)]
+        for position, data in enumerate(catalogs):
+            for incremental_totals in (False, True):
+                service = ManufacturingService(*data, incremental_totals=incremental_totals)
+                for relation in Relation:
+                    with self.subTest(catalog=position, relation=relation):
+                        table = arrow_io.details_by_manufacturer_table(service, relation)
+                        self.assertEqual(table.column_names,
+                                         ["manufacturer_name", "detail_name", "price"])
+                        self.assertEqual(self.table_rows(table),
+                                         service.get_details_by_manufacturer(relation))
+                        self.assertEqual(
+                            self.table_rows(arrow_io.total_price_by_manufacturer_table(
+                                service, relation)),
+                            service.get_total_price_by_manufacturer(relation))
+
+    def test_catalog_round_trip(self):
+        """Каталог после изменений переживает запись и чтение во всех форматах"""
+        for seed in range(3):
+            data = make_random_catalog(seed)
+            service = ManufacturingService(*data)
+            service.apply_changes(make_random_changes(ManufacturingService(*data), seed))
+            with tempfile.TemporaryDirectory() as directory:
+                for suffix in arrow_io.FORMATS:
+                    with self.subTest(seed=seed, suffix=suffix):
+                        paths = arrow_io.export_catalog(service, directory, suffix, batch_size=64)
+                        self.assertEqual(sorted(paths), sorted(arrow_io.SCHEMAS))
+                        restored = arrow_io.import_catalog(directory, suffix,
+                                                           incremental_totals=True)
+                        self.assertEqual(restored.manufacturers, service.manufacturers)
+                        self.assertEqual(restored.details, service.details)
+                        self.assertEqual(restored.manufacturer_details,
+                                         service.manufacturer_details)
+                        for relation in Relation:
+                            self.assertEqual(restored.get_total_price_by_manufacturer(relation),
+                                             service.get_total_price_by_manufacturer(relation))
+
+                        path = os.path.join(directory, "details_by_manufacturer" + suffix)
+                        arrow_io.write_table(arrow_io.details_by_manufacturer_table(service),
+                                             path, batch_size=50)
+                        self.assertEqual(self.table_rows(arrow_io.read_table(path)),
+                                         service.get_details_by_manufacturer())
+
+    @unittest.skipIf(ColumnarManufacturingService is None, "NumPy не установлен")
+    def test_columnar_service_from_tables(self):
+        """Колоночный сервис по таблицам отвечает как сервис в памяти"""
+        for data in (get_sample_data(), ([], [], []), make_random_catalog(4)):
+            service = ManufacturingService(*data)
+            with tempfile.TemporaryDirectory() as directory:
+                arrow_io.export_catalog(service, directory, ".arrow", batch_size=32)
+                tables = {name: arrow_io.read_table(os.path.join(directory, name + ".arrow"))
+                          for name in arrow_io.SCHEMAS}
+                columnar = arrow_io.columnar_service_from_tables(tables)
+                self.assertEqual(columnar.get_details_by_manufacturer(),
+                                 service.get_details_by_manufacturer())
+                self.assertEqual(columnar.get_total_price_by_manufacturer(),
+                                 service.get_total_price_by_manufacturer())
+                self.assertEqual(columnar.get_department_manufacturers_with_details(),
+                                 service.get_department_manufacturers_with_details())
+
+    def test_invalid_input(self):
+        """Неизвестное расширение, недостающие столбцы и пустые значения"""
+        import pyarrow as pa
+        service = ManufacturingService(*get_sample_data())
+        tables = arrow_io.catalog_tables(service)
+        with self.assertRaises(ValueError):
+            arrow_io.write_table(tables["details"], "catalog.csv")
+        with self.assertRaises(ValueError):
+            arrow_io.export_catalog(service, "catalog", ".csv")
+        with self.assertRaises(ValueError):
+            arrow_io.service_from_tables(dict(tables, details=tables["details"].drop(["price"])))
+        prices = pa.array([None] + tables["details"].column("price").to_pylist()[1:],
+                          pa.float64())
+        with self.assertRaises(ValueError):
+            arrow_io.service_from_tables(
+                dict(tables, details=tables["details"].set_column(2, "price", prices)))
+        # Столбцы приводятся к схеме: порядок и целые цены допустимы
+        details = tables["details"].select(["price", "manufacturer_id", "detail_name", "detail_id"])
+        details = details.set_column(0, "price", details.column("price").cast(pa.int64(), safe=False))
+        restored = arrow_io.service_from_tables(dict(tables, details=details))
+        self.assertEqual([detail.price for detail in restored.details],
+                         [float(int(detail.price)) for detail in service.details])
+
+
+def reprice(service, scenario):
+    """Версия сервиса (fork), в которой цены сценария записаны через update_detail"""
+    prices = {}
+    for transform in scenario.transforms:
+        if transform.relation is Relation.OWNERSHIP:
+            detail_ids = [detail.detail_id for detail in service.details
+                          if detail.manufacturer_id == transform.manufacturer_id]
+        else:
+            detail_ids = [detail_id for detail_id in
+                          service.get_manufacturer_to_details().get(transform.manufacturer_id, [])
+                          if service.get_detail(detail_id) is not None]
+        for detail_id in dict.fromkeys(detail_ids):
+            price = prices.get(detail_id, service.get_detail(detail_id).price)
+            prices[detail_id] = (price * transform.factor if isinstance(transform, Markup)
+                                 else price + transform.amount)
+    return service.fork([
+        Change(ChangeKind.UPDATE, "details",
+               Detail(detail_id, service.get_detail(detail_id).detail_name, price,
+                      service.get_detail(detail_id).manufacturer_id))
+        for detail_id, price in prices.items()])
+
+
+def make_random_scenarios(seed, count=20, manufacturer_count=20):
+    rng = random.Random(seed)
+    scenarios = []
+    for number in range(count):
+        transforms = []
+        for _ in range(rng.randint(0, 3)):
+            manufacturer_id = rng.randint(1, manufacturer_count + 3)
+            relation = rng.choice(list(Relation))
+            if rng.random() < 0.5:
+                transforms.append(Markup(manufacturer_id, rng.choice([0.5, 1.5, 2.0, 0.0]),
+                                         relation))
+            else:
+                transforms.append(Surcharge(manufacturer_id, rng.choice([0.25, 1.0, -0.5]),
+                                            relation))
+        scenarios.append(Scenario(f"сценарий {number}", transforms))
+    return scenarios
+
+
+class TestScenarios(unittest.TestCase):
+    """Сценарии цен совпадают с пересчетом копии каталога и не меняют сервис"""
+
+    def test_random_scenarios_match_repriced_catalog(self):
+        """Рейтинги и запросы 1 и 3 по новым ценам для пакета случайных сценариев"""
+        for seed in range(3):
+            data = make_random_catalog(seed)
+            service = ManufacturingService(*data)
+            service.apply_changes(make_random_changes(ManufacturingService(*data), seed))
+            before = query_results(service)
+            engine = ScenarioEngine(service)
+            scenarios = make_random_scenarios(seed)
+            for relation in Relation:
+                results = engine.evaluate_batch(scenarios, relation)
+                self.assertEqual([result.scenario for result in results], scenarios)
+                for result in results:
+                    repriced = reprice(service, result.scenario)
+                    with self.subTest(seed=seed, relation=relation, scenario=result.scenario):
+                        self.assertEqual(result.ranked_totals(),
+                                         repriced.get_total_price_by_manufacturer(relation))
+                        self.assertEqual(result.top(3),
+                                         repriced.get_total_price_by_manufacturer(relation)[:3])
+                        for query_relation in Relation:
+                            self.assertEqual(
+                                result.details_by_manufacturer(query_relation),
+                                repriced.get_details_by_manufacturer(query_relation))
+                            for pattern in ("отдел", "цех"):
+                                self.assertEqual(
+                                    result.manufacturers_with_details_matching(pattern,
+                                                                               query_relation),
+                                    repriced.get_manufacturers_with_details_matching(
+                                        pattern, query_relation))
+            self.assertEqual(query_results(service), before)
+
+    def test_empty_scenario_and_unknown_manufacturer(self):
+        """Без затронутых деталей результаты совпадают с каталогом"""
+        service = ManufacturingService(*get_sample_data())
+        engine = ScenarioEngine(service)
+        for scenario in (Scenario("пустой", []), Scenario("нет такого", [Markup(99, 2.0)])):
+            result = engine.evaluate(scenario)
+            self.assertEqual(result.prices, {})
+            self.assertEqual(result.ranked_totals(), service.get_total_price_by_manufacturer())
+            self.assertEqual(result.details_by_manufacturer(),
+                             service.get_details_by_manufacturer())
+
+    def test_transforms_apply_in_order(self):
+        """Наценка после надбавки и надбавка после наценки дают разные цены"""
+        service = ManufacturingService(*get_sample_data())
+        engine = ScenarioEngine(service)
+        price = service.get_detail(1).price
+        first = engine.evaluate(Scenario("a", [Surcharge(2, 1.0, Relation.OWNERSHIP),
+                                               Markup(2, 2.0)]))
+        second = engine.evaluate(Scenario("b", [Markup(2, 2.0),
+                                                Surcharge(2, 1.0, Relation.OWNERSHIP)]))
+        self.assertEqual(first.prices[1], (price + 1.0) * 2.0)
+        self.assertEqual(second.prices[1], price * 2.0 + 1.0)
+        with self.assertRaises(TypeError):
+            Scenario("c", [("наценка", 2, 1.07)])
+
+    def test_service_changes(self):
+        """После изменения сервиса старые результаты устаревают, новые видят изменения"""
+        service = ManufacturingService(*get_sample_data())
+        engine = ScenarioEngine(service)
+        result = engine.evaluate(Scenario("наценка", [Markup(2, 1.5)]))
+        service.add_detail(Detail(100, "Новая", 1000.0, 4))
+        with self.assertRaises(ValueError):
+            result.ranked_totals()
+        with self.assertRaises(ValueError):
+            result.details_by_manufacturer()
+        result = engine.evaluate(Scenario("наценка", [Markup(2, 1.5)]))
+        self.assertEqual(result.ranked_totals(),
+                         reprice(service, result.scenario).get_total_price_by_manufacturer())
+
+
 class TestDataStructures(unittest.TestCase):
     """Тесты для структур данных"""
 
@@ -164,6 +2189,29 @@ def run_tests():
 
     # Добавляем тесты
     suite.addTests(loader.loadTestsFromTestCase(TestManufacturingService))
+    suite.addTests(loader.loadTestsFromTestCase(TestServiceIndexes))
+    suite.addTests(loader.loadTestsFromTestCase(TestIncrementalTotals))
+    suite.addTests(loader.loadTestsFromTestCase(TestManufacturerNameSearch))
+    suite.addTests(loader.loadTestsFromTestCase(TestColumnarStorage))
+    suite.addTests(loader.loadTestsFromTestCase(TestLazyQueries))
+    suite.addTests(loader.loadTestsFromTestCase(TestQueryCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestAsyncService))
+    suite.addTests(loader.loadTestsFromTestCase(TestShardedQueries))
+    suite.addTests(loader.loadTestsFromTestCase(TestRelationsAndIntegrity))
+    suite.addTests(loader.loadTestsFromTestCase(TestLoaders))
+    suite.addTests(loader.loadTestsFromTestCase(TestCompactRecords))
+    suite.addTests(loader.loadTestsFromTestCase(TestBenchmarkTools))
+    suite.addTests(loader.loadTestsFromTestCase(TestSnapshotFormat))
+    suite.addTests(loader.loadTestsFromTestCase(TestChangeLog))
+    suite.addTests(loader.loadTestsFromTestCase(TestInstrumentation))
+    suite.addTests(loader.loadTestsFromTestCase(TestPriceQueries))
+    suite.addTests(loader.loadTestsFromTestCase(TestReportRenderer))
+    suite.addTests(loader.loadTestsFromTestCase(TestSQLiteBackend))
+    suite.addTests(loader.loadTestsFromTestCase(TestRunAllReports))
+    suite.addTests(loader.loadTestsFromTestCase(TestVersionedService))
+    suite.addTests(loader.loadTestsFromTestCase(TestQueryPlanner))
+    suite.addTests(loader.loadTestsFromTestCase(TestArrowExport))
+    suite.addTests(loader.loadTestsFromTestCase(TestScenarios))
     suite.addTests(loader.loadTestsFromTestCase(TestDataStructures))
 
     # Запускаем тесты
@@ -0,0 +1,69 @@
+"""
+Версии ManufacturingService для чтения из многих потоков без блокировок
+Опубликованная версия сервиса больше не изменяется: писатель строит
+следующую версию через ManufacturingService.fork() и публикует ее одним
+присваиванием ссылки, а читатели выполняют запросы над версией, взятой
+в начале чтения
+"""
+
+import threading
+from typing import Callable, Iterable, TypeVar
+
+from refactored_manufacturing import ManufacturingService, Change
+
+Result = TypeVar("Result")
+
+
+class VersionedManufacturingService:
+    """Неизменяемые версии сервиса с публикацией новой версии на запись
+
+    snapshot() возвращает текущую версию без блокировок; любые запросы к
+    ней, в том числе ленивые итераторы, видят одно согласованное
+    состояние, сколько бы версий ни было опубликовано после. Версии
+    только для чтения (переданный сервис тоже замораживается): методы
+    add_*/update_*/remove_* вызывают ReadOnlyServiceError, изменения
+    передаются в apply_changes(). Писатели выполняются по одному;
+    пакет публикуется целиком или, при ошибке, не публикуется.
+    """
+
+    def __init__(self, service: ManufacturingService):
+        service.freeze()
+        self._current = service
+        self._write_lock = threading.Lock()
+
+    def snapshot(self) -> ManufacturingService:
+        """Текущая версия сервиса"""
+        return self._current
+
+    def read(self, query: Callable[[ManufacturingService], Result]) -> Result:
+        """Выполняет query над текущей версией"""
+        return query(self._current)
+
+    def apply_changes(self, changes: Iterable[Change]) -> int:
+        """Строит версию с пакетом изменений и публикует ее, возвращает размер пакета"""
+        changes = list(changes)
+        with self._write_lock:
+            # Присваивание ссылки атомарно: читатель видит старую или новую версию
+            self._current = self._current.fork(changes)
+        return len(changes)
+
+
+class LockedManufacturingService:
+    """Изменяемый сервис под общей блокировкой: чтения и записи по очереди
+
+    Базовый вариант для сравнения с VersionedManufacturingService.
+    """
+
+    def __init__(self, service: ManufacturingService):
+        self._service = service
+        self._lock = threading.Lock()
+
+    def read(self, query: Callable[[ManufacturingService], Result]) -> Result:
+        """Выполняет query под блокировкой"""
+        with self._lock:
+            return query(self._service)
+
+    def apply_changes(self, changes: Iterable[Change]) -> int:
+        """Применяет пакет изменений под блокировкой"""
+        with self._lock:
+            return self._service.apply_changes(changes)